@@ -39,6 +39,7 @@ def str2action(action: str, setting_name: str = None) -> 'Action':
      shutter:shutter_name:operation[/operation_on_release_long_press]
      plug:plug_name:on|off[/on|off <- operation_on_release_long_press][:sends=XX <- send command amount, default is 3]
      light:light_name:on|off[/brightness=XX][/white=XX][/transition=XXX][/secondary_state=on|off][/secondary_brightness=XX][/secondary_white=XX][/secondary_transition=XX]
+     scene:scene_name[/secondary_scene_name] <- lighting scene defined in lights.ini
      webhook:url <- example: http://example.com/?mywebhook
      alarm:on|off|0|1|2|3|4|5|6|7|8|9
      sleep[:rabbit_name]
@@ -82,6 +83,8 @@ def str2action(action: str, setting_name: str = None) -> 'Action':
         return PlugAction(action_name, action_data)
     elif action_type == 'light':
         return LightAction(action_name, action_data)
+    elif action_type == 'scene':
+        return SceneAction(action_name, action_data)
     elif action_type == 'webhook':
         return WebhookAction(action_name_and_data, None)
     elif action_type == 'alarm':
@@ -96,7 +99,7 @@ def str2action(action: str, setting_name: str = None) -> 'Action':
         return TaichiAction(action_name, action_data)
     else:
         raise ValueError('Unknown action type for "{}", expecting {}, got "{}"'.format(
-        setting_name, 'scenario|shutter|plug|webhook|sleep|weather|airquality|taichi', action_type))
+        setting_name, 'scenario|shutter|plug|light|scene|webhook|alarm|sleep|weather|airquality|taichi', action_type))
 
 class Action:
     '''
@@ -269,18 +272,37 @@ class LightAction(Action):
                 self.secondary_transition = self.transition
     def run(self, event_type = None, rabbit = None, secondary_action: bool = False):
         if not secondary_action or self.secondary_enabled:
-            for light in self.lights:
-                lights.switch(
-                    light,
-                    on=((self.secondary_state if secondary_action else self.state) == 'on'),
-                    brightness=(self.secondary_brightness if secondary_action else self.brightness),
-                    white=(self.secondary_white if secondary_action else self.white),
-                    transition=(self.secondary_transition if secondary_action else self.transition)
-                )
+            lights.switch_many(
+                self.lights,
+                on=((self.secondary_state if secondary_action else self.state) == 'on'),
+                brightness=(self.secondary_brightness if secondary_action else self.brightness),
+                white=(self.secondary_white if secondary_action else self.white),
+                transition=(self.secondary_transition if secondary_action else self.transition)
+            )
     def __repr__(self):
         return 'LightAction(Light: {}, State: {}, Brightness: {}, White: {}, Transition: {})'.format(
           ', '.join(self.lights), self.state, self.brightness, self.white, self.transition)
 
+class SceneAction(Action):
+    '''
+    Apply a lighting scene, switching all its lights at once
+    '''
+    def __init__(self, name: str, data: str = None):
+        scene_data = name.split('/')
+        self.scene = scene_data[0].lower()
+        self.secondary_scene = scene_data[1].lower() if len(scene_data) > 1 else None
+        for scene in [self.scene, self.secondary_scene]:
+            if scene is not None and not scene in lights.get_scenes():
+                raise ValueError('SceneAction: Unknown scene "{}"'.format(scene))
+    def run(self, event_type = None, rabbit = None, secondary_action: bool = False):
+        if secondary_action:
+            if self.secondary_scene:
+                lights.apply_scene(self.secondary_scene)
+        else:
+            lights.apply_scene(self.scene)
+    def __repr__(self):
+        return 'SceneAction(Scene: {}, Secondary scene: {})'.format(self.scene, self.secondary_scene)
+
 class WebhookAction(Action):
     '''
     Call the specified URL (HTTP GET)
@@ -17,6 +17,7 @@ from openings import OpenState
 
 import cameras
 import datastore
+import homestate
 import motion
 import notifications
 import openings
@@ -35,11 +36,14 @@ _KEYPAD_MAX_ATTEMPTS = 3
 _KEYPAD_TIMEOUT_SECONDS = 30
 _FRONT_DOOR_GRACE_TIME_SECONDS = 30
 _ENABLE_GRACE_TIME_SECONDS = 75
+_DEFAULT_CAPTURE_FPS = 0.5
 
 assert(_FRONT_DOOR_GRACE_TIME_SECONDS < _ENABLE_GRACE_TIME_SECONDS)
 
 _rabbit = None
 _notification_topic = None
+_capture_fps = _DEFAULT_CAPTURE_FPS
+_upload_kbps = 0
 
 class EnableStatus(Enum):
     GRACE = 1
@@ -62,6 +66,10 @@ for c in _keycode:
         raise ValueError('Invalid keycode digit: {}'.format(c))
 _rabbit = rabbits.get_name(config.get('Alarm', 'Rabbit'))
 _notification_topic = config.get('Alarm', 'Channel')
+_capture_fps = config.getfloat('Alarm', 'CaptureFps', fallback=_DEFAULT_CAPTURE_FPS)
+_upload_kbps = config.getint('Alarm', 'UploadKBps', fallback=0)
+if _capture_fps <= 0:
+    raise ValueError('Invalid CaptureFps: {}'.format(_capture_fps))
 
 def command(cmd: str):
     '''
@@ -198,6 +206,7 @@ def _grace_timeout_thread(thread_token):
     with _instance_lock:
         if thread_token == _instance_token and is_enabled() and _instance_status == EnableStatus.GRACE:
             _instance_status = EnableStatus.READY
+    homestate.touch('alarm')
 
 def _enable_alarm(with_grace_time: bool = True):
     '''
@@ -213,6 +222,7 @@ def _enable_alarm(with_grace_time: bool = True):
         else:
             _instance_status = EnableStatus.READY
         datastore.set(_DATASTORE_ALARM_ENABLED, True)
+        homestate.touch('alarm')
         cameras.start_monitoring()
 
 def _disable_alarm():
@@ -225,6 +235,7 @@ def _disable_alarm():
         _instance_token = 0
         _instance_status = EnableStatus.READY
         datastore.set(_DATASTORE_ALARM_ENABLED, False)
+        homestate.touch('alarm')
         cameras.stop_monitoring()
         # TODO turn off alarm bell
 
@@ -233,12 +244,12 @@ def _alarm_bell_and_lights():
      Child thread for _triggered_alarm_thread
     '''
     # TODO turn on alarm bell
-    for light in lights.get_all():
-        lights.switch(light, on=True)
+    lights.switch_many(lights.get_all(), on=True, synchronous=True)
 
-def _triggered_alarm_thread(thread_token):
+def _triggered_alarm_thread(thread_token, history: dict):
     '''
     Initialize triggered alarm (thread)
+    history: Camera frames captured before the trigger, see cameras.copy_history()
     '''
     global _instance_status
 
@@ -257,6 +268,7 @@ def _triggered_alarm_thread(thread_token):
             _instance_status = EnableStatus.ALARM
         else:
             return # Alarm disabled during grace time
+    homestate.touch('alarm')
 
     logs.info('Starting alarm')
     notifications.publish(
@@ -270,17 +282,22 @@ def _triggered_alarm_thread(thread_token):
     # Asynchronously turn on bell and lights, need to take the first photo ASAP
     Thread(target=_alarm_bell_and_lights, name='Triggered Alarm - Bell and Lights').start()
 
-    # Take photos with cameras as long as alarm is triggered
-    while thread_token == _instance_token and is_enabled():
-        for camera in cameras.get_all():
-            cameras.capture_and_send(
-                camera=camera,
-                title="Alarme déclenchée",
-                message=camera,
-                tags='rotating_light,video_camera',
-                priority=notifications.Priority.LOWEST,
-                synchronous=True,
-            )
+    # Send what happened before the trigger, only once the alarm is not disabled during grace time
+    cameras.send_history(
+        title='Avant déclenchement',
+        tags='rewind,video_camera',
+        history=history,
+    )
+
+    # Take photos with all cameras at once as long as alarm is triggered
+    cameras.capture_and_send_parallel(
+        should_continue=lambda: thread_token == _instance_token and is_enabled(),
+        title="Alarme déclenchée",
+        tags='rotating_light,video_camera',
+        priority=notifications.Priority.LOWEST,
+        fps=_capture_fps,
+        max_upload_kbps=_upload_kbps,
+    )
 
 def _trigger_alarm(with_prealarm: bool = False):
     '''
@@ -291,7 +308,10 @@ def _trigger_alarm(with_prealarm: bool = False):
         if _instance_status in [ EnableStatus.PREALARM, EnableStatus.ALARM ]:
             return # sensor callback trying to enable alarm twice, may happen in case of race condition
         _instance_status = EnableStatus.PREALARM if with_prealarm else EnableStatus.ALARM
-        Thread(target=_triggered_alarm_thread, args=[_instance_token], name='Triggered Alarm').start()
+        homestate.touch('alarm')
+        # Keep what happened before the trigger, before history gets overwritten by upcoming frames
+        history = cameras.copy_history()
+        Thread(target=_triggered_alarm_thread, args=[_instance_token, history], name='Triggered Alarm').start()
 
 def _opening_event_callback(opening_name: str, state: OpenState, shutter_name: str = None, rabbit_name: str = None, is_front_door: bool = False):
     '''
@@ -317,7 +337,8 @@ def _opening_event_callback(opening_name: str, state: OpenState, shutter_name: s
             tags='detective,video_camera',
             priority_first=notifications.Priority.NORMAL,
             priority=notifications.Priority.LOWEST,
-            count=10
+            count=10,
+            coalesce=False,
         )
         _trigger_alarm(with_prealarm=True)
     else:
@@ -361,6 +382,34 @@ def _motion_event_callback(motion_event: motion.MotionEvent):
 
 motion.event_handler.subscribe(_motion_event_callback)
 
+def _camera_motion_event_callback(motion_event: cameras.CameraMotionEvent):
+    '''
+    Callback for motion detected on camera streams
+    '''
+    if motion_event.outside:
+        logs.debug('Motion detected by camera "{}" but camera is located outside, ignoring'.format(motion_event.camera))
+        return
+
+    if not is_enabled():
+        logs.debug('Motion detected by camera "{}" but alarm is disabled, ignoring'.format(motion_event.camera))
+        return
+
+    if _instance_status != EnableStatus.READY:
+        logs.debug('Motion detected by camera "{}" but alarm is not in READY state: {}, ignoring'.format(motion_event.camera, _instance_status))
+        return
+
+    logs.warning('Motion detected by camera "{}" after activating the alarm, triggering now'.format(motion_event.camera))
+    notifications.publish(
+        title="Mouvement détecté",
+        message="La caméra {} a détecté un mouvement".format(motion_event.camera),
+        tags='rotating_light,video_camera',
+        topic=_notification_topic,
+        priority=notifications.Priority.HIGHEST,
+    )
+    _trigger_alarm()
+
+cameras.motion_event_handler.subscribe(_camera_motion_event_callback)
+
 if is_enabled():
     logs.warning('Alarm was enabled before shutting down service, reenabling')
     notifications.publish(
@@ -373,11 +422,19 @@ if is_enabled():
 
 # === HTTP API ===
 
+def _api_state() -> dict:
+    '''
+    Get alarm state for HTTP API and home state snapshot
+    '''
+    return {'enabled': is_enabled(), 'detail': 'DISABLED' if not is_enabled() else '{}'.format(_instance_status.name)}
+
+homestate.register('alarm', _api_state)
+
 alarm_api = Blueprint('alarm_api', __name__)
 
 @alarm_api.route('/api/v1/alarm', methods = ['GET'])
 def alarm_api_get():
-    return jsonify({'enabled': is_enabled(), 'detail': 'DISABLED' if not is_enabled() else '{}'.format(_instance_status.name)})
+    return jsonify(_api_state())
 
 @alarm_api.route('/api/v1/alarm/toggle', methods = ['POST'])
 def alarm_api_toggle():
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+# ===================================================================
+# batch - run several device commands from a single HTTP API request
+# By ORelio (c) 2026 - CDDL 1.0
+# ===================================================================
+
+from concurrent.futures import ThreadPoolExecutor, wait
+from flask import Blueprint, jsonify, request
+
+import time
+
+import lights
+import plugs433
+import shutters_auto
+
+from logs import logs
+
+_MAX_COMMANDS = 32
+_MAX_WORKERS = 8
+_TIMEOUT_SECONDS = 30
+
+_executor = ThreadPoolExecutor(max_workers=_MAX_WORKERS, thread_name_prefix='Batch Command')
+
+def _parse_on_off(state: str) -> bool:
+    '''
+    Parse ON/OFF state
+    raises ValueError for invalid state
+    '''
+    if not isinstance(state, str) or not state.upper() in ['ON', 'OFF']:
+        raise ValueError('Invalid state: {}'.format(state))
+    return state.upper() == 'ON'
+
+def _prepare(command: dict):
+    '''
+    Validate a batch command and prepare the corresponding function call
+    command: Dictionary with type (light, shutter, plug), name and state, same values as the per-device HTTP API
+    raises KeyError for unknown device, ValueError for invalid parameter
+    returns function to call for running the command
+    '''
+    if not isinstance(command, dict):
+        raise ValueError('Invalid command: {}'.format(command))
+    command_type = command.get('type', None)
+    name = command.get('name', None)
+    state = command.get('state', None)
+    if isinstance(state, int) and not isinstance(state, bool):
+        state = str(state)
+    # JSON values may be of any type, only strings are valid for the fields below
+    for field, value in [('type', command_type), ('name', name), ('state', state)]:
+        if not isinstance(value, str):
+            raise ValueError('Invalid {}: {}'.format(field, value))
+    command_type = command_type.lower()
+    name = name.lower()
+
+    if command_type == 'light':
+        if not name in lights.get_all():
+            raise KeyError(name)
+        on = _parse_on_off(state)
+        return lambda: lights.switch(light=name, on=on, synchronous=True)
+
+    if command_type == 'shutter':
+        if not name in shutters_auto.get_all():
+            raise KeyError(name)
+        shutter_state, percent = shutters_auto.str2state(state)
+        return lambda: shutters_auto.operate(name, shutter_state, percent)
+
+    if command_type == 'plug':
+        if not name in plugs433.get_all():
+            raise KeyError(name)
+        on = _parse_on_off(state)
+        return lambda: plugs433.switch(name, on, synchronous=True)
+
+    raise ValueError('Invalid command type: {}'.format(command_type))
+
+def _run(function) -> tuple:
+    '''
+    Run a prepared command and measure its duration (internal, from worker thread)
+    returns (success: bool, message: str, duration_ms: int)
+    '''
+    start = time.time()
+    try:
+        success = (function() is not False)
+        message = None
+    except Exception as e:
+        logs.error('Batch command failed: {}'.format(e))
+        success = False
+        message = str(e)
+    return success, message, round((time.time() - start) * 1000)
+
+def run(commands: list) -> list:
+    '''
+    Run several device commands concurrently and wait for all of them
+    commands: List of dictionaries with type (light, shutter, plug), name and state
+    returns list of results in the same order as commands: type, name, success, message (on failure), duration_ms
+    '''
+    results = []
+    futures = {}
+    for index, command in enumerate(commands):
+        result = {
+            'type': command.get('type', None) if isinstance(command, dict) else None,
+            'name': command.get('name', None) if isinstance(command, dict) else None,
+            'success': False,
+        }
+        try:
+            futures[index] = _executor.submit(_run, _prepare(command))
+        except KeyError:
+            result['message'] = 'Not Found'
+        except ValueError:
+            result['message'] = 'Invalid parameter'
+        results.append(result)
+
+    wait(futures.values(), timeout=_TIMEOUT_SECONDS)
+    for index, future in futures.items():
+        if future.done():
+            success, message, duration_ms = future.result()
+            results[index]['success'] = success
+            if message is not None:
+                results[index]['message'] = message
+            results[index]['duration_ms'] = duration_ms
+        else:
+            results[index]['message'] = 'Timeout'
+    return results
+
+# === HTTP API ===
+
+batch_api = Blueprint('batch_api', __name__)
+
+@batch_api.route('/api/v1/batch', methods = ['POST'])
+def batch_api_run():
+    commands = request.get_json(silent=True)
+    if isinstance(commands, dict):
+        commands = commands.get('commands', None)
+    if not isinstance(commands, list) or len(commands) == 0 or len(commands) > _MAX_COMMANDS:
+        return jsonify({'success': False, 'message': 'Invalid parameter'}), 400
+    logs.info('Web API: Running batch of {} commands'.format(len(commands)))
+    start = time.time()
+    results = run(commands)
+    return jsonify({
+        'success': all([result['success'] for result in results]),
+        'duration_ms': round((time.time() - start) * 1000),
+        'results': results,
+    })
@@ -5,19 +5,30 @@
 # By ORelio (c) 2025-2026 - CDDL 1.0
 # ==================================
 
-from flask import Blueprint, jsonify
+from flask import Blueprint, Response, jsonify, request
 from threading import Thread, Lock
 from configparser import ConfigParser
+from dataclasses import dataclass
 from datetime import datetime
+from typing import Callable
 
 import cv2
+import hashlib
+import numpy as np
+import queue
+import socket
 import time
 
+from events import EventHandler
+from framegrabber import FrameGrabber, FrameHistory
 from logs import logs
 
+import homestate
+import metrics
 import notifications
 import plugs433
-import requests
+import timelapse
+import timers
 
 _cameras = []
 _camera_locks = {}
@@ -25,7 +36,7 @@ _camera_should_monitor = {}
 _camera_thread_token = {}
 _camera_socket_off_time = {}
 
-_TOKEN_INACTIVE = 0
+_TOKEN_INACTIVE = None
 
 _camera_ip = {}
 _camera_port = {}
@@ -35,12 +46,79 @@ _camera_rtsp_accesskey = {}
 _camera_screenshot_frequency_minutes = {}
 _camera_screenshot_channel = {}
 _camera_power_socket = {}
+_camera_grabber = {}
+_camera_notification_width = {}
+_camera_snapshot_cache_seconds = {}
+_camera_timelapse_minutes = {}
+_camera_outside = {}
+_camera_motion_grabber = {}
+_camera_motion_fps = {}
+_camera_motion_cpu_budget = {}
+_camera_motion_threshold = {}
+_camera_motion_regions = {}
+_camera_motion_cooldown = {}
 
 _DEFAULT_RTSP_PORT = 554
+_DEFAULT_GRABBER_FRAMES = 5
+_DEFAULT_PREALARM_FPS = 1
+_DEFAULT_PREALARM_WIDTH = 640
+_DEFAULT_PREALARM_FRAME_KB = 64
+_GRABBER_MAX_FRAME_AGE_SECONDS = 2
+_GRABBER_FRAME_TIMEOUT_SECONDS = 10
+_DEFAULT_MOTION_FPS = 2
+_DEFAULT_MOTION_CPU_BUDGET_PERCENT = 5
+_DEFAULT_MOTION_THRESHOLD_PERCENT = 2
+_DEFAULT_MOTION_COOLDOWN_SECONDS = 30
+_MOTION_FRAME_WIDTH = 160
+_MOTION_PIXEL_THRESHOLD = 25
+_DEFAULT_NOTIFICATION_WIDTH = 1280
+_JPEG_QUALITY = 80
+_ENCODE_WORKERS = 2
+_ENCODE_QUEUE_SIZE = 4
+_UPLOAD_QUEUE_SIZE = 8
+_PIPELINE_TIMEOUT_SECONDS = 10
+_PROBE_CACHE_SECONDS = 5
+_PROBE_TIMEOUT_SECONDS = 2
+_DEFAULT_SNAPSHOT_CACHE_SECONDS = 5
 
 _last_seen = {}
 _last_seen_lock = {}
 
+_probe_cache = {}
+_probe_cache_lock = Lock()
+
+_snapshot_cache = {}
+_snapshot_locks = {}
+
+def _get_stream_url(camera: str, low_res: bool = False) -> str:
+    '''
+    Get RTSP URL from camera name, including credentials (internal, do not log)
+    low_res: Use the low-definition stream, if any
+    '''
+    credentials = ''
+    if _camera_rtsp_accesskey[camera]:
+        credentials = '{}@'.format(_camera_rtsp_accesskey[camera])
+    stream = _camera_stream[camera]
+    if low_res and _camera_stream_low_def[camera]:
+        stream = _camera_stream_low_def[camera]
+    return 'rtsp://{}{}:{}/{}'.format(credentials, _camera_ip[camera], _camera_port[camera], stream)
+
+def _parse_motion_regions(regions: str) -> list:
+    '''
+    Parse motion regions from config, e.g. '0,0,50,100;50,50,100,100' (internal)
+    returns list of (left, top, right, bottom) tuples in percent of the image
+    '''
+    result = []
+    for region in regions.split(';'):
+        coordinates = [float(value.strip()) for value in region.split(',')]
+        if len(coordinates) != 4:
+            raise ValueError('Invalid motion region, expecting left,top,right,bottom: {}'.format(region))
+        left, top, right, bottom = coordinates
+        if not (0 <= left < right <= 100 and 0 <= top < bottom <= 100):
+            raise ValueError('Invalid motion region, expecting percentages: {}'.format(region))
+        result.append((left, top, right, bottom))
+    return result
+
 config = ConfigParser()
 config.read('config/cameras.ini')
 
@@ -65,6 +143,37 @@ for camera_name_raw in config.sections():
         camera_screenshot_frequency_minutes = 0
     camera_screenshot_channel = config.get(camera_name_raw, 'ScreenshotsChannel', fallback=None)
     camera_power_socket = config.get(camera_name_raw, 'PowerSocket', fallback=None)
+    camera_grabber = config.getboolean(camera_name_raw, 'Grabber', fallback=False)
+    camera_grabber_frames = config.getint(camera_name_raw, 'GrabberFrames', fallback=_DEFAULT_GRABBER_FRAMES)
+    if camera_grabber_frames < 1:
+        raise ValueError('Invalid GrabberFrames for camera "{}": {}'.format(camera_name_raw, camera_grabber_frames))
+    camera_history = None
+    camera_prealarm_seconds = config.getfloat(camera_name_raw, 'PreAlarmSeconds', fallback=0)
+    if camera_prealarm_seconds > 0:
+        if not camera_grabber:
+            raise ValueError('PreAlarmSeconds requires Grabber=true for camera: {}'.format(camera_name_raw))
+        camera_history = FrameHistory(
+            seconds=camera_prealarm_seconds,
+            fps=config.getfloat(camera_name_raw, 'PreAlarmFps', fallback=_DEFAULT_PREALARM_FPS),
+            width=config.getint(camera_name_raw, 'PreAlarmWidth', fallback=_DEFAULT_PREALARM_WIDTH),
+            max_frame_bytes=config.getint(camera_name_raw, 'PreAlarmFrameKB', fallback=_DEFAULT_PREALARM_FRAME_KB) * 1024
+        )
+    camera_notification_width = config.getint(camera_name_raw, 'NotificationWidth', fallback=_DEFAULT_NOTIFICATION_WIDTH)
+    camera_snapshot_cache_seconds = config.getfloat(camera_name_raw, 'SnapshotCacheSeconds', fallback=_DEFAULT_SNAPSHOT_CACHE_SECONDS)
+    camera_timelapse_minutes = config.getint(camera_name_raw, 'TimelapseMinutes', fallback=0)
+    if camera_timelapse_minutes < 0:
+        camera_timelapse_minutes = 0
+    camera_outside = config.getboolean(camera_name_raw, 'Outside', fallback=False)
+    camera_motion = config.getboolean(camera_name_raw, 'Motion', fallback=False)
+    if camera_motion and not camera_stream_low_def:
+        raise ValueError('Motion requires StreamLowDef for camera: {}'.format(camera_name_raw))
+    camera_motion_fps = config.getfloat(camera_name_raw, 'MotionFps', fallback=_DEFAULT_MOTION_FPS)
+    camera_motion_cpu_budget = config.getfloat(camera_name_raw, 'MotionCpuBudget', fallback=_DEFAULT_MOTION_CPU_BUDGET_PERCENT)
+    camera_motion_threshold = config.getfloat(camera_name_raw, 'MotionThreshold', fallback=_DEFAULT_MOTION_THRESHOLD_PERCENT)
+    camera_motion_regions = _parse_motion_regions(config.get(camera_name_raw, 'MotionRegions', fallback='0,0,100,100'))
+    camera_motion_cooldown = config.getfloat(camera_name_raw, 'MotionCooldown', fallback=_DEFAULT_MOTION_COOLDOWN_SECONDS)
+    if camera_motion_fps <= 0 or not 0 < camera_motion_cpu_budget <= 100 or not 0 < camera_motion_threshold <= 100:
+        raise ValueError('Invalid MotionFps, MotionCpuBudget or MotionThreshold for camera: {}'.format(camera_name_raw))
     _cameras.append(camera_name)
     _camera_locks[camera_name] = Lock()
     _camera_socket_off_time[camera_name] = 0
@@ -78,10 +187,23 @@ for camera_name_raw in config.sections():
     _camera_screenshot_frequency_minutes[camera_name] = camera_screenshot_frequency_minutes
     _camera_screenshot_channel[camera_name] = camera_screenshot_channel
     _camera_power_socket[camera_name] = camera_power_socket
+    _camera_grabber[camera_name] = None
+    _camera_notification_width[camera_name] = camera_notification_width
+    _camera_snapshot_cache_seconds[camera_name] = camera_snapshot_cache_seconds
+    _camera_timelapse_minutes[camera_name] = camera_timelapse_minutes
+    _snapshot_cache[camera_name] = (0, None)
+    _snapshot_locks[camera_name] = Lock()
+    _camera_outside[camera_name] = camera_outside
+    _camera_motion_grabber[camera_name] = None
+    _camera_motion_fps[camera_name] = camera_motion_fps
+    _camera_motion_cpu_budget[camera_name] = camera_motion_cpu_budget
+    _camera_motion_threshold[camera_name] = camera_motion_threshold
+    _camera_motion_regions[camera_name] = camera_motion_regions
+    _camera_motion_cooldown[camera_name] = camera_motion_cooldown
     _last_seen[camera_name] = 0
     _last_seen_lock[camera_name] = Lock()
     logs.debug(('Loaded camera "{}" (IP={}, Port={}, Stream={}, StreamLowDef={}, Account={}, '
-        + 'ScreenshotFrequency={}min, ScreenshotChannel={}, PowerSocket={})').format(
+        + 'ScreenshotFrequency={}min, ScreenshotChannel={}, PowerSocket={}, Grabber={}, PreAlarm={}, Motion={}, Outside={})').format(
             camera_name,
             camera_ip,
             camera_port,
@@ -90,8 +212,16 @@ for camera_name_raw in config.sections():
             rtsp_login,
             camera_screenshot_frequency_minutes,
             camera_screenshot_channel,
-            camera_power_socket
+            camera_power_socket,
+            '{} frames'.format(camera_grabber_frames) if camera_grabber else 'no',
+            '{}s, {}KB'.format(camera_prealarm_seconds, camera_history.memory_bytes() // 1024) if camera_history else 'no',
+            '{}fps, {}%'.format(camera_motion_fps, camera_motion_threshold) if camera_motion else 'no',
+            camera_outside
     ))
+    if camera_grabber:
+        _camera_grabber[camera_name] = FrameGrabber(camera_name, _get_stream_url(camera_name), buffer_size=camera_grabber_frames, history=camera_history)
+    if camera_motion:
+        _camera_motion_grabber[camera_name] = FrameGrabber('{} (motion)'.format(camera_name), _get_stream_url(camera_name, low_res=True), buffer_size=1, fps=camera_motion_fps)
 logs.debug('Loaded {} camera definitions'.format(len(_cameras)))
 
 def get_all() -> list:
@@ -100,15 +230,6 @@ def get_all() -> list:
     '''
     return _cameras
 
-def _get_host(camera: str) -> str:
-    '''
-    Get ip:port from camera name
-    '''
-    camera = camera.lower()
-    if not camera in _cameras:
-        raise ValueError('Unknown camera: {}'.format(camera))
-    return '{}:{}'.format(_camera_ip[camera], _camera_port[camera])
-
 def _param_to_camera_list(camera: str = None) -> list:
     '''
     Convert param to list of cameras (internal)
@@ -135,28 +256,43 @@ def _switch_camera_socket(on: bool, camera: str = None):
             raise ValueError('No socket configured for camera "{}" so cannot switch ON/OFF'.format(camera))
         plugs433.switch(socket, on, synchronous=True)
 
-def is_reachable(camera: str, timeout_seconds: int = 10, retries: int = 2) -> bool:
+def _probe(camera: str, timeout_seconds: float) -> bool:
+    '''
+    Send an RTSP OPTIONS request over a raw socket and check that the camera answers (internal)
+    Any RTSP status line means the RTSP server is up, even if authentication would be required for streaming.
+    '''
+    request = 'OPTIONS rtsp://{}:{}/ RTSP/1.0\r\nCSeq: 1\r\n\r\n'.format(_camera_ip[camera], _camera_port[camera])
+    try:
+        with socket.create_connection((_camera_ip[camera], _camera_port[camera]), timeout=timeout_seconds) as sock:
+            sock.sendall(request.encode('ascii'))
+            return sock.recv(16).startswith(b'RTSP/1.0 ')
+    except OSError:
+        return False
+
+def is_reachable(camera: str, timeout_seconds: float = _PROBE_TIMEOUT_SECONDS, retries: int = 1, max_age_seconds: float = _PROBE_CACHE_SECONDS) -> bool:
     '''
     Check if the specified camera is up and running
-    timeout_seconds: HTTP request timeout
+    timeout_seconds: Connection and response timeout for each try
     retries: Amount of additional tries in case of failure
+    max_age_seconds: Reuse result of a previous check if more recent than the specified delay, 0 to force a new check
     returns TRUE if the camera is responding properly
     '''
-    host = _get_host(camera)
-    if timeout_seconds < 5:
-        raise ValueError('Timeout too short, minimum 5 seconds')
-    try:
-        requests.options('http://{}/'.format(host), timeout=timeout_seconds)
-    except requests.exceptions.ConnectionError as e:
-        if len(e.args) > 0 \
-          and len(e.args[0].args) > 1 \
-          and str(e.args[0].args[1]).strip() == 'RTSP/1.0 200 OK':
-            return True
-    except requests.exceptions.ReadTimeout as e2:
-        pass
-    if retries > 0:
-        return is_reachable(camera, timeout_seconds=timeout_seconds, retries = retries - 1)
-    return False
+    camera = camera.lower()
+    if not camera in _cameras:
+        raise ValueError('Unknown camera: {}'.format(camera))
+    if timeout_seconds <= 0:
+        raise ValueError('Invalid timeout: {}'.format(timeout_seconds))
+    with _probe_cache_lock:
+        probe_time, reachable = _probe_cache.get(camera, (0, False))
+    if probe_time + max_age_seconds > time.time():
+        return reachable
+    for attempt in range(max(0, retries) + 1):
+        reachable = _probe(camera, timeout_seconds)
+        if reachable:
+            break
+    with _probe_cache_lock:
+        _probe_cache[camera] = (time.time(), reachable)
+    return reachable
 
 def wait_for_camera(camera: str, timeout_seconds = 120) -> bool:
     '''
@@ -169,7 +305,7 @@ def wait_for_camera(camera: str, timeout_seconds = 120) -> bool:
     while request_count > 0:
         request_count -= 1
         time_start = time.time()
-        if is_reachable(camera, timeout_seconds=10):
+        if is_reachable(camera, max_age_seconds=0):
             return True
         time_elapsed = time.time() - time_start
         if time_elapsed < 10:
@@ -190,6 +326,117 @@ def _capture_error(camera, message_format):
             topic=_camera_screenshot_channel[camera],
         )
 
+# === Snapshot pipeline ===
+# Grab (capture threads) -> Resize and encode (encode threads) -> Publish (upload thread)
+# Stages are connected by bounded queues: when a stage cannot keep up, previous stages wait, then drop photos.
+
+@dataclass
+class _Snapshot():
+    camera: str
+    frame: object
+    grab_time: float
+    notification: dict
+
+_encode_queue = queue.Queue(maxsize=_ENCODE_QUEUE_SIZE)
+_upload_queue = queue.Queue(maxsize=_UPLOAD_QUEUE_SIZE)
+_pipeline_lock = Lock()
+_pipeline_started = False
+_upload_bytes_per_second = 0
+
+def _resize_for_notification(camera: str, frame):
+    '''
+    Downscale frame to the notification width of the camera, if larger (internal)
+    '''
+    max_width = _camera_notification_width[camera]
+    height, width = frame.shape[:2]
+    if max_width > 0 and width > max_width:
+        return cv2.resize(frame, (max_width, round(height * max_width / width)), interpolation=cv2.INTER_AREA)
+    return frame
+
+def _encode_thread():
+    '''
+    Resize and encode grabbed frames, then hand them to the upload thread (internal thread)
+    '''
+    while True:
+        snapshot = _encode_queue.get()
+        start_time = time.time()
+        ret, jpg = cv2.imencode('.jpg', _resize_for_notification(snapshot.camera, snapshot.frame), [int(cv2.IMWRITE_JPEG_QUALITY), _JPEG_QUALITY])
+        metrics.record('cameras.encode', (time.time() - start_time) * 1000)
+        snapshot.frame = None
+        if not ret:
+            _capture_error(snapshot.camera, 'Failed to encode RTSP image from camera: {}')
+            continue
+        snapshot.notification['attachment'] = bytes(jpg)
+        _pipeline_put(_upload_queue, snapshot, 'upload')
+
+def _upload_thread():
+    '''
+    Send encoded photos one at a time, spacing requests so that the average upload rate stays under the limit (internal thread)
+    '''
+    next_upload_time = 0
+    while True:
+        snapshot = _upload_queue.get()
+        if _upload_bytes_per_second > 0 and next_upload_time > time.time():
+            time.sleep(next_upload_time - time.time())
+        start_time = time.time()
+        try:
+            notifications.publish(topic=_camera_screenshot_channel[snapshot.camera], synchronous=True, **snapshot.notification)
+            metrics.record('cameras.upload', (time.time() - start_time) * 1000)
+            metrics.record('cameras.snapshot', (time.time() - snapshot.grab_time) * 1000)
+            metrics.increment('cameras.upload_bytes', len(snapshot.notification['attachment']))
+        except Exception as e:
+            logs.error('Failed to send photo from camera {}: {}'.format(snapshot.camera, e))
+        if _upload_bytes_per_second > 0:
+            next_upload_time = max(next_upload_time, time.time()) + len(snapshot.notification['attachment']) / _upload_bytes_per_second
+
+def _pipeline_put(stage_queue: queue.Queue, snapshot: _Snapshot, stage: str) -> bool:
+    '''
+    Hand snapshot to the next pipeline stage, waiting if the stage is busy, dropping the snapshot on timeout (internal)
+    returns TRUE if the snapshot was queued
+    '''
+    try:
+        stage_queue.put(snapshot, timeout=_PIPELINE_TIMEOUT_SECONDS)
+        return True
+    except queue.Full:
+        metrics.increment('cameras.dropped')
+        logs.warning('Snapshot {} stage is not keeping up, dropping photo from camera: {}'.format(stage, snapshot.camera))
+        return False
+
+def _queue_snapshot(camera: str, frame, grab_time: float, notification: dict) -> bool:
+    '''
+    Queue a grabbed frame for resizing, encoding and sending as notification (internal)
+    camera: Name of camera, for determining notification size and channel
+    frame: Grabbed frame, as returned by cv2
+    grab_time: Timestamp of the frame
+    notification: Arguments for notifications.publish(), except topic and attachment
+    returns TRUE if the snapshot was queued
+    '''
+    global _pipeline_started
+    with _pipeline_lock:
+        if not _pipeline_started:
+            for i in range(_ENCODE_WORKERS):
+                Thread(target=_encode_thread, name='Camera encode {}'.format(i + 1)).start()
+            Thread(target=_upload_thread, name='Camera upload').start()
+            _pipeline_started = True
+    notification['filename'] = '{}_{}.jpg'.format(camera, datetime.fromtimestamp(grab_time).strftime('%Y-%m-%d_%H-%M-%S'))
+    return _pipeline_put(_encode_queue, _Snapshot(camera, frame, grab_time, notification), 'encode')
+
+def _grab_frame(camera: str, low_res: bool = False, newer_than: float = 0) -> tuple:
+    '''
+    Get a frame from the frame grabber of a camera, if running and suitable for the capture (internal)
+    low_res: Low resolution capture requested
+    newer_than: Timestamp of previous frame from the same burst, or 0 for first frame
+    returns (timestamp: float, frame: numpy array) or (None, None) if the grabber cannot provide a frame
+    '''
+    grabber = _camera_grabber[camera]
+    if grabber is None or not grabber.is_running():
+        return None, None
+    if low_res and _camera_stream_low_def[camera]:
+        return None, None # Grabber decodes the high definition stream
+    if newer_than == 0:
+        newer_than = time.time() - _GRABBER_MAX_FRAME_AGE_SECONDS
+    return grabber.wait_for_frame(newer_than=newer_than, timeout_seconds=_GRABBER_FRAME_TIMEOUT_SECONDS)
+
 def _capture_and_send_thread(
         camera: str,
         message: str = None,
@@ -200,16 +447,14 @@ def _capture_and_send_thread(
         low_res: bool = False,
         count = 1,
         delay = 1,
+        coalesce: bool = True,
     ):
     '''
     Capture a photo from a camera and send it as notification (internal, see capture_and_send())
     '''
     camera = camera.lower()
-    host = _get_host(camera)
-
-    credentials = ''
-    if _camera_rtsp_accesskey[camera]:
-        credentials = '{}@'.format(_camera_rtsp_accesskey[camera])
+    if not camera in _cameras:
+        raise ValueError('Unknown camera: {}'.format(camera))
 
     if not message:
         message = 'Photo from camera {}'.format(camera)
@@ -219,10 +464,6 @@ def _capture_and_send_thread(
     if priority_first is None:
         priority_first = priority
 
-    stream = _camera_stream[camera]
-    if low_res and _camera_stream_low_def[camera]:
-        stream = _camera_stream_low_def[camera]
-
     if count < 1:
         count = 1
     count_total = count
@@ -231,43 +472,47 @@ def _capture_and_send_thread(
     if delay < 1:
         delay = 1
 
+    frame_time = 0
+
     while count >= 1:
         with _camera_locks[camera]:
             if _camera_thread_token[camera] == _TOKEN_INACTIVE:
                 break
-            if is_reachable(camera):
-                cap = cv2.VideoCapture('rtsp://{}{}/{}'.format(credentials, host, stream))
+            # Frame grabber already has an open session, reuse it for all photos of the series
+            grab_start = time.time()
+            frame_time, frame = _grab_frame(camera, low_res=low_res, newer_than=frame_time)
+            if frame is None:
+                if not is_reachable(camera):
+                    return _capture_error(camera, 'Camera is not reachable: {}')
+                cap = cv2.VideoCapture(_get_stream_url(camera, low_res=low_res))
                 try:
                     if not cap.isOpened():
                         return _capture_error(camera, 'Failed to access RTSP stream for camera: {}')
                     ret, frame = cap.read()
                     if not ret:
                         return _capture_error(camera, 'Failed to capture image from RTSP stream for camera: {}')
-                    filename = '{}_{}.jpg'.format(camera, datetime.now().strftime('%Y-%m-%d_%H-%M-%S'))
-                    # ret = cv2.imwrite(filename, frame, [int(cv2.IMWRITE_JPEG_QUALITY), jpeg_quality])
-                    ret, jpg = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), 80]) # jpeg quality = 80%
-                    if not ret:
-                        return _capture_error(camera, 'Failed to encode RTSP image from camera: {}')
-                    notification_message = message
-                    if count_total > 1:
-                        notification_message = '{} ({}/{})'.format(message, count_total - count + 1, count_total)
-                    notifications.publish(
-                        title=title,
-                        message=notification_message,
-                        priority=priority_first if first_photo else priority,
-                        tags=tags,
-                        topic=_camera_screenshot_channel[camera],
-                        attachment=bytes(jpg),
-                        filename=filename
-                    )
                 finally:
                     cap.release()
-                first_photo = False
-                count -= 1
-                if count >= 1:
-                    time.sleep(delay)
-            else:
-                return _capture_error(camera, 'Camera is not reachable: {}')
+                frame_time = time.time()
+            metrics.record('cameras.grab', (time.time() - grab_start) * 1000)
+            notification_message = message
+            if count_total > 1:
+                notification_message = '{} ({}/{})'.format(message, count_total - count + 1, count_total)
+            # Resize, encode and upload happen on pipeline threads, no need to hold the camera lock
+            _queue_snapshot(camera, frame, frame_time, {
+                'title': title,
+                'message': notification_message,
+                'priority': priority_first if first_photo else priority,
+                'tags': tags,
+                'coalesce': coalesce,
+            })
+            first_photo = False
+            count -= 1
+            if count >= 1:
+                # Stop waiting right away if monitoring is stopped meanwhile
+                thread_token = _camera_thread_token[camera]
+                if thread_token == _TOKEN_INACTIVE or not thread_token.sleep(delay):
+                    break
 
 def capture_and_send(
         camera: str,
@@ -279,6 +524,7 @@ def capture_and_send(
         low_res: bool = False,
         count = 1,
         delay = 1,
+        coalesce: bool = True,
         synchronous: bool = False,
     ):
     '''
@@ -291,6 +537,7 @@ def capture_and_send(
     low_res: Make a low resolution capture to save bandwidth.
     count: Amount of photos to take
     delay: Delay between each photo in seconds
+    coalesce: Allow merging photos into a summary when sent too often, see notifications.publish()
     synchronous: Wait for capture(s) to finish before returning
     '''
     if synchronous:
@@ -304,6 +551,7 @@ def capture_and_send(
             low_res=low_res,
             count=count,
             delay=delay,
+            coalesce=coalesce,
         )
     else:
         _capture_thread = Thread(target=_capture_and_send_thread,
@@ -317,13 +565,273 @@ def capture_and_send(
                 'low_res': low_res,
                 'count': count,
                 'delay': delay,
+                'coalesce': coalesce,
             },
             name='Capture and send (camera={}, title={})'.format(camera, title))
         _capture_thread.start()
         while _capture_thread.is_alive() and not _camera_locks[camera].locked():
             time.sleep(0.05) # make sure the lock is acquired before returning
 
-def _monitor_thread(camera: str, thread_token: int):
+def _send_history_thread(camera: str, frames: list, before: float, message: str, title: str, priority: notifications.Priority, tags: str):
+    '''
+    Send frames from history as notifications (internal, see send_history())
+    '''
+    for timestamp, jpg in frames:
+        notifications.publish(
+            title=title,
+            message='{} (-{}s)'.format(message, max(0, round(before - timestamp))),
+            priority=priority,
+            tags=tags,
+            topic=_camera_screenshot_channel[camera],
+            attachment=jpg,
+            filename='{}_{}.jpg'.format(camera, datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d_%H-%M-%S')),
+            coalesce=False,
+        )
+
+def copy_history(camera: str = None, before: float = None) -> dict:
+    '''
+    Copy frames captured before an event, for cameras with PreAlarmSeconds configured, so that they can be sent later on
+    camera: Name of camera (default: all cameras having a history)
+    before: Timestamp of the event, default is now
+    returns dict mapping camera name to (before: float, frames: list), see send_history()
+    '''
+    if before is None:
+        before = time.time()
+    history = {}
+    for camera in _param_to_camera_list(camera):
+        camera = camera.lower()
+        grabber = _camera_grabber[camera]
+        if grabber is None or grabber.history is None or not grabber.is_running():
+            continue
+        frames = grabber.history.get_frames(before=before)
+        if len(frames) > 0:
+            history[camera] = (before, frames)
+    return history
+
+def send_history(
+        camera: str = None,
+        message: str = None,
+        title: str = None,
+        priority: notifications.Priority = None,
+        tags: str = 'rewind,video_camera',
+        before: float = None,
+        history: dict = None,
+    ) -> int:
+    '''
+    Send frames captured before an event as notifications, for cameras with PreAlarmSeconds configured
+    The history is copied immediately so that frames are not overwritten while sending them.
+    camera: Name of camera (default: all cameras having a history)
+    message: Message to attach to frames, default is camera name
+    title: Title for the message to attach to frames
+    priority: Notification priority. Default is lowest (silent).
+    tags: Notification tags, see notification.publish().
+    before: Timestamp of the event, default is now
+    history: (optional) Send frames previously copied using copy_history() instead, ignoring camera and before
+    returns amount of frames being sent
+    '''
+    if history is None:
+        history = copy_history(camera, before)
+    if priority is None:
+        priority = notifications.Priority.LOWEST
+    frame_count = 0
+    for camera, (before, frames) in history.items():
+        frame_count += len(frames)
+        Thread(target=_send_history_thread,
+            args=[camera, frames, before, message if message else camera, title, priority, tags],
+            name='Send camera history (camera={})'.format(camera)).start()
+    return frame_count
+
+# === Snapshots for local viewers ===
+
+def _read_frame_low_cost(camera: str) -> tuple:
+    '''
+    Get a recent frame from a running frame grabber, else from a one-off session on the low-definition stream (internal)
+    returns (timestamp: float, frame: numpy array) or (None, None) if the camera is not available
+    '''
+    for grabber in [_camera_grabber[camera], _camera_motion_grabber[camera]]:
+        if grabber is not None and grabber.is_running():
+            frame_time, frame = grabber.get_latest(max_age_seconds=_GRABBER_MAX_FRAME_AGE_SECONDS)
+            if frame is not None:
+                return frame_time, frame
+    if not is_reachable(camera):
+        return None, None
+    cap = cv2.VideoCapture(_get_stream_url(camera, low_res=True))
+    try:
+        if not cap.isOpened():
+            return None, None
+        ret, frame = cap.read()
+        if not ret:
+            return None, None
+    finally:
+        cap.release()
+    return time.time(), frame
+
+def get_snapshot(camera: str) -> tuple:
+    '''
+    Get a recent JPEG snapshot from a camera, shared by all callers for SnapshotCacheSeconds
+    Concurrent callers wait for the same capture instead of each opening an RTSP session.
+    Uses a running frame grabber when available, else a one-off session on the low-definition stream.
+    returns (timestamp: float, jpg: bytes) or (None, None) if the camera is not available
+    '''
+    camera = camera.lower()
+    if not camera in _cameras:
+        raise ValueError('Unknown camera: {}'.format(camera))
+    with _snapshot_locks[camera]:
+        snapshot_time, jpg = _snapshot_cache[camera]
+        if jpg is not None and snapshot_time + _camera_snapshot_cache_seconds[camera] > time.time():
+            return snapshot_time, jpg
+        frame_time, frame = _read_frame_low_cost(camera)
+        if frame is None:
+            return None, None
+        ret, encoded = cv2.imencode('.jpg', _resize_for_notification(camera, frame), [int(cv2.IMWRITE_JPEG_QUALITY), _JPEG_QUALITY])
+        if not ret:
+            return None, None
+        _snapshot_cache[camera] = (frame_time, bytes(encoded))
+        return _snapshot_cache[camera]
+
+# === Parallel capture ===
+
+def _capture_parallel_thread(camera: str, message: str, title: str, priority: notifications.Priority, tags: str, fps: float, should_continue: Callable):
+    '''
+    Capture photos from a camera at the target frame rate, handing them to the snapshot pipeline (internal thread)
+    Uses the camera frame grabber, or a temporary one for the duration of the capture.
+    '''
+    grabber = _camera_grabber[camera]
+    temporary_grabber = grabber is None or not grabber.is_running()
+    if temporary_grabber:
+        grabber = FrameGrabber('{} (capture)'.format(camera), _get_stream_url(camera), buffer_size=1)
+        grabber.start()
+    try:
+        interval = 1.0 / fps
+        frame_time = 0
+        count = 0
+        while should_continue() and _camera_thread_token[camera] != _TOKEN_INACTIVE:
+            next_capture_time = time.time() + interval
+            frame_time, frame = grabber.wait_for_frame(newer_than=frame_time, timeout_seconds=_GRABBER_FRAME_TIMEOUT_SECONDS)
+            if frame is None:
+                frame_time = 0
+                continue
+            count += 1
+            _queue_snapshot(camera, frame, frame_time, {
+                'title': title,
+                'message': '{} ({})'.format(message if message else camera, count),
+                'priority': priority,
+                'tags': tags,
+                'coalesce': False, # Rate already limited by fps and bandwidth cap
+            })
+            if next_capture_time > time.time():
+                time.sleep(next_capture_time - time.time())
+    finally:
+        if temporary_grabber:
+            grabber.stop()
+
+def capture_and_send_parallel(
+        should_continue: Callable,
+        camera: str = None,
+        message: str = None,
+        title: str = None,
+        priority: notifications.Priority = None,
+        tags: str = 'video_camera',
+        fps: float = 0.5,
+        max_upload_kbps: int = 0,
+    ):
+    '''
+    Capture photos from several cameras at once and send them as notifications, as long as should_continue() returns True
+    Frames are grabbed concurrently, then go through the shared snapshot pipeline for encoding and upload.
+    should_continue: Function called before each photo, capture stops when it returns False
+    camera: Name of camera (default: all cameras)
+    message: Message to attach to photos, default is camera name
+    title: Title for the message to attach to photos
+    priority: Notification priority. Default is lowest (silent).
+    tags: Notification tags, see notification.publish().
+    fps: Target frame rate for each camera
+    max_upload_kbps: Global upload bandwidth cap in kilobytes per second, 0 for unlimited
+    '''
+    global _upload_bytes_per_second
+    if fps <= 0:
+        raise ValueError('Invalid frame rate: {}'.format(fps))
+    if priority is None:
+        priority = notifications.Priority.LOWEST
+    _upload_bytes_per_second = max(0, max_upload_kbps) * 1024
+    threads = []
+    for camera in _param_to_camera_list(camera):
+        camera = camera.lower()
+        thread = Thread(target=_capture_parallel_thread,
+            args=[camera, message, title, priority, tags, fps, should_continue],
+            name='Parallel capture (camera={})'.format(camera))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    _upload_bytes_per_second = 0
+
+# === Motion detection ===
+
+@dataclass
+class CameraMotionEvent():
+    camera: str
+    outside: bool
+    score: float
+
+'''
+Camera Motion Event Handler
+Callbacks will receive args = CameraMotionEvent
+'''
+motion_event_handler = EventHandler('Camera Motion')
+
+def _build_motion_mask(regions: list, width: int, height: int):
+    '''
+    Build boolean mask of watched pixels from motion regions (internal)
+    '''
+    mask = np.zeros((height, width), dtype=bool)
+    for left, top, right, bottom in regions:
+        mask[round(top * height / 100):round(bottom * height / 100), round(left * width / 100):round(right * width / 100)] = True
+    return mask
+
+def _motion_thread(camera: str, thread_token: timers.Cancellation):
+    '''
+    Detect motion by comparing consecutive downscaled grayscale frames from the low-definition stream (internal thread)
+    Decoding rate is lowered automatically when decoding and analysis take more CPU time than the configured budget.
+    '''
+    grabber = _camera_motion_grabber[camera]
+    interval = 1.0 / _camera_motion_fps[camera]
+    budget = _camera_motion_cpu_budget[camera] / 100.0
+    threshold = _camera_motion_threshold[camera]
+    grabber.frame_interval = interval
+    mask = None
+    mask_pixels = 0
+    previous = None
+    frame_time = 0
+    last_event_time = 0
+
+    while not thread_token.is_cancelled():
+        frame_time, frame = grabber.wait_for_frame(newer_than=frame_time, timeout_seconds=_GRABBER_FRAME_TIMEOUT_SECONDS)
+        if frame is None:
+            frame_time = 0
+            previous = None # Stream lost, do not compare with a frame from before the interruption
+            continue
+
+        cpu_start = time.thread_time()
+        height, width = frame.shape[:2]
+        small = cv2.resize(frame, (_MOTION_FRAME_WIDTH, max(1, round(height * _MOTION_FRAME_WIDTH / width))), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.int16)
+        if mask is None or mask.shape != gray.shape:
+            mask = _build_motion_mask(_camera_motion_regions[camera], gray.shape[1], gray.shape[0])
+            mask_pixels = max(1, int(np.count_nonzero(mask)))
+            previous = None
+        if previous is not None:
+            changed = int(np.count_nonzero((np.abs(gray - previous) > _MOTION_PIXEL_THRESHOLD) & mask))
+            score = changed * 100.0 / mask_pixels
+            if score >= threshold and frame_time - last_event_time >= _camera_motion_cooldown[camera]:
+                last_event_time = frame_time
+                motion_event_handler.dispatch(CameraMotionEvent(camera, _camera_outside[camera], round(score, 1)))
+        previous = gray
+        cpu_time = time.thread_time() - cpu_start + grabber.take_cpu_time()
+
+        # Decode next frames less often if over budget, staying below frame timeout to keep comparing frames
+        grabber.frame_interval = min(max(interval, cpu_time / budget), _GRABBER_FRAME_TIMEOUT_SECONDS / 2)
+
+def _monitor_thread(camera: str, thread_token: timers.Cancellation):
     '''
     Monitor camera and regularly send captures as notification
     '''
@@ -343,18 +851,19 @@ def _monitor_thread(camera: str, thread_token: int):
 
     if _camera_power_socket[camera]:
         # Minimum delay for camera to initialize
-        time.sleep(75)
+        if not thread_token.sleep(75):
+            return
 
     camera_lost = False
     if wait_for_camera(camera):
-        if thread_token == _camera_thread_token[camera]:
+        if not thread_token.is_cancelled():
             capture_and_send(camera,
                 title='Démarrage caméra : {}'.format(camera),
                 message=frequency_desc,
                 tags='arrow_forward,video_camera',
             )
     else:
-        if thread_token == _camera_thread_token[camera]:
+        if not thread_token.is_cancelled():
             notifications.publish(
                 message="La caméra n'a pas démarré : {}".format(camera),
                 tags='x,video_camera',
@@ -365,14 +874,17 @@ def _monitor_thread(camera: str, thread_token: int):
 
     take_screenshots = frequency > 0
     next_screenshot_time = time.time() + (frequency * 60)
+    timelapse_frequency = _camera_timelapse_minutes[camera]
+    next_timelapse_time = 0
 
     while True:
-        if thread_token != _camera_thread_token[camera]:
+        if thread_token.is_cancelled():
             break
 
         if is_reachable(camera):
             with _last_seen_lock[camera]:
                 _last_seen[camera] = time.time()
+            homestate.touch('cameras')
             if camera_lost:
                 camera_lost = False
                 capture_and_send(camera,
@@ -388,9 +900,18 @@ def _monitor_thread(camera: str, thread_token: int):
                         low_res=True,
                     )
                     next_screenshot_time = time.time() + (frequency * 60)
+            if timelapse_frequency > 0 and time.time() >= next_timelapse_time:
+                frame_time, frame = _read_frame_low_cost(camera)
+                if frame is not None:
+                    try:
+                        timelapse.append_frame(camera, frame_time, frame)
+                    except OSError as e:
+                        logs.error('Failed to archive time-lapse frame for camera {}: {}'.format(camera, e))
+                    next_timelapse_time = time.time() + (timelapse_frequency * 60) - 5 # Tolerate monitoring loop drift
         elif not camera_lost:
             with _last_seen_lock[camera]:
                 _last_seen[camera] = 0
+            homestate.touch('cameras')
             camera_lost = True
             if _camera_socket_off_time[camera] + 60 > time.time():
                 logs.info('Camera just switched off, ignoring "camera not responding" error: {}'.format(camera))
@@ -404,7 +925,8 @@ def _monitor_thread(camera: str, thread_token: int):
                 # Attempt to reboot the camera
                 if _camera_power_socket[camera]:
                     _switch_camera_socket(camera=camera, on=False)
-                    time.sleep(10)
+                    if not thread_token.sleep(10):
+                        break
                     notifications.publish(
                         message='Redémarrage : {}'.format(camera),
                         tags='recycle,video_camera',
@@ -412,7 +934,7 @@ def _monitor_thread(camera: str, thread_token: int):
                     )
                     _switch_camera_socket(camera=camera, on=True)
 
-        time.sleep(60) # 1 minute
+        thread_token.sleep(60) # 1 minute, or until monitoring is stopped
 
 def start_monitoring(camera: str = None):
     '''
@@ -427,12 +949,19 @@ def start_monitoring(camera: str = None):
             _camera_socket_off_time[camera] = 0
             _switch_camera_socket(camera=camera, on=True)
         with _camera_locks[camera]:
-            thread_token = round(time.time() * 1000)
-            if _camera_thread_token.get(camera, _TOKEN_INACTIVE) == thread_token:
-                thread_token -= 1;
+            # Replace token, cancelling threads from previous monitoring
+            if _camera_thread_token[camera] != _TOKEN_INACTIVE:
+                _camera_thread_token[camera].cancel()
+            thread_token = timers.Cancellation()
             _camera_thread_token[camera] = thread_token
             t = Thread(target=_monitor_thread, args=[camera, thread_token], name='Camera monitor : {}'.format(camera))
             t.start()
+            if _camera_motion_grabber[camera]:
+                Thread(target=_motion_thread, args=[camera, thread_token], name='Camera motion : {}'.format(camera)).start()
+        if _camera_grabber[camera]:
+            _camera_grabber[camera].start()
+        if _camera_motion_grabber[camera]:
+            _camera_motion_grabber[camera].start()
 
 def _stop_monitoring_thread(camera: str = None):
     '''
@@ -447,12 +976,20 @@ def _stop_monitoring_thread(camera: str = None):
             _switch_camera_socket(camera=camera, on=False)
         with _last_seen_lock[camera]:
             _last_seen[camera] = 0
+        homestate.touch('cameras')
         if _camera_thread_token[camera] == _TOKEN_INACTIVE:
             logs.debug('Monitoring already stopped for camera: {}'.format(camera))
         else:
             logs.info('Stopping monitoring for camera: {}'.format(camera))
+            thread_token = _camera_thread_token[camera]
+            if thread_token != _TOKEN_INACTIVE:
+                thread_token.cancel() # Wake up sleeping threads right away, even if a capture holds the lock
             with _camera_locks[camera]:
                 _camera_thread_token[camera] = _TOKEN_INACTIVE
+            if _camera_grabber[camera]:
+                _camera_grabber[camera].stop()
+            if _camera_motion_grabber[camera]:
+                _camera_motion_grabber[camera].stop()
             notifications.publish(
                 message="Arrêt caméra : {}".format(camera),
                 tags='stop_button,video_camera',
@@ -476,10 +1013,10 @@ def stop_monitoring(camera: str = None, synchronous: bool = False):
 
 # === HTTP API ===
 
-cameras_api = Blueprint('cameras_api', __name__)
-
-@cameras_api.route('/api/v1/cameras', methods = ['GET'])
-def cameras_api_get():
+def _api_state() -> dict:
+    '''
+    Get online state of all cameras for HTTP API and home state snapshot
+    '''
     response = {}
     for camera in _cameras:
         with _last_seen_lock[camera]:
@@ -487,4 +1024,26 @@ def cameras_api_get():
                 'state': 'online' if _last_seen[camera] + 120 > time.time() else 'offline',
                 'refreshed': int(_last_seen[camera]) if _last_seen[camera] > 0 else None
             }
-    return jsonify(response)
+    return response
+
+# Rebuild regularly: cameras are considered offline after some time without response
+homestate.register('cameras', _api_state, max_age=60)
+
+cameras_api = Blueprint('cameras_api', __name__)
+
+@cameras_api.route('/api/v1/cameras', methods = ['GET'])
+def cameras_api_get():
+    return jsonify(_api_state())
+
+@cameras_api.route('/api/v1/cameras/<camera>/snapshot.jpg', methods = ['GET'])
+def cameras_api_snapshot(camera: str):
+    if not camera or not camera.lower() in _cameras:
+        return jsonify({'success': False, 'message': 'Not Found'}), 404
+    camera = camera.lower()
+    snapshot_time, jpg = get_snapshot(camera)
+    if jpg is None:
+        return jsonify({'success': False, 'message': 'Camera not available'}), 503
+    response = Response(jpg, mimetype='image/jpeg')
+    response.set_etag(hashlib.sha1(jpg).hexdigest()[:16])
+    response.headers['Cache-Control'] = 'private, max-age={}'.format(int(_camera_snapshot_cache_seconds[camera]))
+    return response.make_conditional(request)
@@ -66,3 +66,9 @@ def set(key: str, value):
         _datastore[key] = value
     _save()
     return value
+
+def flush():
+    '''
+    Write datastore to disk, e.g. before shutting down
+    '''
+    _save()
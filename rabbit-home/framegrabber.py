@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+
+# =====================================================================
+# framegrabber - keep an RTSP session open and buffer its recent frames
+# By ORelio (c) 2026 - CDDL 1.0
+# =====================================================================
+
+from threading import Thread, Condition, Lock
+
+import cv2
+import math
+import time
+
+from logs import logs
+
+_TOKEN_INACTIVE = 0
+_RECONNECT_DELAY_MIN_SECONDS = 2
+_RECONNECT_DELAY_MAX_SECONDS = 60
+_HISTORY_JPEG_QUALITY = 70
+_HISTORY_JPEG_QUALITY_FALLBACK = 40
+
+class FrameHistory:
+    '''
+    Rolling history of downscaled JPEG frames, for retrieving what happened before an event.
+    Frames are stored in a single preallocated buffer divided in fixed-size slots, so memory usage is bounded.
+    seconds: Duration of the history
+    fps: Amount of frames per second to keep
+    width: Width of stored frames in pixels, height is scaled accordingly
+    max_frame_bytes: Size of each slot. Frames still too large after re-encoding at lower quality are dropped.
+    '''
+    def __init__(self, seconds: float, fps: float, width: int, max_frame_bytes: int):
+        if seconds <= 0 or fps <= 0 or width < 16 or max_frame_bytes < 1024:
+            raise ValueError('Invalid frame history settings: seconds={}, fps={}, width={}, max_frame_bytes={}'.format(
+                seconds, fps, width, max_frame_bytes))
+        self.interval = 1.0 / fps
+        self.width = width
+        self._slot_size = max_frame_bytes
+        self._slots = max(1, math.ceil(seconds * fps))
+        self._buffer = bytearray(self._slots * self._slot_size)
+        self._lengths = [0] * self._slots
+        self._timestamps = [0] * self._slots
+        self._index = 0
+        self._last_time = 0
+        self._lock = Lock()
+
+    def memory_bytes(self) -> int:
+        '''
+        Get the size of the preallocated buffer
+        '''
+        return len(self._buffer)
+
+    def is_due(self, timestamp: float) -> bool:
+        '''
+        Check if a new frame should be added to the history, according to fps
+        '''
+        return timestamp - self._last_time >= self.interval
+
+    def add(self, timestamp: float, frame):
+        '''
+        Downscale, encode and store a frame, overwriting the oldest one
+        timestamp: Capture time of the frame
+        frame: Frame as numpy array, as returned by cv2
+        '''
+        self._last_time = timestamp
+        height, width = frame.shape[:2]
+        if width > self.width:
+            frame = cv2.resize(frame, (self.width, round(height * self.width / width)), interpolation=cv2.INTER_AREA)
+        jpg = None
+        for quality in [_HISTORY_JPEG_QUALITY, _HISTORY_JPEG_QUALITY_FALLBACK]:
+            ret, jpg = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+            if ret and len(jpg) <= self._slot_size:
+                break
+            jpg = None
+        if jpg is None:
+            logs.debug('Frame too large for history slot ({} bytes), dropping'.format(self._slot_size))
+            return
+        with self._lock:
+            offset = self._index * self._slot_size
+            self._buffer[offset:offset + len(jpg)] = jpg.tobytes()
+            self._lengths[self._index] = len(jpg)
+            self._timestamps[self._index] = timestamp
+            self._index = (self._index + 1) % self._slots
+
+    def get_frames(self, before: float = None) -> list:
+        '''
+        Get a copy of all frames in the history, oldest first
+        before: (optional) Only retrieve frames captured before the specified timestamp
+        returns list of (timestamp: float, jpg: bytes)
+        '''
+        frames = []
+        with self._lock:
+            for i in range(self._slots):
+                slot = (self._index + i) % self._slots
+                if self._lengths[slot] > 0 and (before is None or self._timestamps[slot] <= before):
+                    offset = slot * self._slot_size
+                    frames.append((self._timestamps[slot], bytes(self._buffer[offset:offset + self._lengths[slot]])))
+        return frames
+
+    def clear(self):
+        '''
+        Forget all frames, keeping the preallocated buffer
+        '''
+        with self._lock:
+            self._lengths = [0] * self._slots
+            self._timestamps = [0] * self._slots
+            self._last_time = 0
+
+class FrameGrabber:
+    '''
+    Continuously decode an RTSP stream on a dedicated thread, keeping the most recent frames in a ring buffer.
+    Avoids RTSP negotiation and keyframe wait before each capture, and allows bursts of captures using a single session.
+    name: Name for logs and thread, e.g. camera name
+    url: RTSP URL of the stream, may contain credentials so never logged
+    buffer_size: Amount of recent frames to keep in memory
+    history: (optional) Also feed decoded frames into the specified FrameHistory
+    fps: (optional) Only decode frames at the specified rate, other frames are grabbed from the stream and skipped.
+      The rate can be lowered afterwards by changing frame_interval, e.g. to stay within a CPU budget.
+    '''
+    def __init__(self, name: str, url: str, buffer_size: int = 5, history: FrameHistory = None, fps: float = None):
+        if buffer_size < 1:
+            raise ValueError('Invalid frame buffer size: {}'.format(buffer_size))
+        if fps is not None and fps <= 0:
+            raise ValueError('Invalid frame rate: {}'.format(fps))
+        self.name = name
+        self._url = url
+        self.history = history
+        self.frame_interval = 0 if fps is None else 1.0 / fps
+        self._cpu_time = 0
+        self._frames = [None] * buffer_size
+        self._timestamps = [0] * buffer_size
+        self._index = 0
+        self._thread_token = _TOKEN_INACTIVE
+        self._new_frame = Condition()
+
+    def start(self):
+        '''
+        Start grabbing frames, if not already started
+        '''
+        with self._new_frame:
+            if self._thread_token != _TOKEN_INACTIVE:
+                return
+            thread_token = round(time.time() * 1000)
+            self._thread_token = thread_token
+        logs.debug('Starting frame grabber: {}'.format(self.name))
+        Thread(target=self._grab_thread, args=[thread_token], name='Frame grabber : {}'.format(self.name)).start()
+
+    def stop(self):
+        '''
+        Stop grabbing frames and clear the buffer. The RTSP session is closed asynchronously.
+        '''
+        with self._new_frame:
+            if self._thread_token == _TOKEN_INACTIVE:
+                return
+            self._thread_token = _TOKEN_INACTIVE
+            self._frames = [None] * len(self._frames)
+            self._timestamps = [0] * len(self._timestamps)
+            self._new_frame.notify_all()
+        if self.history:
+            self.history.clear()
+        logs.debug('Stopping frame grabber: {}'.format(self.name))
+
+    def is_running(self) -> bool:
+        '''
+        Check if the grabber is started. Does not mean that frames are currently received, see get_latest().
+        '''
+        return self._thread_token != _TOKEN_INACTIVE
+
+    def get_latest(self, max_age_seconds: float = None) -> tuple:
+        '''
+        Get the most recent frame
+        max_age_seconds: (optional) Ignore frame if older than the specified delay
+        returns (timestamp: float, frame: numpy array) or (None, None) if no frame is available
+        '''
+        with self._new_frame:
+            return self._get_latest(max_age_seconds)
+
+    def _get_latest(self, max_age_seconds: float = None) -> tuple:
+        '''
+        Get the most recent frame (internal, lock must be held)
+        '''
+        latest = (self._index - 1) % len(self._frames)
+        timestamp = self._timestamps[latest]
+        if self._frames[latest] is None or (max_age_seconds is not None and timestamp + max_age_seconds < time.time()):
+            return None, None
+        return timestamp, self._frames[latest]
+
+    def wait_for_frame(self, newer_than: float = 0, timeout_seconds: float = 10) -> tuple:
+        '''
+        Get a frame more recent than the specified timestamp, waiting for it if necessary
+        newer_than: Timestamp of previously retrieved frame, or 0 for any frame
+        timeout_seconds: Maximum delay to wait for the frame
+        returns (timestamp: float, frame: numpy array) or (None, None) on timeout or if grabber was stopped
+        '''
+        deadline = time.time() + timeout_seconds
+        with self._new_frame:
+            while self._thread_token != _TOKEN_INACTIVE:
+                timestamp, frame = self._get_latest()
+                if frame is not None and timestamp > newer_than:
+                    return timestamp, frame
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._new_frame.wait(remaining)
+        return None, None
+
+    def take_cpu_time(self) -> float:
+        '''
+        Get CPU time spent by the grabber thread on grabbing and decoding since previous call
+        returns CPU time in seconds
+        '''
+        with self._new_frame:
+            cpu_time = self._cpu_time
+            self._cpu_time = 0
+            return cpu_time
+
+    def _store(self, thread_token: int, frame):
+        '''
+        Store a frame in the ring buffer (internal, from grabber thread)
+        returns FALSE if the grabber was stopped or restarted
+        '''
+        timestamp = time.time()
+        with self._new_frame:
+            if self._thread_token != thread_token:
+                return False
+            self._frames[self._index] = frame
+            self._timestamps[self._index] = timestamp
+            self._index = (self._index + 1) % len(self._frames)
+            self._new_frame.notify_all()
+        if self.history and self.history.is_due(timestamp):
+            self.history.add(timestamp, frame)
+        return True
+
+    def _grab_thread(self, thread_token: int):
+        '''
+        Decode frames as they arrive, reconnecting with increasing delay when the stream is lost (internal thread)
+        '''
+        reconnect_delay = _RECONNECT_DELAY_MIN_SECONDS
+        while self._thread_token == thread_token:
+            cap = cv2.VideoCapture(self._url)
+            try:
+                if cap.isOpened():
+                    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+                    logs.debug('Frame grabber connected: {}'.format(self.name))
+                    last_frame_time = 0
+                    while self._thread_token == thread_token:
+                        cpu_start = time.thread_time()
+                        ret = cap.grab()
+                        frame = None
+                        if ret and time.time() - last_frame_time >= self.frame_interval:
+                            ret, frame = cap.retrieve()
+                        with self._new_frame:
+                            self._cpu_time += time.thread_time() - cpu_start
+                        if not ret:
+                            logs.debug('Frame grabber lost stream: {}'.format(self.name))
+                            break
+                        if frame is None:
+                            continue
+                        last_frame_time = time.time()
+                        if not self._store(thread_token, frame):
+                            break
+                        reconnect_delay = _RECONNECT_DELAY_MIN_SECONDS
+            finally:
+                cap.release()
+            if self._thread_token == thread_token:
+                time.sleep(reconnect_delay)
+                reconnect_delay = min(reconnect_delay * 2, _RECONNECT_DELAY_MAX_SECONDS)
+        logs.debug('Frame grabber stopped: {}'.format(self.name))
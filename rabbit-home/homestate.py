@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+# ====================================================================
+# homestate - aggregated snapshot of module states for Web UI clients
+# By ORelio (c) 2026 - CDDL 1.0
+# ====================================================================
+
+from flask import Blueprint, Response, request
+from threading import Lock, Event
+from typing import Callable
+
+import hashlib
+import json
+import time
+
+from logs import logs
+
+_getters = dict()
+_max_age = dict()
+_sections = dict()
+_section_time = dict()
+
+_dirty = set()
+_dirty_lock = Lock()
+_build_lock = Lock()
+_changed = Event()
+
+_version = 0
+_snapshot_hash = None
+_snapshot_body = None
+_snapshot_etag = None
+
+def register(module: str, getter: Callable, max_age: float = None):
+    '''
+    Register a module state for inclusion in the aggregated snapshot
+    module: Name of the snapshot section, e.g. 'lights'
+    getter: Function returning the json-serializable state of the module
+    max_age: (optional) Rebuild the section after the specified delay in seconds, for states depending on time
+    '''
+    with _build_lock:
+        if module in _getters:
+            raise ValueError('Duplicate home state section: {}'.format(module))
+        _getters[module] = getter
+        _max_age[module] = max_age
+    touch(module)
+
+def touch(module: str):
+    '''
+    Signal that the state of a module changed, so that its section is rebuilt on next snapshot
+    Cheap and non-blocking, can be called from any thread including while holding module locks
+    '''
+    with _dirty_lock:
+        _dirty.add(module)
+    _changed.set()
+
+def wait_for_change(timeout: float = None) -> bool:
+    '''
+    Wait until a module state is touched, for pushing updates to clients
+    timeout: (optional) Maximum delay to wait in seconds
+    returns TRUE if a module was touched, FALSE on timeout
+    '''
+    touched = _changed.wait(timeout)
+    _changed.clear()
+    return touched
+
+def _rebuild():
+    '''
+    Rebuild sections which changed or expired, and the snapshot if needed (internal, _build_lock must be held)
+    '''
+    global _version
+    global _snapshot_hash
+    global _snapshot_body
+    global _snapshot_etag
+    with _dirty_lock:
+        modules = set(_dirty)
+        _dirty.clear()
+    now = time.time()
+    for module in _getters:
+        if _max_age[module] is not None and _section_time.get(module, 0) + _max_age[module] < now:
+            modules.add(module)
+    for module in modules:
+        if module in _getters:
+            try:
+                _sections[module] = json.dumps(_getters[module](), sort_keys=True, separators=(',', ':'))
+                _section_time[module] = now
+            except Exception as e:
+                logs.error('Failed to build home state for "{}": {}'.format(module, e))
+    if len(modules) > 0 or _snapshot_body is None:
+        sections_json = ['"{}":{}'.format(module, _sections[module]) for module in sorted(_sections)]
+        sections_hash = hashlib.sha1(','.join(sections_json).encode('utf-8')).hexdigest()
+        if sections_hash != _snapshot_hash:
+            _version += 1
+            _snapshot_hash = sections_hash
+            _snapshot_body = '{{{}}}'.format(','.join(['"version":{}'.format(_version)] + sections_json)).encode('utf-8')
+            _snapshot_etag = '{}-{}'.format(_version, sections_hash[:16])
+
+def get_snapshot() -> tuple:
+    '''
+    Get the aggregated snapshot of all module states, only rebuilding sections which changed
+    returns (version: int, body: bytes, etag: str) - version only increments when content changes
+    '''
+    with _build_lock:
+        _rebuild()
+        return _version, _snapshot_body, _snapshot_etag
+
+def get_sections() -> tuple:
+    '''
+    Get the snapshot as separate sections, only rebuilding sections which changed
+    returns (version: int, sections: dict) - sections map module name to its state, already rendered as JSON
+    '''
+    with _build_lock:
+        _rebuild()
+        return _version, dict(_sections)
+
+# === HTTP API ===
+
+homestate_api = Blueprint('homestate_api', __name__)
+
+@homestate_api.route('/api/v1/state', methods = ['GET'])
+def homestate_api_get():
+    version, body, etag = get_snapshot()
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
@@ -6,8 +6,18 @@
 # ========================================
 
 from configparser import ConfigParser
-from flask import Flask
+from flask import Flask, Response, jsonify
+from threading import Thread, Lock
 
+import logging
+import os
+import queue
+import signal
+import time
+
+import datastore
+import homestate
+import notifications
 import soundplayer
 
 from logs import logs
@@ -24,6 +34,10 @@ from openings import openings_api
 from cameras import cameras_api
 from alarm import alarm_api
 from motion import motion_api
+from homestate import homestate_api
+from batch import batch_api
+from metrics import metrics_api
+from timelapse import timelapse_api
 from webui import web_ui
 
 config = ConfigParser()
@@ -31,6 +45,23 @@ config.read('config/httpserver.ini')
 bind_ip = config.get('Server', 'ip')
 bind_port = config.getint('Server', 'port')
 url = config.get('Server', 'url', fallback=None)
+mode = config.get('Server', 'mode', fallback='development').lower()
+threads = config.getint('Server', 'threads', fallback=8)
+connection_limit = config.getint('Server', 'connectionlimit', fallback=100)
+channel_timeout = config.getint('Server', 'channeltimeout', fallback=30)
+backlog = config.getint('Server', 'backlog', fallback=64)
+events_max_clients = config.getint('Server', 'eventsmaxclients', fallback=4)
+events_buffer = config.getint('Server', 'eventsbuffer', fallback=32)
+if not mode in ['development', 'production']:
+    raise ValueError('Invalid server mode: "{}", expecting development or production'.format(mode))
+if threads < 1:
+    raise ValueError('Invalid thread count: {}, minimum is 1'.format(threads))
+if connection_limit < threads:
+    raise ValueError('Connection limit ({}) must be at least the amount of threads ({})'.format(connection_limit, threads))
+if mode == 'production' and events_max_clients >= threads:
+    raise ValueError('Event stream clients ({}) must leave worker threads for other requests ({} threads)'.format(events_max_clients, threads))
+if events_buffer < 1:
+    raise ValueError('Invalid event buffer size: {}, minimum is 1'.format(events_buffer))
 
 app = Flask(__name__)
 app.logger = logs
@@ -47,9 +78,156 @@ app.register_blueprint(openings_api)
 app.register_blueprint(cameras_api)
 app.register_blueprint(alarm_api)
 app.register_blueprint(motion_api)
+app.register_blueprint(homestate_api)
+app.register_blueprint(batch_api)
+app.register_blueprint(metrics_api)
+app.register_blueprint(timelapse_api)
 app.register_blueprint(web_ui)
 
 soundplayer.set_base_url(url)
 
+# === Server-Sent Events ===
+
+_EVENTS_KEEPALIVE_SECONDS = 15
+_EVENTS_DEBOUNCE_SECONDS = 0.1
+
+_event_clients = list()
+_event_clients_lock = Lock()
+_event_sections = dict()
+_event_broadcast_thread_started = False
+
+def _event_message(event: str, version: int, sections: dict) -> str:
+    '''
+    Format a Server-Sent Event containing the specified home state sections (already rendered as JSON)
+    '''
+    data = ','.join(['"version":{}'.format(version)] + ['"{}":{}'.format(module, sections[module]) for module in sorted(sections)])
+    return 'id: {}\nevent: {}\ndata: {{{}}}\n\n'.format(version, event, data)
+
+def _event_push(client: queue.Queue, message: str):
+    '''
+    Push a message to a client buffer. A client too slow to keep up gets its buffer replaced by a full state message.
+    '''
+    try:
+        client.put_nowait(message)
+    except queue.Full:
+        while not client.empty():
+            try:
+                client.get_nowait()
+            except queue.Empty:
+                pass
+        version, sections = homestate.get_sections()
+        client.put_nowait(_event_message('state', version, sections))
+
+def _event_broadcast_thread():
+    '''
+    Render home state changes once as incremental deltas, and fan them out to all connected clients
+    '''
+    while True:
+        homestate.wait_for_change(timeout=_EVENTS_KEEPALIVE_SECONDS)
+        time.sleep(_EVENTS_DEBOUNCE_SECONDS) # Group changes happening at the same time in one message
+        version, sections = homestate.get_sections()
+        delta = dict()
+        for module in sections:
+            if _event_sections.get(module, None) != sections[module]:
+                delta[module] = sections[module]
+                _event_sections[module] = sections[module]
+        if len(delta) > 0:
+            message = _event_message('delta', version, delta)
+            with _event_clients_lock:
+                for client in _event_clients:
+                    _event_push(client, message)
+
+def _event_release(client: queue.Queue):
+    '''
+    Unregister an event stream client, freeing its slot. Does nothing if already unregistered.
+    '''
+    with _event_clients_lock:
+        if not client in _event_clients:
+            return
+        _event_clients.remove(client)
+    logs.debug('Event stream client disconnected ({} remaining)'.format(len(_event_clients)))
+
+def _event_stream(client: queue.Queue):
+    '''
+    Stream events for one client, starting with the full state, then deltas and keep-alive comments
+    '''
+    try:
+        version, sections = homestate.get_sections()
+        yield _event_message('state', version, sections)
+        while True:
+            try:
+                yield client.get(timeout=_EVENTS_KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield ': keepalive\n\n'
+    finally:
+        _event_release(client)
+
+@app.route('/api/v1/events', methods = ['GET'])
+def events_api_stream():
+    global _event_broadcast_thread_started
+    client = queue.Queue(maxsize=events_buffer)
+    # Slot is reserved right away so that simultaneous connections cannot exceed the limit
+    with _event_clients_lock:
+        if len(_event_clients) >= events_max_clients:
+            return jsonify({'success': False, 'message': 'Too many event stream clients'}), 503
+        _event_clients.append(client)
+        if not _event_broadcast_thread_started:
+            _event_broadcast_thread_started = True
+            Thread(target=_event_broadcast_thread, name='Event stream broadcast').start()
+    logs.debug('Event stream client connected ({} total)'.format(len(_event_clients)))
+    response = Response(_event_stream(client), mimetype='text/event-stream')
+    response.call_on_close(lambda: _event_release(client)) # Generator may never start if the response is aborted
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def _shutdown():
+    '''
+    Flush persistent data and logs, then terminate the service
+    '''
+    logs.info('Stopping service')
+    try:
+        datastore.flush()
+    except Exception as e:
+        logs.error('Failed to flush datastore: {}'.format(e))
+    try:
+        notifications.flush()
+    except Exception as e:
+        logs.error('Failed to spool notifications: {}'.format(e))
+    logging.shutdown()
+    # Background modules run non-daemon threads, make sure they do not keep the process alive
+    os._exit(0)
+
+def _run_production():
+    '''
+    Serve the app using a multi-threaded WSGI server with bounded workers and connection limits
+    In-flight requests are allowed to complete when the service receives SIGTERM or SIGINT
+    '''
+    from waitress import create_server
+    server = create_server(app,
+        host=bind_ip,
+        port=bind_port,
+        threads=threads,
+        connection_limit=connection_limit,
+        channel_timeout=channel_timeout,
+        backlog=backlog,
+        ident='Rabbit Home',
+    )
+    # Let waitress catch KeyboardInterrupt on SIGTERM, so that it gracefully stops its worker threads
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    logs.info('Serving on http://{}:{} (threads={}, connection_limit={}, channel_timeout={}s)'.format(
+        bind_ip, bind_port, threads, connection_limit, channel_timeout))
+    try:
+        server.run()
+    finally:
+        server.close()
+        _shutdown()
+
 def run():
-    app.run(host=bind_ip, port=bind_port)
+    '''
+    Run the HTTP server using the mode set in config
+    '''
+    if mode == 'production':
+        _run_production()
+    else:
+        app.run(host=bind_ip, port=bind_port)
@@ -6,25 +6,42 @@
 # ========================================================
 
 from flask import Blueprint, jsonify
-from threading import Thread, Lock
+from requests.adapters import HTTPAdapter
+from threading import Thread, Lock, Condition
+from concurrent.futures import ThreadPoolExecutor, wait
 from configparser import ConfigParser
+from dataclasses import dataclass
 from enum import Enum
 
 import json
+import logging
 import requests
 import time
 
+from events import EventHandler
 from logs import logs
 
+import homestate
+import metrics
 import notifications
 import plugs433
 import rabbits
+import timers
 
 class LightType(Enum):
     GROUP = 0
     SHELLY = 1
     PLUG = 2
 
+@dataclass
+class LightEvent():
+    light: str
+    on: bool
+    brightness: int
+    white: int
+    rabbit: str
+    external: bool # Change made outside Rabbit Home, e.g. using a wall switch, detected by polling
+
 _light_to_device = {}
 _light_to_type = {}
 _light_to_channel = {}
@@ -33,28 +50,60 @@ _light_to_white = {}
 _light_to_transition = {}
 _light_is_hidden = {}
 _light_is_dimmable = {}
+_light_is_polled = {}
 
 _command_locks = {}
 _command_tokens = {}
 
 _light_state = {}
 _state_lock = Lock()
+_light_command_time = {}
+_light_poll_failures = {}
+
+_device_sessions = {}
+_device_settings = {}
+_settings_lock = Lock()
 
 _rabbit_to_lights = {}
 _lights_to_rabbit = {}
 
+_scene_plans = {}
+
 config = ConfigParser()
 config.read('config/lights.ini')
 
 API_SWITCH='light/{CHANNEL}'
 API_SETTINGS='settings/'
+API_STATUS='status'
+
+_CONNECT_TIMEOUT_SECONDS = 2
+_READ_TIMEOUT_SECONDS = 5
+_GROUP_MAX_WORKERS = 8
+_GROUP_TIMEOUT_SECONDS = 15
+
+_POLL_INTERVAL_ACTIVE_SECONDS = 2
+_POLL_INTERVAL_IDLE_SECONDS = 60
+_POLL_ACTIVE_DURATION_SECONDS = 30
+_POLL_MAX_FAILURES = 2
+
+_group_executor = ThreadPoolExecutor(max_workers=_GROUP_MAX_WORKERS, thread_name_prefix='Switching Light Group')
+_poll_executor = ThreadPoolExecutor(max_workers=_GROUP_MAX_WORKERS, thread_name_prefix='Polling Light')
+_poll_condition = Condition()
+_poll_active_until = 0
+
+event_handler = EventHandler('Lights', log_level=logging.DEBUG)
 
 # Load configuration file
 for light_name_raw in config.sections():
     light_name = light_name_raw.lower()
+    if config.get(light_name_raw, 'Type').lower() == 'scene':
+        continue # Scenes are loaded below, once all lights are known
     light_type = LightType[config.get(light_name_raw, 'Type').upper()]
     light_device = config.get(light_name_raw, 'Device').lower()
     light_hidden = config.getboolean(light_name_raw, 'Hidden', fallback=False)
+    light_polled = config.getboolean(light_name_raw, 'Poll', fallback=(light_type == LightType.SHELLY))
+    if light_polled and light_type != LightType.SHELLY:
+        raise ValueError('{}: Poll attribute only valid for Type=Shelly'.format(light_name_raw))
     light_channel = config.getint(light_name_raw, 'Channel', fallback=0)
     if light_channel < 0:
         raise ValueError('Negative channel invalid for light: {}'.format(light_name_raw))
@@ -97,11 +146,17 @@ for light_name_raw in config.sections():
     _light_to_white[light_name] = light_white
     _light_to_transition[light_name] = light_transition
     _light_is_hidden[light_name] = light_hidden
+    _light_is_polled[light_name] = light_polled
     if light_type != LightType.GROUP:
         _light_is_dimmable[light_name] = light_dimmable
+    if light_type == LightType.SHELLY and not light_device in _device_sessions:
+        # Keep connection to each device open between requests
+        session = requests.Session()
+        session.mount('http://{}/'.format(light_device), HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        _device_sessions[light_device] = session
     _command_locks[light_name] = Lock()
-    _command_tokens[light_name] = 0;
-    logs.debug('Loaded light "{}" (Type={}, Device={}, Brightness={}, White={}, TransitionMs={}, Hidden={}, Dimmable={}, Rabbit={})'.format(
+    _command_tokens[light_name] = timers.Cancellation()
+    logs.debug('Loaded light "{}" (Type={}, Device={}, Brightness={}, White={}, TransitionMs={}, Hidden={}, Dimmable={}, Poll={}, Rabbit={})'.format(
         light_name,
         light_type,
         light_device,
@@ -110,6 +165,7 @@ for light_name_raw in config.sections():
         light_transition,
         light_hidden,
         light_dimmable,
+        light_polled,
         rabbit
     ))
 # Make sure group members exist
@@ -134,30 +190,82 @@ def _api_request(light: str, api_endpoint: str, parameters: dict = None, retries
         raise ValueError('Unknown light: {}'.format(light))
     if _light_to_type.get(light, None) != LightType.SHELLY:
         raise ValueError('Light "{}" is not of type Shelly.'.format(light))
+    ip = _light_to_device[light]
+    start_time = time.time()
     try:
-        ip = _light_to_device[light]
         url = f"http://{ip}/{api_endpoint}"
-        return json.loads(requests.get(url, params=parameters).text)
-    except (requests.exceptions.ConnectionError, json.decoder.JSONDecodeError) as err:
+        response = _device_sessions[ip].get(url, params=parameters, timeout=(_CONNECT_TIMEOUT_SECONDS, _READ_TIMEOUT_SECONDS))
+        result = json.loads(response.text)
+        metrics.record('lights.request.{}'.format(light), (time.time() - start_time) * 1000)
+        return result
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, json.decoder.JSONDecodeError) as err:
+        # Device may have rebooted or been reconfigured meanwhile: retrieve settings again on next use
+        _invalidate_settings(light)
+        metrics.increment('lights.errors.{}'.format(light))
         if retries <= 0:
             logs.debug(f"in _api_request({light}, {api_endpoint}, {str(parameters)}, {retries}):")
             raise
         return _api_request(light, api_endpoint, parameters, retries - 1)
 
-def _sleep(thread_token: int, light: str, delay_milliseconds: int):
+def _get_settings(light: str) -> dict:
+    '''
+    Get settings of a Shelly light, from cache if available
+    Settings are cached after first retrieval, and only retrieved again after being changed or on connection error
+    '''
+    ip = _light_to_device[light]
+    with _settings_lock:
+        settings = _device_settings.get(ip, None)
+    if settings is None:
+        settings = _api_request(light, API_SETTINGS)
+        with _settings_lock:
+            _device_settings[ip] = settings
+    return settings
+
+def _set_settings(light: str, settings: dict):
+    '''
+    Change settings of a Shelly light, updating the cache using settings returned by the device
+    settings: Settings to change (as dict)
+    '''
+    _invalidate_settings(light)
+    updated_settings = _api_request(light, API_SETTINGS, settings)
+    with _settings_lock:
+        _device_settings[_light_to_device[light]] = updated_settings
+
+def _invalidate_settings(light: str):
     '''
-    Sleep for the specified delay but stop early if the token changed
-    Note: The sleep delay resolution is 100ms rounded to the upper unit, e.g, 50ms is rounded to 100ms and so on.
+    Forget cached settings of a Shelly light
     '''
-    if delay_milliseconds > 0:
-        for i in range(0, delay_milliseconds, 100):
-            if _command_tokens.get(light, 0) == thread_token:
-                time.sleep(0.1)
+    with _settings_lock:
+        _device_settings.pop(_light_to_device[light], None)
 
-def _switch(thread_token: int, light: str, on: bool = False, brightness: int = None, white: int = None, transition: int = None, delay: int = None, delay_off: int = None):
+def _update_state(light: str, on: bool, brightness: int, white: int, external: bool = False) -> bool:
+    '''
+    Update state cache for a light, publishing an event if the state changed (internal)
+    external: State change detected by polling, not made through switch()
+    returns TRUE if the state changed
+    '''
+    state = {
+        'on': on,
+        'brightness': brightness,
+        'white': white
+    }
+    with _state_lock:
+        previous = _light_state.get(light, {'on': None, 'brightness': None, 'white': None})
+        _light_state[light] = state
+    if previous != state:
+        homestate.touch('lights')
+    # Brightness and color of a light which is off are not meaningful, e.g. switch() does not know
+    # the white value kept by the bulb when turning it off, so only on/off state is compared
+    changed = previous['on'] != on or (on is not False and previous != state)
+    if changed:
+        event_handler.dispatch(LightEvent(light, on, brightness, white, _lights_to_rabbit.get(light, None), external))
+    return changed
+
+def _switch(thread_token: timers.Cancellation, light: str, on: bool = False, brightness: int = None, white: int = None, transition: int = None, delay: int = None, delay_off: int = None):
     '''
     Switch a light (internal). See switch()
-    thread_token: Allows cancelling a delayed on/off operations by updating the token.
+    thread_token: Allows cancelling a delayed on/off operations by cancelling the token.
+    returns FALSE if the light could not be reached
     '''
     light = light.lower()
     if not light in _light_to_device:
@@ -193,52 +301,116 @@ def _switch(thread_token: int, light: str, on: bool = False, brightness: int = N
         light, on, brightness, white, transition))
 
     if delay:
-        _sleep(thread_token, light, delay)
+        thread_token.sleep(delay / 1000)
 
+    success = True
     with _command_locks[light]:
         try:
-            if _command_tokens.get(light, 0) == thread_token:
+            if not thread_token.is_cancelled():
 
                 if _light_to_type[light] == LightType.PLUG:
                     # Light is connected through its power socket, only on/off state is supported
                     plugs433.switch(_light_to_device[light], state=on)
-                    with _state_lock:
-                        _light_state[light] = {
-                            'on': on,
-                            'brightness': None,
-                            'white': None
-                        }
+                    _update_state(light, on, None, None)
                 else: # LightType.SHELLY
                     # Temporarily update the light transition setting if needed
+                    # Settings are cached, so in the common case only the switch request below is made
                     original_transition = transition
-                    original_settings = _api_request(light, API_SETTINGS)
+                    original_settings = _get_settings(light)
                     if 'transition' in original_settings:
                         original_transition = original_settings['transition']
                     if original_transition != transition:
-                        _api_request(light, API_SETTINGS, {'transition': str(transition)})
+                        _set_settings(light, {'transition': str(transition)})
 
                     # Switch light to desired brightness and color
-                    if _command_tokens.get(light, 0) == thread_token:
+                    if not thread_token.is_cancelled():
                         _api_request(light, API_SWITCH.replace('{CHANNEL}', str(_light_to_channel[light])), arguments)
-                        with _state_lock:
-                            _light_state[light] = {
-                                'on': on,
-                                'brightness': 0 if not on else brightness,
-                                'white': white
-                            }
+                        _light_command_time[light] = time.monotonic()
+                        _update_state(light, on, 0 if not on else brightness, white)
+                        _poll_soon()
 
                     # Wait for transition to finish playing before restoring it
                     if original_transition != transition:
-                        _sleep(thread_token, light, transition)
-                        _api_request(light, API_SETTINGS, {'transition': str(original_transition)})
+                        thread_token.sleep(transition / 1000)
+                        _set_settings(light, {'transition': str(original_transition)})
 
-        except requests.exceptions.ConnectionError:
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            success = False
             logs.warning('Failed to connect to light "{}"'.format(light))
             notifications.publish("L'éclairage '{}' n'a pas répondu".format(light), title='Eclairage injoignable', tags='electric_plug,bulb', rabbit=_lights_to_rabbit.get(light, None))
 
     if delay_off is not None:
         _switch(thread_token, light, on=False, transition=transition, delay=delay_off)
 
+    return success
+
+def _get_members(light: str) -> list:
+    '''
+    Get lights making up a light or group, expanding nested groups (internal)
+    returns list of lights which are not groups, without duplicates
+    '''
+    light = light.lower()
+    if not light in _light_to_device:
+        raise ValueError('Unknown light: {}'.format(light))
+    if _light_to_type[light] != LightType.GROUP:
+        return [light]
+    members = []
+    for member in _light_to_device[light]:
+        for submember in _get_members(member):
+            if not submember in members:
+                members.append(submember)
+    return members
+
+def switch_many(lights: list, on: bool = False, brightness: int = None, white: int = None, transition: int = None, delay: int = None, delay_off: int = None, synchronous: bool = False) -> bool:
+    '''
+    Switch several lights or groups at once. Each light is switched only once, even if it belongs to several groups.
+    lights: Names of lights or groups to operate
+    synchronous: Switch lights concurrently and wait for all of them, up to a shared deadline
+    See switch() for other parameters
+    returns FALSE if synchronous and at least one light failed to switch before deadline
+    '''
+    members = []
+    for light in lights:
+        for member in _get_members(light):
+            if not member in members:
+                members.append(member)
+
+    if not synchronous:
+        for member in members:
+            switch(member, on=on, brightness=brightness, white=white, transition=transition, delay=delay, delay_off=delay_off)
+        return True
+
+    commands = {}
+    for member in members:
+        commands[member] = {'on': on, 'brightness': brightness, 'white': white, 'transition': transition, 'delay': delay, 'delay_off': delay_off}
+    timeout = _GROUP_TIMEOUT_SECONDS + ((delay or 0) + (delay_off or 0)) / 1000
+    return _switch_concurrently(commands, timeout, 'lights.group')
+
+def _switch_concurrently(commands: dict, timeout: float, metric: str) -> bool:
+    '''
+    Switch lights concurrently and wait for all of them, up to a shared deadline (internal)
+    commands: dict mapping light (not a group) to switch() arguments
+    timeout: Deadline in seconds for all lights to finish switching
+    metric: Name of the latency metric to record, e.g. lights.group
+    returns FALSE if at least one light failed to switch before deadline
+    '''
+    start_time = time.time()
+    futures = {}
+    for light, arguments in commands.items():
+        futures[light] = _group_executor.submit(switch, light, synchronous=True, **arguments)
+    wait(futures.values(), timeout=timeout)
+
+    failed = []
+    for light, future in futures.items():
+        if not future.done() or future.exception() is not None or future.result() is False:
+            failed.append(light)
+    metrics.record(metric, (time.time() - start_time) * 1000)
+    if len(failed) > 0:
+        logs.warning('Failed to switch {} out of {} lights within {}s: {}'.format(
+            len(failed), len(commands), round(timeout, 1), ', '.join(failed)))
+        return False
+    return True
+
 def switch(light: str, on: bool = False, brightness: int = None, white: int = None, transition: int = None, delay: int = None, delay_off: int = None, synchronous: bool = False):
     '''
     Switch a light
@@ -249,7 +421,8 @@ def switch(light: str, on: bool = False, brightness: int = None, white: int = No
     transition: transition delay from 0ms (immediate) to 5000ms (5 seconds), default set in config
     delay: delay before switching the light from 0ms (immediate) to any value in milliseconds, default 0ms
     delay_off: timeout delay before auto-switching the light off, from None (never) to any value in milliseconds, default Never
-    synchronous: Wait for light to finish switching before returning
+    synchronous: Wait for light to finish switching before returning. Group members are switched concurrently.
+    returns FALSE if synchronous and the light, or one of the group members, failed to switch
     '''
     light = light.lower()
     if not light in _light_to_device:
@@ -261,25 +434,26 @@ def switch(light: str, on: bool = False, brightness: int = None, white: int = No
         logs.info('Adjusting group {}: {}, on={}, brightness={}, white={}, transition={}'.format(
             light, '+'.join(_light_to_device[light]), on, brightness, white, transition
         ))
-        for member in _light_to_device[light]:
-            switch(
-                light=member,
-                on=on,
-                brightness=brightness,
-                white=white,
-                transition=transition,
-                delay=delay,
-                delay_off=delay_off,
-                synchronous=synchronous
-            )
-        return
+        return switch_many(
+            _light_to_device[light],
+            on=on,
+            brightness=brightness,
+            white=white,
+            transition=transition,
+            delay=delay,
+            delay_off=delay_off,
+            synchronous=synchronous
+        )
 
+    # Cancel any delayed operation right away, waking up its thread if sleeping
+    _command_tokens[light].cancel()
     with _command_locks[light]:
-        thread_token = round(time.time() * 1000)
+        _command_tokens[light].cancel()
+        thread_token = timers.Cancellation()
         _command_tokens[light] = thread_token
 
     if synchronous:
-        _switch(
+        return _switch(
             thread_token,
             light=light,
             on=on,
@@ -290,18 +464,18 @@ def switch(light: str, on: bool = False, brightness: int = None, white: int = No
             delay_off=delay_off
         )
     else:
-        _switch_thread = Thread(target=_switch,
-            args=[thread_token, light],
-            kwargs={
-                'on': on,
-                'brightness': brightness,
-                'white': white,
-                'transition': transition,
-                'delay': delay,
-                'delay_off': delay_off},
+        # Delayed operations wait on the shared timer scheduler, no thread is started until the delay elapses
+        timers.schedule((delay or 0) / 1000, _switch,
+            thread_token,
+            light,
+            on=on,
+            brightness=brightness,
+            white=white,
+            transition=transition,
+            delay_off=delay_off,
             name='Switching Light'
         )
-        _switch_thread.start()
+        return True
 
 def get_all() -> list:
     '''
@@ -328,9 +502,7 @@ def switch_for_rabbit(rabbit: str, on: bool = False, brightness: int = None, whi
     delay: delay before switching the light from 0ms (immediate) to any value in milliseconds, default 0ms
     delay_off: timeout delay before auto-switching the light off, from None (never) to any value in milliseconds, default Never
     '''
-    lights = get_for_rabbit(rabbit)
-    for light in lights:
-        switch(light, on=on, brightness=brightness, white=white, transition=transition, delay=delay, delay_off=delay_off)
+    switch_many(get_for_rabbit(rabbit), on=on, brightness=brightness, white=white, transition=transition, delay=delay, delay_off=delay_off)
 
 def is_dimmable(light: str):
     '''
@@ -385,12 +557,203 @@ def get_state(light: str):
             }
         return state
 
-# === HTTP API ===
+# === Scenes ===
 
-lights_api = Blueprint('lights_api', __name__)
+_SCENE_OPTION_RANGES = {
+    'brightness': (1, 100),
+    'white': (0, 100),
+    'transition': (0, 5000),
+}
 
-@lights_api.route('/api/v1/lights', methods = ['GET'])
-def lights_api_get():
+def _compile_scene(scene_name_raw: str) -> dict:
+    '''
+    Compile a scene from config into a per-light command plan (internal)
+    Entries are applied in order, so that a light can override settings of an earlier group.
+    returns dict mapping light (not a group) to switch() arguments and expected state after switching
+    '''
+    plan = {}
+    for (key, val) in config.items(scene_name_raw):
+        if key.lower() == 'type':
+            continue
+        if not key.lower() in _light_to_device:
+            raise ValueError('Scene "{}": Unknown light "{}"'.format(scene_name_raw, key))
+        state_data = val.split('/')
+        state = state_data[0].strip().lower()
+        if not state in ['on', 'off']:
+            raise ValueError('Scene "{}": Invalid state for "{}", expecting on|off, got "{}"'.format(scene_name_raw, key, state))
+        options = {}
+        for option in state_data[1:]:
+            name, _, value = option.partition('=')
+            name = name.strip().lower()
+            if not name in _SCENE_OPTION_RANGES:
+                raise ValueError('Scene "{}": Unknown option for "{}": "{}"'.format(scene_name_raw, key, option))
+            try:
+                value = int(value.strip())
+            except ValueError:
+                raise ValueError('Scene "{}": Invalid {} for "{}", expecting a number, got "{}"'.format(scene_name_raw, name, key, value.strip()))
+            # Same ranges as light settings
+            minimum, maximum = _SCENE_OPTION_RANGES[name]
+            options[name] = min(max(value, minimum), maximum)
+        for light in _get_members(key):
+            on = state == 'on'
+            brightness = options.get('brightness', _light_to_brightness[light] if on else 0)
+            white = options.get('white', _light_to_white[light])
+            if brightness == 0:
+                on = False
+            if _light_to_type[light] == LightType.PLUG:
+                expected_state = {'on': on, 'brightness': None, 'white': None}
+            else:
+                expected_state = {'on': on, 'brightness': brightness if on else 0, 'white': white}
+            plan[light] = {
+                'arguments': {
+                    'on': on,
+                    'brightness': brightness if on else None,
+                    'white': white,
+                    'transition': options.get('transition', _light_to_transition[light]),
+                },
+                'state': expected_state,
+            }
+    return plan
+
+def get_scenes() -> list:
+    '''
+    Get all lighting scenes
+    '''
+    return list(_scene_plans.keys())
+
+def apply_scene(scene: str, force: bool = False, synchronous: bool = False) -> bool:
+    '''
+    Apply a lighting scene defined in config
+    Lights already in the desired state according to the state cache are left untouched.
+    scene: Name of the scene
+    force: Also switch lights already in the desired state
+    synchronous: Switch lights concurrently and wait for all of them, up to a shared deadline
+    returns FALSE if synchronous and at least one light failed to switch before deadline
+    '''
+    scene = scene.lower()
+    if not scene in _scene_plans:
+        raise ValueError('Unknown scene: {}'.format(scene))
+    commands = {}
+    for light, step in _scene_plans[scene].items():
+        if force or get_state(light) != step['state']:
+            commands[light] = step['arguments']
+    logs.info('Applying scene {}: {} lights to switch, {} already set'.format(
+        scene, len(commands), len(_scene_plans[scene]) - len(commands)))
+    if not synchronous:
+        for light, arguments in commands.items():
+            switch(light, **arguments)
+        return True
+    return _switch_concurrently(commands, _GROUP_TIMEOUT_SECONDS, 'lights.scene')
+
+for scene_name_raw in config.sections():
+    if config.get(scene_name_raw, 'Type').lower() == 'scene':
+        if scene_name_raw.lower() in _light_to_device or scene_name_raw.lower() in _scene_plans:
+            raise ValueError('Duplicate light or scene name: {}'.format(scene_name_raw))
+        _scene_plans[scene_name_raw.lower()] = _compile_scene(scene_name_raw)
+        logs.debug('Loaded scene "{}": {}'.format(scene_name_raw.lower(), ', '.join(
+            ['{}={}'.format(light, step['state']) for light, step in _scene_plans[scene_name_raw.lower()].items()])))
+
+# === State polling ===
+
+def _poll_soon():
+    '''
+    Poll lights more frequently for a while, e.g. after a command, to catch up with further changes (internal)
+    '''
+    global _poll_active_until
+    with _poll_condition:
+        _poll_active_until = time.monotonic() + _POLL_ACTIVE_DURATION_SECONDS
+        _poll_condition.notify()
+
+def _poll_device(device: str, device_lights: list) -> bool:
+    '''
+    Retrieve status of a Shelly device and reconcile state cache of its lights (internal, from polling pool)
+    device: IP address of the device
+    device_lights: Lights using this device, one per channel
+    returns TRUE if the state of at least one light changed
+    '''
+    poll_time = time.monotonic()
+    changed = False
+    try:
+        status = _api_request(device_lights[0], API_STATUS, retries=0)
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, json.decoder.JSONDecodeError):
+        for light in device_lights:
+            _light_poll_failures[light] = _light_poll_failures.get(light, 0) + 1
+            if _light_poll_failures[light] == _POLL_MAX_FAILURES:
+                # Bulb is probably powered off using a wall switch, state is unknown until it comes back
+                logs.debug('Light "{}" not responding to polling, state is now unknown'.format(light))
+                changed = _update_state(light, None, None, None, external=True) or changed
+        return changed
+    channels = status.get('lights', [])
+    for light in device_lights:
+        _light_poll_failures[light] = 0
+        channel = _light_to_channel[light]
+        if channel >= len(channels):
+            logs.warning('Light "{}": No channel {} in device status'.format(light, channel))
+            continue
+        # Status may predate a command sent meanwhile, in which case it is discarded
+        if _command_locks[light].locked() or _light_command_time.get(light, 0) >= poll_time:
+            continue
+        on = channels[channel].get('ison', None)
+        brightness = channels[channel].get('brightness', None)
+        white = channels[channel].get('white', None)
+        if on is False:
+            brightness = 0
+        if _update_state(light, on, brightness, white, external=True):
+            logs.info('Light "{}" changed outside Rabbit Home: on={}, brightness={}, white={}'.format(light, on, brightness, white))
+            changed = True
+    return changed
+
+def _poll_all() -> bool:
+    '''
+    Poll all Shelly devices concurrently, in a single sweep (internal)
+    returns TRUE if the state of at least one light changed
+    '''
+    devices = {}
+    for light in _light_to_device:
+        if _light_is_polled.get(light, False):
+            device = _light_to_device[light]
+            if not device in devices:
+                devices[device] = []
+            devices[device].append(light)
+    start_time = time.time()
+    futures = [_poll_executor.submit(_poll_device, device, device_lights) for device, device_lights in devices.items()]
+    done, not_done = wait(futures, timeout=_CONNECT_TIMEOUT_SECONDS + _READ_TIMEOUT_SECONDS)
+    changed = False
+    for future in done:
+        if future.exception() is not None:
+            logs.error('Failed to poll light: {}'.format(future.exception()))
+        elif future.result():
+            changed = True
+    metrics.record('lights.poll', (time.time() - start_time) * 1000)
+    return changed
+
+def _poll_thread():
+    '''
+    Regularly poll Shelly devices to reflect changes made outside Rabbit Home, e.g. using a wall switch (internal thread)
+    Polling is faster right after a command or a change, and slower when lights are idle.
+    '''
+    last_poll = 0
+    while True:
+        with _poll_condition:
+            now = time.monotonic()
+            interval = _POLL_INTERVAL_ACTIVE_SECONDS if now < _poll_active_until else _POLL_INTERVAL_IDLE_SECONDS
+            if now < last_poll + interval:
+                _poll_condition.wait(last_poll + interval - now)
+                continue
+        last_poll = time.monotonic()
+        if _poll_all():
+            # Someone is operating lights, expect further changes
+            _poll_soon()
+
+if True in _light_is_polled.values():
+    Thread(target=_poll_thread, name='Lights polling').start()
+
+# === HTTP API ===
+
+def _api_state() -> dict:
+    '''
+    Get state of all non-hidden lights for HTTP API and home state snapshot
+    '''
     lights = {}
     for light in _light_to_device:
         if not _light_is_hidden.get(light, False):
@@ -400,7 +763,26 @@ def lights_api_get():
                 del state['brightness']
                 del state['white']
             lights[light] = state
-    return jsonify(lights)
+    return lights
+
+homestate.register('lights', _api_state)
+
+lights_api = Blueprint('lights_api', __name__)
+
+@lights_api.route('/api/v1/lights', methods = ['GET'])
+def lights_api_get():
+    return jsonify(_api_state())
+
+@lights_api.route('/api/v1/lights/scenes', methods = ['GET'])
+def lights_api_get_scenes():
+    return jsonify(get_scenes())
+
+@lights_api.route('/api/v1/lights/scenes/<scene>', methods = ['POST'])
+def lights_api_apply_scene(scene):
+    if not scene or not scene.lower() in _scene_plans:
+        return jsonify({'success': False, 'message': 'Not Found'}), 404
+    success = apply_scene(scene, synchronous=True)
+    return jsonify({'success': success})
 
 @lights_api.route('/api/v1/lights/<light>/<state>', methods = ['POST'])
 def plugs433_api_set(light, state):
@@ -410,5 +792,5 @@ def plugs433_api_set(light, state):
         return jsonify({'success': False, 'message': 'Invalid parameter'}), 400
     light = light.lower()
     on = (state.upper() == 'ON')
-    switch(light=light, on=on, synchronous=True)
-    return jsonify({'success': True})
+    success = switch(light=light, on=on, synchronous=True)
+    return jsonify({'success': success})
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+# ===================================================================
+# metrics - latency and counter statistics for monitoring performance
+# By ORelio (c) 2026 - CDDL 1.0
+# ===================================================================
+
+from collections import deque
+from flask import Blueprint, jsonify
+from threading import Lock
+
+_WINDOW_SIZE = 100
+
+_lock = Lock()
+_latencies = dict()
+_counters = dict()
+_gauges = dict()
+
+class LatencyStats:
+    '''
+    Latency statistics for an operation: totals since startup, and percentiles over the most recent samples
+    '''
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.last = 0.0
+        self.window = deque(maxlen=_WINDOW_SIZE)
+
+    def add(self, milliseconds: float):
+        self.count += 1
+        self.total += milliseconds
+        self.maximum = max(self.maximum, milliseconds)
+        self.last = milliseconds
+        self.window.append(milliseconds)
+
+    def to_dict(self) -> dict:
+        window = sorted(self.window)
+        percentile = lambda p: round(window[min(len(window) - 1, int(len(window) * p))], 1) if len(window) > 0 else None
+        return {
+            'count': self.count,
+            'average': round(self.total / self.count, 1) if self.count > 0 else None,
+            'maximum': round(self.maximum, 1),
+            'last': round(self.last, 1),
+            'p50': percentile(0.50),
+            'p95': percentile(0.95),
+        }
+
+def record(name: str, milliseconds: float):
+    '''
+    Record duration of an operation
+    name: Name of the operation, prefixed with module name, e.g. 'cameras.upload'
+    milliseconds: Duration of the operation
+    '''
+    with _lock:
+        if not name in _latencies:
+            _latencies[name] = LatencyStats()
+        _latencies[name].add(milliseconds)
+
+def increment(name: str, amount: int = 1):
+    '''
+    Increment a counter
+    name: Name of the counter, prefixed with module name, e.g. 'cameras.dropped'
+    amount: Amount to add to the counter
+    '''
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+def set_gauge(name: str, value: float):
+    '''
+    Set current value of a gauge
+    name: Name of the gauge, prefixed with module name, e.g. 'notifications.queue_depth'
+    value: Current value, e.g. amount of items in a queue
+    '''
+    with _lock:
+        _gauges[name] = value
+
+def get_latency(name: str) -> dict:
+    '''
+    Get latency statistics for an operation, in milliseconds
+    returns dict with count, average, maximum, last, p50, p95 - or None if the operation was never recorded
+    '''
+    with _lock:
+        if name in _latencies:
+            return _latencies[name].to_dict()
+    return None
+
+def get_counter(name: str) -> int:
+    '''
+    Get value of a counter, 0 if never incremented
+    '''
+    with _lock:
+        return _counters.get(name, 0)
+
+def get_all() -> dict:
+    '''
+    Get all latency statistics, counters and gauges
+    '''
+    with _lock:
+        return {
+            'latencies': {name: stats.to_dict() for name, stats in _latencies.items()},
+            'counters': dict(_counters),
+            'gauges': dict(_gauges),
+        }
+
+# === HTTP API ===
+
+metrics_api = Blueprint('metrics_api', __name__)
+
+@metrics_api.route('/api/v1/metrics', methods = ['GET'])
+def metrics_api_get():
+    return jsonify(get_all())
@@ -16,6 +16,7 @@ from events import EventHandler
 from logs import logs
 
 import enocean
+import homestate
 import rabbits
 import sensorhealth
 
@@ -95,6 +96,7 @@ def enocean_callback(sender_name: str, event: object):
         if event.motion:
             with _last_motion_lock:
                 _last_motion_time_by_device[device] = _last_motion_time_by_rabbit[device] = time.time()
+            homestate.touch('motion')
             event_handler.dispatch(MotionEvent(sensor, rabbit, outside))
         sensorhealth.heartbeat('motion', sensor, battery_low=event.battery_low)
     else:
@@ -104,10 +106,10 @@ enocean.motion_event_handler.subscribe(enocean_callback)
 
 # === HTTP API ===
 
-motion_api = Blueprint('motion_api', __name__)
-
-@motion_api.route('/api/v1/motion', methods = ['GET'])
-def motion_api_get():
+def _api_state() -> dict:
+    '''
+    Get last motion time of all sensors for HTTP API and home state snapshot
+    '''
     response = {}
     with _last_motion_lock:
         for device in _device_to_name:
@@ -115,4 +117,12 @@ def motion_api_get():
             response[_device_to_name[device]] = {
                 'refreshed': refreshed if refreshed > 0 else None
             }
-    return jsonify(response)
+    return response
+
+homestate.register('motion', _api_state)
+
+motion_api = Blueprint('motion_api', __name__)
+
+@motion_api.route('/api/v1/motion', methods = ['GET'])
+def motion_api_get():
+    return jsonify(_api_state())
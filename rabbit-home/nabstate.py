@@ -12,6 +12,7 @@ from typing import Callable
 
 import time
 
+import homestate
 import rabbits
 import nabweb
 import nabd
@@ -62,6 +63,7 @@ def _cache_current_state(rabbit: str, state: str):
     nabaztag_ip = rabbits.get_ip(rabbit)
     with _state_lock:
         _stateinfo[nabaztag_ip] = state
+    homestate.touch('rabbits')
 
 def _handle_sleep_wakeup_event(rabbit: str, state: str):
     '''
@@ -171,17 +173,25 @@ Thread(target=_auto_initialize, name='Nabstate Initialization').start()
 
 # === HTTP API ===
 
-nabstate_api = Blueprint('nabstate_api', __name__)
-
-@nabstate_api.route('/api/v1/rabbits', methods = ['GET'])
-def nabstate_api_get():
+def _api_state() -> dict:
+    '''
+    Get state of all rabbits for HTTP API and home state snapshot
+    '''
     result = {}
     for rabbit in rabbits.get_all():
         state = get_state(rabbit)
         if not state in [STATE_OFFLINE, STATE_ASLEEP]:
             state = 'awake'
         result[rabbit] = state
-    return jsonify(result)
+    return result
+
+homestate.register('rabbits', _api_state)
+
+nabstate_api = Blueprint('nabstate_api', __name__)
+
+@nabstate_api.route('/api/v1/rabbits', methods = ['GET'])
+def nabstate_api_get():
+    return jsonify(_api_state())
 
 @nabstate_api.route('/api/v1/rabbits/<rabbit>/<state>', methods = ['POST'])
 def nabstate_api_set(rabbit, state):
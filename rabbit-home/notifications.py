@@ -9,11 +9,17 @@ import requests
 import base64
 
 from configparser import ConfigParser
-from threading import Thread
+from requests.adapters import HTTPAdapter
+from threading import Thread, Condition, Lock
 from strenum import StrEnum
 
+import heapq
+import json
 import logging
+import metrics
+import os
 import rabbits
+import time
 
 from logs import logs
 
@@ -31,9 +37,41 @@ service_url = config.get('Notifications', 'service')
 default_publish_topic = config.get('Notifications', 'default_topic')
 access_token = config.get('Notifications', 'token', fallback=None)
 rabbits_as_topic = config.getboolean('Notifications', 'rabbits_as_topic', fallback=False)
+rate_limit = config.getboolean('Notifications', 'rate_limit', fallback=True)
+coalesce_window = config.getint('Notifications', 'coalesce_window', fallback=60)
+topic_burst = config.getint('Notifications', 'topic_burst', fallback=10)
+topic_per_minute = config.getfloat('Notifications', 'topic_per_minute', fallback=20)
+tags_burst = config.getint('Notifications', 'tags_burst', fallback=3)
+tags_per_minute = config.getfloat('Notifications', 'tags_per_minute', fallback=6)
+if rate_limit and (coalesce_window < 1 or topic_burst < 1 or topic_per_minute <= 0 or tags_burst < 1 or tags_per_minute <= 0):
+    raise ValueError('Invalid rate limiting settings in notifications.ini')
 if not service_url.endswith('/'):
     service_url = service_url + '/'
 
+_SPOOL_DIR = 'cache/notifications'
+_QUEUE_SIZE = 200
+_REQUEST_TIMEOUT_SECONDS = 30
+_RETRY_DELAY_MIN_SECONDS = 2
+_RETRY_DELAY_MAX_SECONDS = 300
+
+_PRIORITY_RANK = {
+    Priority.HIGHEST: 0,
+    Priority.HIGH: 1,
+    Priority.NORMAL: 2,
+    Priority.LOW: 3,
+    Priority.LOWEST: 4,
+}
+
+# Single keep-alive connection to the ntfy server, shared by all requests
+_session = requests.Session()
+_session.mount(service_url, HTTPAdapter(pool_connections=1, pool_maxsize=2))
+
+_queue = []
+_queue_condition = Condition()
+_queue_sequence = 0
+_queue_delivering = None
+_spool_lock = Lock()
+
 def _encode_header_b64(text: str) -> str:
     return '=?UTF-8?B?{}?='.format(base64.b64encode(text.encode(encoding='utf-8')).decode('ascii'))
 
@@ -73,10 +111,254 @@ def _publish(message, title=None, priority=None, tags=None, topic=None, rabbit=N
         headers['Content-Type'] = 'text/plain; charset=utf-8'
         request_data = message.encode('utf-8')
 
-    resp = requests.post(service_url + topic, data=request_data, headers=headers)
+    resp = _session.post(service_url + topic, data=request_data, headers=headers, timeout=_REQUEST_TIMEOUT_SECONDS)
     resp.raise_for_status()
 
-def publish(message, title=None, priority=None, tags=None, topic=None, rabbit=None, synchronous=False, auto_trim=True, attachment=None, filename=None):
+# === Delivery queue ===
+# Messages are delivered by a single worker thread, most urgent first, retrying until the server accepts them.
+# Messages which could not be delivered yet are spooled on disk, and so are pending messages on shutdown.
+
+def _enqueue(notification: dict, queued_time: float = None, spool_file: str = None):
+    '''
+    Add a message to the delivery queue. When the queue is full, the least urgent message is dropped,
+    except the message being delivered. (internal)
+    notification: Arguments for _publish()
+    queued_time: Time when the message was first queued, for measuring delivery latency
+    spool_file: Spool file containing the message, if already spooled
+    '''
+    global _queue_sequence
+    with _queue_condition:
+        _queue_sequence += 1
+        item = (_PRIORITY_RANK.get(notification.get('priority', None), _PRIORITY_RANK[Priority.NORMAL]), _queue_sequence, {
+            'notification': notification,
+            'queued': queued_time if queued_time else time.time(),
+            'spool_file': spool_file,
+        })
+        heapq.heappush(_queue, item)
+        if len(_queue) > _QUEUE_SIZE:
+            least_urgent = max(queued for queued in _queue if queued is not _queue_delivering)
+            _queue.remove(least_urgent)
+            heapq.heapify(_queue)
+            _unspool(least_urgent[2])
+            metrics.increment('notifications.dropped')
+            logs.warning('Notification queue full, dropping: {}'.format(least_urgent[2]['notification']['message']))
+        metrics.set_gauge('notifications.queue_depth', len(_queue))
+        _queue_condition.notify()
+
+def _spool(item: dict):
+    '''
+    Save a queued message to disk, if not already saved (internal)
+    '''
+    if item['spool_file'] is not None:
+        return
+    notification = dict(item['notification'])
+    if notification.get('attachment', None) is not None:
+        notification['attachment'] = base64.b64encode(notification['attachment']).decode('ascii')
+    if notification.get('priority', None) is not None:
+        notification['priority'] = str(notification['priority'])
+    with _spool_lock:
+        os.makedirs(_SPOOL_DIR, exist_ok=True)
+        spool_file = os.path.join(_SPOOL_DIR, '{:.6f}.json'.format(item['queued']))
+        while os.path.exists(spool_file):
+            spool_file = spool_file[:-5] + '_.json'
+        with open(spool_file, 'w', encoding='utf-8') as f:
+            json.dump({'queued': item['queued'], 'notification': notification}, f)
+    item['spool_file'] = spool_file
+
+def _unspool(item: dict):
+    '''
+    Delete saved message from disk, if any (internal)
+    '''
+    if item['spool_file'] is not None:
+        with _spool_lock:
+            if os.path.isfile(item['spool_file']):
+                os.remove(item['spool_file'])
+        item['spool_file'] = None
+
+def _load_spool():
+    '''
+    Queue messages saved on disk by a previous instance (internal)
+    '''
+    if not os.path.isdir(_SPOOL_DIR):
+        return
+    for filename in sorted(os.listdir(_SPOOL_DIR)):
+        spool_file = os.path.join(_SPOOL_DIR, filename)
+        try:
+            with open(spool_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            notification = data['notification']
+            if notification.get('attachment', None) is not None:
+                notification['attachment'] = base64.b64decode(notification['attachment'])
+            if notification.get('priority', None) is not None:
+                notification['priority'] = Priority(notification['priority'])
+            _enqueue(notification, queued_time=data['queued'], spool_file=spool_file)
+        except Exception as e:
+            logs.error('Failed to load spooled notification {}, discarding: {}'.format(filename, e))
+            os.remove(spool_file)
+    if len(_queue) > 0:
+        logs.info('Loaded {} spooled notifications'.format(len(_queue)))
+
+def _is_retryable(error: Exception) -> bool:
+    '''
+    Check if a delivery error is temporary: server unreachable, timeout, server error or rate limiting (internal)
+    '''
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(error, requests.exceptions.HTTPError):
+        return error.response is None or error.response.status_code >= 500 or error.response.status_code == 429
+    return False
+
+def _delivery_thread():
+    '''
+    Deliver queued messages, most urgent first, retrying with increasing delay on failure (internal thread)
+    '''
+    global _queue_delivering
+    retry_delay = _RETRY_DELAY_MIN_SECONDS
+    while True:
+        with _queue_condition:
+            while len(_queue) == 0:
+                _queue_condition.wait()
+            item = _queue[0]
+            _queue_delivering = item
+        start_time = time.time()
+        try:
+            _publish(**item[2]['notification'])
+            metrics.record('notifications.request', (time.time() - start_time) * 1000)
+            metrics.record('notifications.delivery', (time.time() - item[2]['queued']) * 1000)
+            metrics.increment('notifications.sent')
+            retry_delay = _RETRY_DELAY_MIN_SECONDS
+        except Exception as e:
+            if not _is_retryable(e):
+                # Retrying would block less urgent messages forever, e.g. message rejected by server or invalid arguments
+                logs.error('Failed to deliver notification, dropping: {}: {}'.format(e, item[2]['notification'].get('message', None)))
+                metrics.increment('notifications.dropped')
+            else:
+                logs.warning('Failed to deliver notification, retrying in {}s: {}'.format(retry_delay, e))
+                metrics.increment('notifications.retries')
+                try:
+                    _spool_all() # Server unreachable, make sure pending messages survive a restart
+                except OSError as e:
+                    logs.error('Failed to spool notification: {}'.format(e))
+                # Retry early if a more urgent message is queued meanwhile, e.g. alarm notification
+                with _queue_condition:
+                    _queue_delivering = None
+                    _queue_condition.wait_for(lambda: _queue[0] is not item, timeout=retry_delay)
+                retry_delay = min(retry_delay * 2, _RETRY_DELAY_MAX_SECONDS)
+                continue
+        with _queue_condition:
+            _queue_delivering = None
+            _queue.remove(item)
+            heapq.heapify(_queue)
+            metrics.set_gauge('notifications.queue_depth', len(_queue))
+        _unspool(item[2])
+
+def _spool_all() -> int:
+    '''
+    Save all pending messages to disk (internal)
+    returns amount of pending messages
+    '''
+    with _queue_condition:
+        items = [item[2] for item in _queue]
+    for item in items:
+        _spool(item)
+    return len(items)
+
+# === Coalescing ===
+# Each message takes a token from the bucket of its topic, and from the bucket of its kind (topic, tags, title).
+# When a bucket is empty, messages of the same kind are held during coalesce_window, then sent as a single summary.
+# HIGHEST priority messages are always sent immediately.
+
+class _TokenBucket:
+    '''
+    Allow bursts of up to capacity messages, refilling at the specified rate
+    '''
+    def __init__(self, capacity: int, per_minute: float):
+        self.capacity = capacity
+        self.per_second = per_minute / 60.0
+        self.tokens = float(capacity)
+        self.updated = time.time()
+
+    def available(self) -> bool:
+        now = time.time()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.per_second)
+        self.updated = now
+        return self.tokens >= 1
+
+    def take(self):
+        self.tokens -= 1
+
+_buckets = {}
+_held = {}
+_coalesce_lock = Lock()
+
+def _get_bucket(key: tuple, capacity: int, per_minute: float) -> _TokenBucket:
+    '''
+    Get token bucket for the specified key (internal, _coalesce_lock must be held)
+    '''
+    if not key in _buckets:
+        _buckets[key] = _TokenBucket(capacity, per_minute)
+    return _buckets[key]
+
+def _coalesce(notification: dict) -> bool:
+    '''
+    Apply rate limiting to a message (internal)
+    returns TRUE if the message can be sent now, FALSE if it is held for a summary
+    '''
+    if not rate_limit or notification['priority'] == Priority.HIGHEST:
+        return True
+    topic_key = (notification['topic'], notification['rabbit'])
+    kind_key = (notification['topic'], notification['rabbit'], notification['tags'], notification['title'])
+    with _coalesce_lock:
+        if kind_key in _held:
+            _held[kind_key].append(notification)
+            metrics.increment('notifications.coalesced')
+            return False
+        topic_bucket = _get_bucket(topic_key, topic_burst, topic_per_minute)
+        kind_bucket = _get_bucket(kind_key, tags_burst, tags_per_minute)
+        if topic_bucket.available() and kind_bucket.available():
+            topic_bucket.take()
+            kind_bucket.take()
+            return True
+        _held[kind_key] = [notification]
+    metrics.increment('notifications.coalesced')
+    logs.debug('Rate limit reached, holding similar notifications for {}s: {}'.format(coalesce_window, notification['message']))
+    Thread(target=_coalesce_thread, args=[kind_key], name='Ntfy coalescing').start()
+    return False
+
+def _coalesce_thread(kind_key: tuple):
+    '''
+    Send held messages as a single summary at the end of the coalescing window (internal thread)
+    '''
+    time.sleep(coalesce_window)
+    with _coalesce_lock:
+        held = _held.pop(kind_key)
+    summary = dict(held[-1])
+    if len(held) > 1:
+        messages = []
+        for notification in held:
+            if not notification['message'] in messages:
+                messages.append(notification['message'])
+        summary['message'] = '{}\n({} notifications en {}s)'.format('\n'.join(messages[-10:]), len(held), coalesce_window)
+        summary['priority'] = min([notification['priority'] for notification in held],
+            key=lambda priority: _PRIORITY_RANK.get(priority, _PRIORITY_RANK[Priority.NORMAL]))
+        # Keep the most recent attachment, e.g. latest photo from a burst
+        for notification in reversed(held):
+            if notification['attachment'] is not None:
+                summary['attachment'] = notification['attachment']
+                summary['filename'] = notification['filename']
+                break
+        metrics.increment('notifications.merged', len(held) - 1)
+    _enqueue(summary)
+
+def flush():
+    '''
+    Save pending messages to disk so that they are delivered after restart
+    '''
+    count = _spool_all()
+    if count > 0:
+        logs.info('Spooled {} pending notifications'.format(count))
+
+def publish(message, title=None, priority=None, tags=None, topic=None, rabbit=None, synchronous=False, auto_trim=True, attachment=None, filename=None, coalesce=True):
     '''
     Publish a phone notification using ntfy
     message: Notification message, up to 4095 characters, or 2047 when an attachment is set (see auto_trim parameter).
@@ -89,28 +371,37 @@ def publish(message, title=None, priority=None, tags=None, topic=None, rabbit=No
     auto_trim: (optional) Auto trim long messages to fit in size limit. Beyond the limit, server may auto-convert long messages to attachments or reject the request.
     attachment: (optional) Attach a file to the notification. Can be bytes or file-like object.
     filename: (optional) Attachment file name, e.g. 'image.png'. If missing, file name is assigned by the server.
+    coalesce: (optional) Apply rate limiting: similar messages sent too often are merged into a summary. HIGHEST priority is never limited.
     '''
     logs.info('{}: {} (title: {}, priority: {}, tags: {}, rabbit: {})'.format('Publishing' if enabled else 'Would publish if enabled', message, title, priority, tags, rabbit))
     if enabled:
+        if attachment is not None and not isinstance(attachment, bytes):
+            attachment = attachment.read()
+        notification = {
+            'message': message,
+            'title': title,
+            'priority': priority,
+            'tags': tags,
+            'topic': topic,
+            'rabbit': rabbit,
+            'auto_trim': auto_trim,
+            'attachment': attachment,
+            'filename': filename,
+        }
+        if coalesce and not _coalesce(notification):
+            return
         if synchronous:
-            _publish(message,
-                title=title,
-                priority=priority,
-                tags=tags,
-                topic=topic,
-                rabbit=rabbit,
-                auto_trim=auto_trim,
-                attachment=attachment,
-                filename=filename)
+            start_time = time.time()
+            try:
+                _publish(**notification)
+                metrics.record('notifications.request', (time.time() - start_time) * 1000)
+                metrics.increment('notifications.sent')
+            except Exception:
+                _enqueue(notification, queued_time=start_time) # Retry in background
+                raise
         else:
-            _request_thread = Thread(target=_publish, args=[message], kwargs={
-                    'title': title,
-                    'priority': priority,
-                    'tags':tags,
-                    'topic': topic,
-                    'rabbit': rabbit,
-                    'auto_trim': auto_trim,
-                    'attachment': attachment,
-                    'filename': filename
-                }, name='Ntfy request')
-            _request_thread.start()
+            _enqueue(notification)
+
+if enabled:
+    _load_spool()
+    Thread(target=_delivery_thread, name='Ntfy delivery').start()
@@ -12,6 +12,7 @@ from enum import Enum
 
 import datastore
 import enocean
+import homestate
 import rabbits
 
 from logs import logs
@@ -169,16 +170,17 @@ def _enocean_callback(sender_name: str, contact_event: object):
         with _data_lock:
             _is_closed[opening_name] = closed
             datastore.set(_DATASTORE_IS_CLOSED, _is_closed)
+        homestate.touch('openings')
         event_handler.dispatch(opening_name, _bool_to_openstate(closed), get_shutter_from_opening(opening_name), get_rabbit_from_opening(opening_name), opening_name == _front_door)
 
 enocean.contact_event_handler.subscribe(_enocean_callback)
 
 # === HTTP API ===
 
-openings_api = Blueprint('openings_api', __name__)
-
-@openings_api.route('/api/v1/openings', methods = ['GET'])
-def openings_api_get():
+def _api_state() -> dict:
+    '''
+    Get state of all openings for HTTP API and home state snapshot
+    '''
     openings = {}
     for opening in _opening_to_device:
         closed = _is_closed.get(opening, None)
@@ -188,4 +190,12 @@ def openings_api_get():
             openings[opening] = 'closed'
         else:
             openings[opening] = 'open'
-    return jsonify(openings)
+    return openings
+
+homestate.register('openings', _api_state)
+
+openings_api = Blueprint('openings_api', __name__)
+
+@openings_api.route('/api/v1/openings', methods = ['GET'])
+def openings_api_get():
+    return jsonify(_api_state())
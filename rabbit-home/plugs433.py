@@ -16,6 +16,9 @@ from configparser import ConfigParser
 
 from logs import logs
 
+import homestate
+import radio
+
 _devices = {}
 _device_state = {}
 _device_hidden = {}
@@ -23,7 +26,6 @@ _state_lock = Lock()
 
 _DEVICE_COMMAND="codesend"
 _SEND_COMMAND_DELAY=0.1
-_command_lock = Lock()
 
 config = ConfigParser()
 config.read('config/plugs433.ini')
@@ -77,6 +79,19 @@ def _calculate_code(channel: str, unit: str, on: bool) -> int:
     binary_code = binary_code + ('1' if on else '0')
     return int(binary_code, 2)
 
+def _send_radio_command(command_code: str):
+    '''
+    Send a 433MHz code using codesend (internal, from transmitter thread)
+    '''
+    try:
+        subprocess.run([_DEVICE_COMMAND, command_code], stdout=subprocess.DEVNULL)
+    except OSError as os_error:
+        logs.error('Error running command: {} {}'.format(_DEVICE_COMMAND, command_code))
+        logs.error(os_error)
+
+# Minimum delay between 2 commands
+_transmitter = radio.Transmitter('plugs433', _send_radio_command, _SEND_COMMAND_DELAY)
+
 def _switch(device: str, state: bool, sends: int = 3, delay_seconds: int = 1):
     '''
     Switch a 433MHz plug (internal)
@@ -98,15 +113,15 @@ def _switch(device: str, state: bool, sends: int = 3, delay_seconds: int = 1):
         state_str, device, sends, 's' if sends > 1 else ''))
     with _state_lock:
         _device_state[device] = state
+    homestate.touch('plugs')
+    command_code = str(_calculate_code(channel, unit, state))
     for i in range(sends):
-        with _command_lock:
-            command_code = str(_calculate_code(channel, unit, state))
-            try:
-                subprocess.run([_DEVICE_COMMAND, command_code], stdout=subprocess.DEVNULL)
-            except OSError as os_error:
-                logs.error('Error running command: {}'.format(_DEVICE_COMMAND, command_code))
-                logs.error(os_error)
-            time.sleep(_SEND_COMMAND_DELAY) # Minimum delay between 2 commands
+        if i == 0:
+            _transmitter.send(device, command_code)
+        else:
+            # Repeated sends only improve reliability: let other devices go first, skip if late for next repeat,
+            # and never override a more recent command for the same plug
+            _transmitter.send(device, command_code, radio.Priority.LOW, deadline_seconds=delay_seconds if delay_seconds > 0 else None, repeat=True)
         if sends > 1:
             time.sleep(delay_seconds)
             with _state_lock:
@@ -142,17 +157,31 @@ def switch(device: str, state: bool, sends: int = 3, delay_seconds: int = 1, syn
         )
         _switch_thread.start()
 
-# === HTTP API ===
+def get_all() -> list:
+    '''
+    Get all plugs
+    '''
+    return list(_devices.keys())
 
-plugs_api = Blueprint('plugs_api', __name__)
+# === HTTP API ===
 
-@plugs_api.route('/api/v1/plugs', methods = ['GET'])
-def plugs433_api_get():
+def _api_state() -> dict:
+    '''
+    Get state of all non-hidden plugs for HTTP API and home state snapshot
+    '''
     devices = {}
     for device in _devices:
         if not device in _device_hidden or not _device_hidden[device]:
             devices[device] = _device_state.get(device, None)
-    return jsonify(devices)
+    return devices
+
+homestate.register('plugs', _api_state)
+
+plugs_api = Blueprint('plugs_api', __name__)
+
+@plugs_api.route('/api/v1/plugs', methods = ['GET'])
+def plugs433_api_get():
+    return jsonify(_api_state())
 
 @plugs_api.route('/api/v1/plugs/<device>/<state>', methods = ['POST'])
 def plugs433_api_set(device, state):
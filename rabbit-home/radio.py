@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+# =======================================================================
+# radio - schedule commands sent to devices through a shared transmitter
+# By ORelio (c) 2026 - CDDL 1.0
+# =======================================================================
+
+from collections import deque
+from threading import Thread, Condition, Event
+from enum import Enum
+
+import heapq
+import itertools
+import time
+
+from logs import logs
+
+import metrics
+
+_THROUGHPUT_WINDOW_SECONDS = 60
+
+class Priority(Enum):
+    HIGH = 1
+    NORMAL = 2
+    LOW = 3
+
+class RadioCommand:
+    '''
+    Command queued for sending through a transmitter, see Transmitter.send()
+    '''
+    def __init__(self, device: str, command: str, priority: Priority, deadline: float):
+        self.device = device
+        self.command = command
+        self.priority = priority
+        self.deadline = deadline
+        self.queued_time = time.monotonic()
+        self.arrival = 0
+        self.sent = False
+        self._done = Event()
+
+    def _complete(self, sent: bool):
+        '''
+        Mark the command as sent or discarded, releasing waiting threads (internal, transmitter lock must be held)
+        '''
+        self.sent = sent
+        self._done.set()
+
+    def is_done(self) -> bool:
+        '''
+        Check if the command was sent or discarded
+        '''
+        return self._done.is_set()
+
+    def wait(self, timeout_seconds: float = None) -> bool:
+        '''
+        Wait for the command to be sent
+        returns TRUE if the command was sent, FALSE if it was discarded (replaced, expired or failed) or on timeout
+        '''
+        self._done.wait(timeout_seconds)
+        return self.sent
+
+class Transmitter:
+    '''
+    Radio transmitter shared by several devices, sending one command at a time from a dedicated thread.
+    Queued commands are sent by priority, then earliest deadline, then in order of arrival.
+    Each device has at most one pending command: a new command replaces the pending one, e.g. OPEN after CLOSE
+    cancels the CLOSE if not sent yet. A device cannot flood the queue, which makes the queue fair across devices.
+    name: Name of transmitter, for logs, thread and metrics
+    send_function: Function sending a command, called with the command string from transmitter thread
+    interval_seconds: Minimum delay between two commands, to avoid overloading receivers
+    '''
+    def __init__(self, name: str, send_function, interval_seconds: float):
+        self.name = name
+        self._send_function = send_function
+        self._interval = interval_seconds
+        self._queue = []
+        self._pending = {}
+        self._sequence = itertools.count()
+        self._sent_times = deque()
+        self._changed = Condition()
+        Thread(target=self._transmit_thread, name='Radio : {}'.format(name)).start()
+
+    def send(self, device: str, command: str, priority: Priority = Priority.NORMAL, deadline_seconds: float = None, repeat: bool = False, synchronous: bool = True) -> bool:
+        '''
+        Queue a command for sending, see queue()
+        synchronous: Wait for the command to be sent before returning
+        returns TRUE if the command was sent (or queued, if asynchronous), FALSE if it was discarded
+        '''
+        radio_command = self.queue(device, command, priority, deadline_seconds, repeat)
+        if synchronous:
+            return radio_command.wait()
+        return not radio_command.is_done() or radio_command.sent
+
+    def queue(self, device: str, command: str, priority: Priority = Priority.NORMAL, deadline_seconds: float = None, repeat: bool = False) -> RadioCommand:
+        '''
+        Queue a command for sending, without waiting for it to be sent
+        Callers holding a lock should release it before waiting on the command, so that a more recent command can replace it.
+        device: Device targeted by the command. A pending command for the same device is replaced, or merged if identical.
+        command: Command to send, passed to send function
+        priority: Priority of the command, e.g. HIGH for commands that must not be delayed
+        deadline_seconds: (optional) Discard the command if it cannot be sent within the specified delay
+        repeat: Command is a repeat of a command already sent, e.g. for reliability. A repeat is dropped instead of
+          replacing a different pending command for the same device, as the pending command is more recent.
+        returns queued command, allowing to wait for it to be sent
+        '''
+        deadline = None if deadline_seconds is None else time.monotonic() + deadline_seconds
+        with self._changed:
+            radio_command = self._pending.get(device, None)
+            if radio_command is not None and radio_command.command == command:
+                # Same command already queued: keep its place, and upgrade it if the new one is more urgent
+                key = self._get_key(radio_command)
+                if priority.value < radio_command.priority.value:
+                    radio_command.priority = priority
+                if radio_command.deadline is not None and (deadline is None or deadline > radio_command.deadline):
+                    radio_command.deadline = deadline
+                if self._get_key(radio_command) != key:
+                    self._push(radio_command)
+                metrics.increment('radio.{}.merged'.format(self.name))
+            elif radio_command is not None and repeat:
+                logs.debug('{}: Dropping repeat of "{}", "{}" is more recent'.format(self.name, command, radio_command.command))
+                metrics.increment('radio.{}.dropped'.format(self.name))
+                radio_command = RadioCommand(device, command, priority, deadline)
+                radio_command._complete(False)
+                return radio_command
+            else:
+                if radio_command is not None:
+                    logs.debug('{}: Replacing pending command "{}" with "{}"'.format(self.name, radio_command.command, command))
+                    radio_command._complete(False)
+                    metrics.increment('radio.{}.replaced'.format(self.name))
+                radio_command = RadioCommand(device, command, priority, deadline)
+                radio_command.arrival = next(self._sequence)
+                self._pending[device] = radio_command
+                self._push(radio_command)
+            metrics.set_gauge('radio.{}.queue_depth'.format(self.name), len(self._pending))
+            self._changed.notify()
+        return radio_command
+
+    def _get_key(self, radio_command: RadioCommand) -> tuple:
+        '''
+        Get sort key of a command in the priority queue (internal)
+        '''
+        deadline = float('inf') if radio_command.deadline is None else radio_command.deadline
+        return (radio_command.priority.value, deadline, radio_command.arrival)
+
+    def _push(self, radio_command: RadioCommand):
+        '''
+        Add or re-add a command to the priority queue (internal, lock must be held)
+        Outdated queue entries, left behind when a command is upgraded or replaced, are skipped by _pop()
+        '''
+        heapq.heappush(self._queue, (self._get_key(radio_command), next(self._sequence), radio_command))
+
+    def _pop(self) -> RadioCommand:
+        '''
+        Wait for the next command to send and remove it from the queue (internal, from transmitter thread)
+        '''
+        with self._changed:
+            while True:
+                while len(self._queue) == 0:
+                    self._changed.wait()
+                key, sequence, radio_command = heapq.heappop(self._queue)
+                if radio_command.is_done() or key != self._get_key(radio_command):
+                    continue
+                del self._pending[radio_command.device]
+                metrics.set_gauge('radio.{}.queue_depth'.format(self.name), len(self._pending))
+                if radio_command.deadline is not None and radio_command.deadline < time.monotonic():
+                    logs.warning('{}: Discarding command "{}", deadline exceeded'.format(self.name, radio_command.command))
+                    metrics.increment('radio.{}.expired'.format(self.name))
+                    radio_command._complete(False)
+                    continue
+                return radio_command
+
+    def _transmit_thread(self):
+        '''
+        Send queued commands one at a time, waiting for minimum interval between commands (internal thread)
+        '''
+        while True:
+            radio_command = self._pop()
+            start_time = time.monotonic()
+            metrics.record('radio.{}.queue_wait'.format(self.name), (start_time - radio_command.queued_time) * 1000)
+            sent = False
+            try:
+                self._send_function(radio_command.command)
+                sent = True
+            except Exception as e:
+                logs.error('{}: Failed to send command "{}": {}'.format(self.name, radio_command.command, e))
+                metrics.increment('radio.{}.errors'.format(self.name))
+            end_time = time.monotonic()
+            metrics.record('radio.{}.send'.format(self.name), (end_time - start_time) * 1000)
+            with self._changed:
+                radio_command._complete(sent)
+            self._sent_times.append(end_time)
+            while self._sent_times[0] < end_time - _THROUGHPUT_WINDOW_SECONDS:
+                self._sent_times.popleft()
+            metrics.set_gauge('radio.{}.throughput'.format(self.name), len(self._sent_times)) # commands per minute
+            time.sleep(self._interval)
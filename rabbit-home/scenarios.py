@@ -21,6 +21,8 @@ import pcstate
 import temperature
 import openings
 import motion
+import cameras
+import lights
 
 from events import EventHandler
 from daycycle import DaycycleState
@@ -46,6 +48,8 @@ class Event(Enum):
     OPEN_CLOSE = 14
     PC_STATE = 15
     MOTION = 16
+    CAMERA_MOTION = 17
+    LIGHT = 18
 
 _nabstate_to_event = {
     nabstate.STATE_FALLING_ASLEEP: Event.SLEEP,
@@ -214,9 +218,29 @@ def _motion_event_callback(motion_event: motion.MotionEvent):
     '''
     dispatch(Event.MOTION, rabbit=motion_event.rabbit, args={'outside': motion_event.outside})
 
+def _camera_motion_event_callback(motion_event: cameras.CameraMotionEvent):
+    '''
+    Listen to camera motion events to run camera motion events in scenarios
+    '''
+    dispatch(Event.CAMERA_MOTION, args={'camera': motion_event.camera, 'outside': motion_event.outside, 'score': motion_event.score})
+
+def _light_event_callback(light_event: lights.LightEvent):
+    '''
+    Listen to light state changes to run light events in scenarios
+    '''
+    dispatch(Event.LIGHT, rabbit=light_event.rabbit, args={
+        'light': light_event.light,
+        'on': light_event.on,
+        'brightness': light_event.brightness,
+        'white': light_event.white,
+        'external': light_event.external
+    })
+
 nabstate.event_handler.subscribe(_nabstate_event_callback)
 daycycle.event_handler.subscribe(_daycycle_event_callback)
 temperature.event_handler.subscribe(_temperature_event_callback)
 openings.event_handler.subscribe(_opening_event_callback)
 pcstate.event_handler.subscribe(_pcstate_event_callback)
 motion.event_handler.subscribe(_motion_event_callback)
+cameras.motion_event_handler.subscribe(_camera_motion_event_callback)
+lights.event_handler.subscribe(_light_event_callback)
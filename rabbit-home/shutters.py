@@ -8,16 +8,22 @@
 # By ORelio (c) 2023-2025 - CDDL 1.0
 # ===========================================================================
 
-from threading import Thread, Lock
+from threading import Thread, Lock, Condition
 from configparser import ConfigParser
+from dataclasses import dataclass
 from enum import Enum
 
+import select
 import subprocess
 import time
 
 from logs import logs
 
 import datastore
+import homestate
+import metrics
+import radio
+import timers
 
 _shutters = {}
 _shutter_locks = {}
@@ -26,7 +32,13 @@ _shutter_delay_close = {}
 _shutter_closed_offset = {}
 _shutter_delay_open = {}
 _shutter_halfway = {}
-_command_lock = Lock()
+_helper_process = None
+_helper_failures = 0
+_state_changed = Condition()
+_shutter_movement = {}
+_shutter_timer = {}
+_progress_timer = None
+_progress_lock = Lock()
 
 _SHUTTER_STATE_DATASTORE = 'shutters.state_percent'
 _shutter_state_percent = datastore.get(_SHUTTER_STATE_DATASTORE, {})
@@ -38,6 +50,12 @@ class ShutterState(Enum):
     HALF = 4
     AUTO = 5
 
+@dataclass
+class _Movement:
+    start_time: float # Time when the shutter starts moving, as time.monotonic()
+    start_percent: int
+    target_percent: int
+
 _shutter_state_to_command = {
     ShutterState.OPEN: 'on',
     ShutterState.CLOSE: 'off',
@@ -46,8 +64,14 @@ _shutter_state_to_command = {
 
 _SHUTTER_COMMAND="shuttercmd"
 _SHUTTER_ARGUMENT="{STATE} {SHUTTER}"
+_SHUTTER_HELPER_ARGUMENT="--stdin"
+_SHUTTER_HELPER_READY="READY"
+_SHUTTER_HELPER_ACK="OK"
+_SHUTTER_HELPER_MAX_FAILURES=3
+_SHUTTER_HELPER_TIMEOUT=2
 _SEND_COMMAND_DELAY=0.1
 _START_MOVING_DELAY=0.5
+_PROGRESS_INTERVAL=1
 
 config = ConfigParser()
 config.read('config/shutters.ini')
@@ -82,6 +106,7 @@ for shutter_name_raw in config.sections():
         shutter_half_open = 99
     _shutter_halfway[shutter_alias] = shutter_half_open
     _shutter_locks[shutter_alias] = Lock()
+    _shutter_thread_tokens[shutter_alias] = timers.Cancellation()
     logs.debug('Loaded shutter "{}" (name={}, close={}, offset={}, open={}, halfway={}% closed)'.format(
         shutter_alias,
         shutter_internal_name,
@@ -125,7 +150,7 @@ def get_current_state(shutter: str) -> ShutterState:
     This returns the last operated state, which may not match if the shutter was operated manually
     Returns current state or STOP if unknown
     '''
-    state_percent = _shutter_state_percent.get(shutter, None)
+    state_percent = get_current_state_percent(shutter)
     if state_percent is None:
         return ShutterState.STOP
     if state_percent <= 0:
@@ -144,6 +169,9 @@ def get_current_state_percent(shutter: str) -> int:
     This returns the last operated height, which may not match if the shutter was operated manually
     Returns current height between 0 (open) and 100 (closed) or None if unknown
     '''
+    movement = _shutter_movement.get(shutter, None)
+    if movement is not None:
+        return _get_position(shutter, movement, time.monotonic())
     state = _shutter_state_percent.get(shutter, None)
     if state is None:
         return None
@@ -153,11 +181,14 @@ def get_current_state_percent(shutter: str) -> int:
         return 100
     return state
 
-def _send_command(shutter: str, state: ShutterState):
+def _send_command(shutter: str, state: ShutterState, priority: radio.Priority = radio.Priority.NORMAL) -> radio.RadioCommand:
     '''
-    Send command to a shutter
+    Queue command for a shutter, without waiting for the command to be sent
+    Wait on the returned command only after releasing the shutter lock, so that a more recent operation can replace it.
     shutter: Name of shutter to operate
     state: Desired shutter state
+    priority: Priority of the command over commands for other shutters
+    returns queued command, see radio.RadioCommand
     '''
     shutter = shutter.lower()
     if not shutter in _shutters:
@@ -165,49 +196,239 @@ def _send_command(shutter: str, state: ShutterState):
     if not state in _shutter_state_to_command:
         raise ValueError('Unknwon internal command for ShutterState "{}"'.format(state, shutter))
     state = _shutter_state_to_command[state]
-    shutter = _shutters[shutter]
-    logs.debug('Setting state {} to shutter {}'.format(state.upper(), shutter))
-    with _command_lock:
-        subprocess.run([
-            _SHUTTER_COMMAND,
-            _SHUTTER_ARGUMENT.replace('{STATE}', state).replace('{SHUTTER}', shutter)
-        ])
-        time.sleep(_SEND_COMMAND_DELAY) # Avoid overloading shutters with too many commands in a row
-
-def _send_command_from_thread(shutter: str, state: str, thread_token: int):
-    '''
-    Send command to a shutter, acquiring lock and validating thread token
+    logs.debug('Setting state {} to shutter {}'.format(state.upper(), _shutters[shutter]))
+    return _transmitter.queue(shutter, _SHUTTER_ARGUMENT.replace('{STATE}', state).replace('{SHUTTER}', _shutters[shutter]), priority)
+
+def _is_helper_supported() -> bool:
+    '''
+    Check if shuttercmd supports persistent mode, from its usage message (internal)
+    Older builds would send "--stdin" as a command, while running shuttercmd without arguments does not send anything.
+    '''
+    try:
+        result = subprocess.run([_SHUTTER_COMMAND], capture_output=True, text=True, timeout=_SHUTTER_HELPER_TIMEOUT)
+        return _SHUTTER_HELPER_ARGUMENT in result.stdout
+    except (OSError, subprocess.SubprocessError) as e:
+        logs.debug('Failed to check {} usage: {}'.format(_SHUTTER_COMMAND, e))
+        return False
+
+def _read_from_helper() -> str:
+    '''
+    Read a line from the persistent shuttercmd process, without blocking the transmitter if it hangs (internal)
+    returns line without line break, or None on timeout or error
+    '''
+    try:
+        ready, _, _ = select.select([_helper_process.stdout], [], [], _SHUTTER_HELPER_TIMEOUT)
+        if len(ready) == 0:
+            logs.debug('shuttercmd helper did not respond within {}s'.format(_SHUTTER_HELPER_TIMEOUT))
+            return None
+        return _helper_process.stdout.readline().strip()
+    except (OSError, ValueError) as e:
+        logs.debug('shuttercmd helper error: {}'.format(e))
+        return None
+
+def _start_helper() -> bool:
+    '''
+    Start the persistent shuttercmd process and wait for it to open the serial port (internal, from transmitter thread)
+    returns TRUE if the helper is ready to receive commands
+    '''
+    global _helper_process
+    try:
+        _helper_process = subprocess.Popen([_SHUTTER_COMMAND, _SHUTTER_HELPER_ARGUMENT],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1)
+        metrics.increment('shutters.helper_starts')
+    except OSError as e:
+        logs.debug('Failed to start shuttercmd helper: {}'.format(e))
+        _helper_process = None
+        return False
+    if _read_from_helper() == _SHUTTER_HELPER_READY:
+        return True
+    _stop_helper()
+    return False
+
+def _stop_helper():
+    '''
+    Kill the persistent shuttercmd process, and switch to one process per command after too many failures (internal)
+    '''
+    global _helper_process, _helper_failures
+    if _helper_process is not None:
+        _helper_process.kill()
+        _helper_process = None
+    _helper_failures += 1
+    if _helper_failures >= _SHUTTER_HELPER_MAX_FAILURES:
+        logs.warning('{} {} not working, starting one process per command instead'.format(_SHUTTER_COMMAND, _SHUTTER_HELPER_ARGUMENT))
+
+def _send_radio_command(command: str):
+    '''
+    Send a command to the shutters, keeping a single shuttercmd process open between commands (internal, from transmitter thread)
+    Falls back to one shuttercmd process per command if the persistent mode is not supported, e.g. older shuttercmd build
+    '''
+    global _helper_failures
+    if _helper_supported and _helper_failures < _SHUTTER_HELPER_MAX_FAILURES:
+        if (_helper_process is not None and _helper_process.poll() is None) or _start_helper():
+            try:
+                _helper_process.stdin.write(command + '\n')
+                _helper_process.stdin.flush()
+            except (OSError, ValueError) as e:
+                logs.debug('shuttercmd helper error: {}'.format(e))
+                _stop_helper()
+            else:
+                if _read_from_helper() == _SHUTTER_HELPER_ACK:
+                    _helper_failures = 0
+                    return
+                # Command may have been sent already, sending it again could move the shutter twice
+                _stop_helper()
+                raise OSError('{} {} did not acknowledge command'.format(_SHUTTER_COMMAND, _SHUTTER_HELPER_ARGUMENT))
+    subprocess.run([_SHUTTER_COMMAND, command])
+
+_helper_supported = _is_helper_supported()
+
+# Avoid overloading shutters with too many commands in a row
+_transmitter = radio.Transmitter('shutters', _send_radio_command, _SEND_COMMAND_DELAY)
+
+def _send_command_from_thread(shutter: str, state: str, thread_token: timers.Cancellation, priority: radio.Priority = radio.Priority.NORMAL):
+    '''
+    Send command to a shutter, acquiring lock and validating thread token, then wait for the command to be sent
     shutter: Name of shutter to operate
     state: Desired shutter state
-    thread_token: Only send command if the current token matches the provided one
+    thread_token: Only send command if the operation was not cancelled
+    priority: Priority of the command over commands for other shutters
+    returns TRUE if the command was sent
     '''
-    if _shutter_thread_tokens[shutter] == thread_token:
-        with _shutter_locks[shutter]:
-            _send_command(shutter, state)
+    with _shutter_locks[shutter]:
+        if thread_token.is_cancelled():
+            return False
+        radio_command = _send_command(shutter, state, priority)
+    return radio_command.wait()
 
-def _update_state_percent_from_thread(shutter: str, state_percent: int, thread_token: int):
+def _update_state_percent_from_thread(shutter: str, state_percent: int, thread_token: timers.Cancellation):
     '''
     Update state (percent) of a shutter if thread token validates
     shutter: Name of shutter to operate
     state: New shutter state
-    thread_token: Only update state if the current token matches the provided one
+    thread_token: Only update state if the operation was not cancelled
     '''
     if state_percent < 0:
         state_percent = 0
     if state_percent > 100:
         state_percent = 100
 
-    if _shutter_thread_tokens[shutter] == thread_token:
-        with _shutter_locks[shutter]:
-            _shutter_state_percent[shutter] = state_percent
-            datastore.set(_SHUTTER_STATE_DATASTORE, _shutter_state_percent)
+    with _shutter_locks[shutter]:
+        if thread_token.is_cancelled():
+            return
+        _shutter_movement.pop(shutter, None)
+        _shutter_state_percent[shutter] = state_percent
+        datastore.set(_SHUTTER_STATE_DATASTORE, _shutter_state_percent)
+    with _state_changed:
+        _state_changed.notify_all()
+    homestate.touch('shutters')
+
+def _get_travel_delay(shutter: str, from_percent: int, to_percent: int) -> float:
+    '''
+    Get delay in seconds for moving a shutter between two heights, once the motor is started
+    shutter: Name of shutter
+    from_percent: Initial height from 0 (open) to 100 (fully closed)
+    to_percent: Final height from 0 (open) to 100 (fully closed)
+    '''
+    if from_percent == to_percent:
+        return 0
+    direction = ShutterState.OPEN if to_percent < from_percent else ShutterState.CLOSE
+    one_percent_delay = get_full_length_delay(shutter, direction) / 99 # steps between OPEN and 99% (closed with blades open)
+    delay = (min(max(from_percent, to_percent), 99) - min(from_percent, to_percent)) * one_percent_delay
+    if max(from_percent, to_percent) == 100:
+        delay += get_closed_offset_delay(shutter) # delay between 99% (closed with blades open) and 100% (fully closed)
+    return delay
+
+def _get_position(shutter: str, movement: _Movement, now: float) -> int:
+    '''
+    Compute height of a moving shutter from its kinematic model (internal)
+    Only fully travelled percents are counted, so the result is the height last passed by the shutter.
+    now: Current time, as time.monotonic()
+    '''
+    elapsed = now - movement.start_time
+    position = movement.start_percent
+    target = movement.target_percent
+    if elapsed <= 0 or position == target:
+        return position
+    if elapsed >= _get_travel_delay(shutter, position, target):
+        return target
+    if target > position:
+        if position == 99:
+            return 99 # still moving between 99% and 100%
+        one_percent_delay = get_full_length_delay(shutter, ShutterState.CLOSE) / 99
+        return min(position + int(elapsed / one_percent_delay), min(target, 99))
+    if position == 100:
+        if elapsed < get_closed_offset_delay(shutter):
+            return 100
+        elapsed -= get_closed_offset_delay(shutter)
+        position = 99
+    one_percent_delay = get_full_length_delay(shutter, ShutterState.OPEN) / 99
+    return max(position - int(elapsed / one_percent_delay), target)
+
+def _report_progress():
+    '''
+    Signal height changes of moving shutters to home state clients, as long as a shutter is moving (internal timer)
+    '''
+    global _progress_timer
+    with _progress_lock:
+        if len(_shutter_movement) == 0:
+            _progress_timer = None
+            return
+        _progress_timer = timers.schedule(_PROGRESS_INTERVAL, _report_progress, name='Shutter progress')
+    homestate.touch('shutters')
+
+def _start_progress_reports():
+    '''
+    Start signaling height changes of moving shutters, if not already started (internal)
+    '''
+    global _progress_timer
+    with _progress_lock:
+        if _progress_timer is None:
+            _progress_timer = timers.schedule(_PROGRESS_INTERVAL, _report_progress, name='Shutter progress')
+
+def _stop_movement(shutter: str):
+    '''
+    Forget ongoing movement of a shutter, saving the height reached so far (internal, shutter lock must be held)
+    '''
+    timer = _shutter_timer.pop(shutter, None)
+    if timer is not None:
+        timer.cancel()
+    movement = _shutter_movement.pop(shutter, None)
+    if movement is not None:
+        _shutter_state_percent[shutter] = _get_position(shutter, movement, time.monotonic())
+        datastore.set(_SHUTTER_STATE_DATASTORE, _shutter_state_percent)
+        with _state_changed:
+            _state_changed.notify_all()
+        homestate.touch('shutters')
+
+def _end_movement(shutter: str, desired_state_percent: int, thread_token: timers.Cancellation):
+    '''
+    Stop a shutter at its target height, if not already stopped by end position, and save its height (internal timer)
+    '''
+    if desired_state_percent > 0 and desired_state_percent < 100:
+        # Sent before other commands: any delay would move the shutter past its target height
+        _send_command_from_thread(shutter, ShutterState.STOP, thread_token, radio.Priority.HIGH)
+    _update_state_percent_from_thread(shutter, desired_state_percent, thread_token)
+    if not thread_token.is_cancelled():
+        logs.debug('Reached target state for {}: {}%'.format(shutter, desired_state_percent))
 
-def _move_to_state_percent(shutter: str, desired_state_percent: int, thread_token: int):
+def _end_initial_movement(shutter: str, initial_state_percent: int, desired_state_percent: int, thread_token: timers.Cancellation):
+    '''
+    Save height of a shutter that was in unknown state and reached an end position, then move to the desired height (internal timer)
+    '''
+    _update_state_percent_from_thread(shutter, initial_state_percent, thread_token)
+    if not thread_token.is_cancelled():
+        _move_to_state_percent(shutter, desired_state_percent, thread_token)
+
+def _move_to_state_percent(shutter: str, desired_state_percent: int, thread_token: timers.Cancellation):
     '''
     Operate a shutter to the desired height
+    The shutter position is modelled from start time, direction and speed, and a single timer stops the shutter at target height.
     shutter: Name of shutter to operate
     desired_state_percent: Desired height from 0 (open) to 100 (fully closed)
-    thread_token: Stop operating shutters if another operation changes the token
+    thread_token: Stop operating shutters if another operation cancels the token
     '''
     assert isinstance(desired_state_percent, int)
 
@@ -225,14 +446,15 @@ def _move_to_state_percent(shutter: str, desired_state_percent: int, thread_toke
         logs.debug('Initial state Unknown, Adjusting {} to {} ({}%)'.format(shutter, target_initial_state, target_initial_percent))
         _send_command_from_thread(shutter, target_initial_state, thread_token)
         target_initial_delay = get_full_length_delay(shutter, target_initial_state) + get_closed_offset_delay(shutter) + 1
-        if _shutter_thread_tokens[shutter] == thread_token:
-            logs.debug('Sleep: {}s (??? -> {}%)'.format(round(target_initial_delay, 3), target_initial_percent))
-        time.sleep(target_initial_delay)
-        _update_state_percent_from_thread(shutter, target_initial_percent, thread_token)
-        current_state = target_initial_percent
+        with _shutter_locks[shutter]:
+            if not thread_token.is_cancelled():
+                logs.debug('Timer: {}s (??? -> {}%)'.format(round(target_initial_delay, 3), target_initial_percent))
+                _shutter_timer[shutter] = timers.schedule(target_initial_delay, _end_initial_movement,
+                    shutter, target_initial_percent, desired_state_percent, thread_token, name='Shutter operation')
+        return
 
     if current_state == desired_state_percent:
-        if _shutter_thread_tokens[shutter] == thread_token:
+        if not thread_token.is_cancelled():
             logs.debug('Current state for {} is equal to desired state: {}%'.format(shutter, current_state))
         # Does not hurt to send command anyway for fully open/closed states, can fix desync
         if desired_state_percent == 0:
@@ -242,39 +464,72 @@ def _move_to_state_percent(shutter: str, desired_state_percent: int, thread_toke
         return
 
     direction = ShutterState.OPEN if desired_state_percent < current_state else ShutterState.CLOSE
-    one_percent_delay = get_full_length_delay(shutter, direction) / 99 # steps between OPEN and 99% (closed with blades open)
-    increment = -1 if direction == ShutterState.OPEN else 1
+    _send_command_from_thread(shutter, direction, thread_token)
+    start_time = time.monotonic() + _START_MOVING_DELAY
+    stop_delay = start_time + _get_travel_delay(shutter, current_state, desired_state_percent) - time.monotonic()
 
-    if (current_state == 100 and increment == -1) or (current_state == 99 and increment == 1):
-        first_percent_delay = get_closed_offset_delay(shutter) - _SEND_COMMAND_DELAY # delay between 99% (closed with blades open) and 100% (fully closed)
-    else:
-        first_percent_delay = one_percent_delay - _SEND_COMMAND_DELAY
+    with _shutter_locks[shutter]:
+        if not thread_token.is_cancelled():
+            logs.debug('Timer: {}s ({}% -> {}%)'.format(round(stop_delay, 3), current_state, desired_state_percent))
+            _shutter_movement[shutter] = _Movement(start_time, current_state, desired_state_percent)
+            _start_progress_reports()
+            _shutter_timer[shutter] = timers.schedule(stop_delay, _end_movement,
+                shutter, desired_state_percent, thread_token, name='Shutter operation')
+    homestate.touch('shutters')
+
+def _is_fine_tunable(shutter: str) -> bool:
+    '''
+    Check if a shutter has calibration data for moving it to any desired height (internal)
+    '''
+    return shutter in _shutter_delay_close \
+       and shutter in _shutter_closed_offset \
+       and shutter in _shutter_delay_open \
+       and shutter in _shutter_halfway
 
-    _send_command_from_thread(shutter, direction, thread_token)
-    first_percent_delay = (first_percent_delay if first_percent_delay > 0 else 0) + _START_MOVING_DELAY
-    if _shutter_thread_tokens[shutter] == thread_token:
-        logs.debug('Sleep: {}s ({}% -> {}%)'.format(round(first_percent_delay, 3), current_state, current_state + increment))
-    time.sleep(first_percent_delay)
-
-    while True:
-        current_state += increment
-        _update_state_percent_from_thread(shutter, current_state, thread_token)
-        if current_state == desired_state_percent:
-            break
-        if (current_state == 100 and increment == -1) or (current_state == 99 and increment == 1):
-            if _shutter_thread_tokens[shutter] == thread_token:
-                logs.debug('Sleep: {}s ({}% -> {}%)'.format(round(get_closed_offset_delay(shutter), 2), current_state, current_state + increment))
-            time.sleep(get_closed_offset_delay(shutter)) # delay between 99% (closed with blades open) and 100% (fully closed)
-        else:
-            if _shutter_thread_tokens[shutter] == thread_token:
-                logs.debug('Sleep: {}s ({}% -> {}%)'.format(round(one_percent_delay, 3), current_state, current_state + increment))
-            time.sleep(one_percent_delay)
+def _get_desired_state_percent(shutter: str, state: ShutterState, target_half_state: int) -> int:
+    '''
+    Get target height of a fine-tunable shutter for the desired state (internal)
+    '''
+    if state == ShutterState.OPEN:
+        return 0
+    if state == ShutterState.CLOSE:
+        return 100
+    if state == ShutterState.HALF and target_half_state is None:
+        return get_halfway_percent(shutter)
+    return target_half_state
 
-    if _shutter_thread_tokens[shutter] == thread_token:
-        logs.debug('Reached target state for {}: {}%'.format(shutter, desired_state_percent))
+def _replace_token(shutter: str) -> timers.Cancellation:
+    '''
+    Replace token, cancelling any ongoing operation, and save height reached so far (internal, shutter lock must be held)
+    returns token for the new operation
+    '''
+    _shutter_thread_tokens[shutter].cancel()
+    thread_token = timers.Cancellation()
+    _shutter_thread_tokens[shutter] = thread_token
+    _stop_movement(shutter)
+    return thread_token
 
-    if current_state > 0 and current_state < 100:
-        _send_command_from_thread(shutter, ShutterState.STOP, thread_token)
+def _get_estimated_delay(shutter: str, desired_state_percent: int) -> float:
+    '''
+    Estimate delay in seconds for a fine-tunable shutter to reach the desired height, once the command is sent (internal)
+    '''
+    current_state = get_current_state_percent(shutter)
+    if current_state is None:
+        # Initial movement to fully open/closed state, see _move_to_state_percent()
+        initial_state = ShutterState.OPEN if desired_state_percent <= 50 else ShutterState.CLOSE
+        current_state = 0 if initial_state == ShutterState.OPEN else 100
+        return get_full_length_delay(shutter, initial_state) + get_closed_offset_delay(shutter) + 1 \
+            + _START_MOVING_DELAY + _get_travel_delay(shutter, current_state, desired_state_percent)
+    return _START_MOVING_DELAY + _get_travel_delay(shutter, current_state, desired_state_percent)
+
+def _run_plan(plan: list):
+    '''
+    Start movements of a plan one after another, from a single thread (internal thread)
+    Each start command is sent as soon as the previous one is out, then a timer stops the shutter at target height.
+    plan: list of (shutter, desired_state_percent, thread_token)
+    '''
+    for shutter, desired_state_percent, thread_token in plan:
+        _move_to_state_percent(shutter, desired_state_percent, thread_token)
 
 def operate(shutter: str, state: ShutterState, target_half_state = None) -> bool:
     '''
@@ -291,27 +546,15 @@ def operate(shutter: str, state: ShutterState, target_half_state = None) -> bool
     if state == ShutterState.AUTO:
         raise ValueError('State "AUTO" is supported through shutters_auto.operate()')
 
+    radio_command = None
     with _shutter_locks[shutter]:
-        # Update token, which will cancel any ongoing operation
-        thread_token = round(time.time() * 1000)
-        if _shutter_thread_tokens.get(shutter, 0) == thread_token:
-            thread_token -= 1;
-        _shutter_thread_tokens[shutter] = thread_token
+        thread_token = _replace_token(shutter)
 
         # Fine-tunable shutter: movable to any desired height
-        if shutter in _shutter_delay_close \
-           and shutter in _shutter_closed_offset \
-           and shutter in _shutter_delay_open \
-           and shutter in _shutter_halfway:
-            desired_state_percent = target_half_state
-            if state == ShutterState.HALF and target_half_state is None:
-                desired_state_percent = get_halfway_percent(shutter)
-            if state == ShutterState.OPEN:
-                desired_state_percent = 0
-            if state == ShutterState.CLOSE:
-                desired_state_percent = 100
+        if _is_fine_tunable(shutter):
+            desired_state_percent = _get_desired_state_percent(shutter, state, target_half_state)
             if state == ShutterState.STOP:
-                _send_command(shutter, state)
+                radio_command = _send_command(shutter, state)
                 logs.info('Stopping shutter {} ({}%)'.format(shutter, get_current_state_percent(shutter)))
             else:
                 t = Thread(target=_move_to_state_percent, args=[shutter, desired_state_percent, thread_token], name='Shutter operation')
@@ -323,7 +566,7 @@ def operate(shutter: str, state: ShutterState, target_half_state = None) -> bool
                 logs.error('Cannot set {} to HALF: No length/offset in config'.format(shutter))
                 return False
             else:
-                _send_command(shutter, state)
+                radio_command = _send_command(shutter, state)
                 if state == ShutterState.OPEN:
                     _shutter_state_percent[shutter] = 0
                 elif state == ShutterState.CLOSE:
@@ -331,5 +574,61 @@ def operate(shutter: str, state: ShutterState, target_half_state = None) -> bool
                 else:
                     _shutter_state_percent[shutter] = None
                 datastore.set(_SHUTTER_STATE_DATASTORE, _shutter_state_percent)
+                with _state_changed:
+                    _state_changed.notify_all()
+                homestate.touch('shutters')
+
+    # Wait outside lock, so that another operation can replace the command before it is sent
+    if radio_command is not None:
+        radio_command.wait()
+    return True
 
+def operate_many(targets: dict) -> bool:
+    '''
+    Operate several shutters at once, e.g. all shutters of the house
+    Movements are planned from calibration data and started from a single thread, longest movement first,
+    so that all shutters reach their target height shortly after the slowest shutter would on its own.
+    targets: dict mapping shutter name to (state: ShutterState, target_half_state: int or None)
+    returns TRUE if successful
+    '''
+    plan = []
+    success = True
+    for shutter, (state, target_half_state) in targets.items():
+        shutter = shutter.lower()
+        if not shutter in _shutters:
+            raise ValueError('Unknown shutter: ' + str(shutter))
+        if state == ShutterState.AUTO:
+            raise ValueError('State "AUTO" is supported through shutters_auto.operate()')
+        if state == ShutterState.STOP or not _is_fine_tunable(shutter):
+            # Single command, no movement to plan
+            success = operate(shutter, state, target_half_state) and success
+            continue
+        with _shutter_locks[shutter]:
+            thread_token = _replace_token(shutter)
+        desired_state_percent = min(max(_get_desired_state_percent(shutter, state, target_half_state), 0), 100)
+        plan.append((_get_estimated_delay(shutter, desired_state_percent), shutter, desired_state_percent, thread_token))
+    if len(plan) > 0:
+        plan.sort(key=lambda step: step[0], reverse=True)
+        # Start commands are sent at regular intervals by the transmitter, see radio.py
+        completion_delay = max(i * _SEND_COMMAND_DELAY + step[0] for i, step in enumerate(plan))
+        logs.info('Operating {} shutters, estimated completion in {}s'.format(len(plan), round(completion_delay, 1)))
+        Thread(target=_run_plan, args=[[step[1:] for step in plan]], name='Shutter operation plan').start()
+    return success
+
+def wait_for_state_percent(shutter: str, state_percent: int, timeout_seconds: float) -> bool:
+    '''
+    Wait until a shutter reaches the specified height, without polling
+    shutter: Name of shutter
+    state_percent: Height to wait for, from 0 (open) to 100 (closed)
+    timeout_seconds: Maximum delay to wait
+    returns TRUE if the shutter reached the specified height
+    '''
+    shutter = shutter.lower()
+    deadline = time.monotonic() + timeout_seconds
+    with _state_changed:
+        while _shutter_state_percent.get(shutter, None) != state_percent:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            _state_changed.wait(remaining)
     return True
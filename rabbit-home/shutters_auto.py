@@ -15,13 +15,14 @@ from temperature import TemperatureEventType
 from openings import OpenState
 from logs import logs
 
+import homestate
 import rabbits
 import nabstate
 import shutters
 import openings
 import daycycle
 import temperature
-import time
+import timers
 
 # == Shutter presets parsing and handling ==
 
@@ -150,16 +151,29 @@ class ShutterPreset:
         '''
         For the specified list of presets, find the one matching the specified conditions most closely.
         '''
-        if len(presets) > 0:
-            matching = [item for item in presets if item.matches(dayphase, season, temp)]
+        matching = [item for item in presets if item.matches(dayphase, season, temp)]
+        if len(matching) > 0:
             matching.sort(reverse=True)
             return matching[0]
         return None
 
+    def compile_table(presets: list) -> dict:
+        '''
+        For the specified list of presets, find the most appropriate one for every combination of conditions.
+        returns dict mapping (dayphase, season, temp) to preset, or to None if no preset matches
+        '''
+        table = dict()
+        for dayphase in DaycycleState:
+            for season in Season:
+                for temp in TemperatureEventType:
+                    table[(dayphase, season, temp)] = ShutterPreset.find_most_appropriate(presets, dayphase, season, temp)
+        return table
+
 # == Load configuration ==
 
 _shutter_to_rabbit = dict()
 _shutter_to_presets = dict()
+_shutter_to_preset_table = dict()
 
 _defective_shutter = dict()
 _defective_shutter_lock = dict()
@@ -184,10 +198,14 @@ for section in config.sections():
             preset = ShutterPreset(key, val)
             logs.debug('[{}/{}] {}'.format(shutter, key, preset))
             _shutter_to_presets[shutter].append(preset)
+    try:
+        _shutter_to_preset_table[shutter] = ShutterPreset.compile_table(_shutter_to_presets[shutter])
+    except ValueError as e:
+        raise ValueError('Invalid presets for "{}": {}'.format(shutter, e))
     _defective_shutter[shutter] = config.getboolean(section, 'defective', fallback=False)
     if _defective_shutter[shutter]:
         _defective_shutter_lock[shutter] = Lock()
-        _defective_shutter_token[shutter] = 0
+        _defective_shutter_token[shutter] = timers.Cancellation()
 logs.debug('Loaded {} shutters: {}'.format(
     len(_shutter_to_presets), ', '.join(list(_shutter_to_presets.keys()))))
 
@@ -214,33 +232,35 @@ def adjust_shutters(current_rabbit: str = None, shutter_name: str = None, overri
     '''
     if current_rabbit:
         current_rabbit = rabbits.get_name(current_rabbit)
+    targets = {}
     for shutter in _shutter_to_presets:
         if shutter_name is None or shutter == shutter_name:
             if ((current_rabbit is None or current_rabbit == _shutter_to_rabbit[shutter]) \
               and (override_sleep or not nabstate.is_sleeping(_shutter_to_rabbit[shutter]))) \
               and openings.get_current_state(shutter=shutter) != OpenState.OPEN:
-                operate(shutter, state)
+                targets[shutter] = (state, None)
+    operate_many(targets)
 
-def _operate_defective_from_thread(shutter: str, state: ShutterState, target_half_state: int, thread_token: int):
+def _operate_defective_from_thread(shutter: str, state: ShutterState, target_half_state: int, thread_token: timers.Cancellation):
     '''
     Operate a defective shutter, acquiring lock and validating thread token
     shutter: Target shutter
     state: Desired shutter state
     target_half_state: Override height for HALF state from 0 (open) to 100 (closed)
-    thread_token: Only send command if the current token matches the provided one
+    thread_token: Only send command if the operation was not cancelled
     '''
-    if _defective_shutter_token[shutter] == thread_token:
+    if not thread_token.is_cancelled():
         with _defective_shutter_lock[shutter]:
             return shutters.operate(shutter, state, target_half_state)
 
-def _operate_defective(shutter: str, state: ShutterState, target_half_state: int, thread_token: int):
+def _operate_defective(shutter: str, state: ShutterState, target_half_state: int, thread_token: timers.Cancellation):
     '''
     Operate a shutter that often blocks itself askew when going down from fully OPEN state
     Work around this defect by doing small, repetitive forward-backward moves
     shutter: Target shutter
     state: Desired final shutter state
     target_half_state: Override height for HALF state from 0 (open) to 100 (closed)
-    thread_token: Stop operating if another operation changes the token
+    thread_token: Stop operating if another operation cancels the token
     '''
     if target_half_state is None:
         if state == ShutterState.OPEN:
@@ -259,22 +279,47 @@ def _operate_defective(shutter: str, state: ShutterState, target_half_state: int
         # Go to 0% first, going UP is safe, but going DOWN may block the shutter askew
         _operate_defective_from_thread(shutter, ShutterState.OPEN, None, thread_token)
         current_state = ShutterState.OPEN
-        while shutters.get_current_state_percent(shutter) is None \
-           or shutters.get_current_state_percent(shutter) > 0:
-            time.sleep(0.1)
+        open_delay = shutters.get_full_length_delay(shutter, ShutterState.OPEN) + shutters.get_closed_offset_delay(shutter) + 5
+        while not shutters.wait_for_state_percent(shutter, 0, timeout_seconds=open_delay):
+            if thread_token.is_cancelled():
+                return
         # Procedure to go from 0 to 30% without blocking shutters
         for i in range(8):
             _operate_defective_from_thread(shutter, ShutterState.OPEN, None, thread_token)
-            time.sleep(1.5)
+            if not thread_token.sleep(1.5):
+                return
             _operate_defective_from_thread(shutter, ShutterState.CLOSE, None, thread_token)
-            time.sleep(2)
-        # Use our token to stop ongoing operation and override the current height
-        shutters._shutter_thread_tokens[shutter] = _defective_shutter_token[shutter]
-        shutters._update_state_percent_from_thread(shutter, 30, _defective_shutter_token[shutter])
+            if not thread_token.sleep(2):
+                return
+        # Stop ongoing operation and override the current height
+        with shutters._shutter_locks[shutter]:
+            shutters._shutter_thread_tokens[shutter].cancel()
+            shutter_token = timers.Cancellation()
+            shutters._shutter_thread_tokens[shutter] = shutter_token
+        shutters._update_state_percent_from_thread(shutter, 30, shutter_token)
 
     # Safe state reached, operate normally
     _operate_defective_from_thread(shutter, state, target_half_state, thread_token)
 
+def _get_conditions() -> tuple:
+    '''
+    Get current conditions for selecting presets
+    returns (dayphase, season, temp)
+    '''
+    return (daycycle.get_state(), daycycle.get_season(), temperature.get_state_today())
+
+def _find_preset(shutter: str, conditions: tuple = None) -> ShutterPreset:
+    '''
+    Find preset matching current conditions for a shutter
+    conditions: (optional) Conditions from _get_conditions(), when operating several shutters at once
+    '''
+    if conditions is None:
+        conditions = _get_conditions()
+    dayphase, season, temp_state = conditions
+    preset = _shutter_to_preset_table[shutter][conditions]
+    logs.info('Auto-Selected state for shutter={}, dayphase={}, season={}, temperature={}: {}'.format(shutter, dayphase.name, season.name, temp_state.name, preset))
+    return preset
+
 def operate(shutter: str, state: ShutterState, target_half_state = None, direct_command = False) -> bool:
     '''
     Operate a shutter - with automatic special operation for defective shutters
@@ -288,18 +333,11 @@ def operate(shutter: str, state: ShutterState, target_half_state = None, direct_
 
     # Operate all shutters at once?
     if shutter == 'all':
-        success = True
-        for shutter in _shutter_to_presets:
-            success = success and operate(shutter, state, target_half_state)
-        return success
+        return operate_many({shutter: (state, target_half_state) for shutter in _shutter_to_presets})
 
     # Auto determine state using presets?
     if state == ShutterState.AUTO:
-        dayphase = daycycle.get_state()
-        season = daycycle.get_season()
-        temp_state = temperature.get_state_today()
-        preset = ShutterPreset.find_most_appropriate(_shutter_to_presets[shutter], dayphase=dayphase, season=season, temp=temp_state)
-        logs.info('Auto-Selected state for shutter={}, dayphase={}, season={}, temperature={}: {}'.format(shutter, dayphase.name, season.name, temp_state.name, preset))
+        preset = _find_preset(shutter)
         if preset is None:
             return False
         state = preset.state
@@ -308,7 +346,8 @@ def operate(shutter: str, state: ShutterState, target_half_state = None, direct_
     # Operate a shutter that may block itself askew?
     if _defective_shutter[shutter]:
         # Neutralize any running thread for defective shutter
-        _defective_shutter_token[shutter] = round(time.time() * 1000)
+        _defective_shutter_token[shutter].cancel()
+        _defective_shutter_token[shutter] = timers.Cancellation()
         if direct_command:
             # Direct control by the user using wall switch
             if state == ShutterState.HALF:
@@ -328,36 +367,87 @@ def operate(shutter: str, state: ShutterState, target_half_state = None, direct_
     else:
         return shutters.operate(shutter, state, target_half_state)
 
+def operate_many(targets: dict) -> bool:
+    '''
+    Operate several shutters at once - movements of normal shutters are planned together, see shutters.operate_many()
+    targets: dict mapping shutter name to (state: ShutterState, target_half_state: int or None)
+    returns TRUE if successful
+    '''
+    success = True
+    planned_targets = {}
+    conditions = None
+    for shutter, (state, target_half_state) in targets.items():
+        shutter = shutter.lower()
+        if state == ShutterState.AUTO:
+            if conditions is None:
+                conditions = _get_conditions()
+            preset = _find_preset(shutter, conditions)
+            if preset is None:
+                success = False
+                continue
+            state = preset.state
+            target_half_state = preset.percent
+        if _defective_shutter[shutter]:
+            success = operate(shutter, state, target_half_state) and success
+        else:
+            planned_targets[shutter] = (state, target_half_state)
+    if len(planned_targets) > 0:
+        success = shutters.operate_many(planned_targets) and success
+    return success
+
+def get_all() -> list:
+    '''
+    Get all shutters managed by shutters_auto
+    '''
+    return list(_shutter_to_presets.keys())
+
+def str2state(state: str) -> tuple:
+    '''
+    Convert state from HTTP API (open/close/stop/half/auto or height in percent) to shutter state
+    raises ValueError for invalid state
+    returns (state: ShutterState, percent: int) with percent set to None if not applicable
+    '''
+    if not state or (not state.upper() in [member.name for member in ShutterState] and not state.isdigit()):
+        raise ValueError('Invalid shutter state: {}'.format(state))
+    if state.isdigit():
+        percent = int(state)
+        if percent < 0 or percent > 100:
+            raise ValueError('Invalid shutter height: {}'.format(state))
+        if percent == 0:
+            return ShutterState.OPEN, None
+        elif percent == 100:
+            return ShutterState.CLOSE, None
+        else:
+            return ShutterState.HALF, percent
+    return ShutterState[state.upper()], None
+
 # === HTTP API ===
 
+def _api_state() -> dict:
+    '''
+    Get state of all shutters for HTTP API and home state snapshot
+    '''
+    result = {}
+    for shutter in _shutter_to_presets:
+        result[shutter] = shutters.get_current_state_percent(shutter)
+    return result
+
+homestate.register('shutters', _api_state)
+
 shutters_api = Blueprint('shutters_api', __name__)
 
 @shutters_api.route('/api/v1/shutters', methods = ['GET'])
 def shutters_api_get():
-    result = {}
-    for shutter in _shutter_to_presets:
-        result[shutter] = shutters.get_current_state_percent(shutter)
-    return jsonify(result)
+    return jsonify(_api_state())
 
 @shutters_api.route('/api/v1/shutters/<shutter>/<state>', methods = ['POST'])
 def shutters_api_set(shutter: str, state: str):
     if not shutter or not shutter.lower() in _shutter_to_presets:
         return jsonify({'success': False, 'message': 'Not Found'}), 404
-    if not state or (not state.upper() in [member.name for member in ShutterState] and not state.isdigit()):
-        return jsonify({'success': False, 'message': 'Invalid parameter'}), 400
-    if state.isdigit() and (int(state) < 0 or int(state) > 100):
+    try:
+        state, percent = str2state(state)
+    except ValueError:
         return jsonify({'success': False, 'message': 'Invalid parameter'}), 400
     shutter = shutter.lower()
-    percent = None
-    if state.isdigit():
-        percent = int(state)
-        if percent == 0:
-            state = ShutterState.OPEN
-        elif percent == 100:
-            state = ShutterState.CLOSE
-        else:
-            state = ShutterState.HALF
-    else:
-        state = ShutterState[state.upper()]
     operate(shutter, state, percent)
     return jsonify({'success': True})
@@ -17,6 +17,7 @@ from events import EventHandler
 from logs import logs
 
 import enocean
+import homestate
 import rabbits
 import weather
 import sensorhealth
@@ -296,6 +297,7 @@ def enocean_callback(sender_name: str, event: object):
         with _last_temperature_time_lock:
             _last_temperature_value[device] = temperature
             _last_temperature_time[device] = time.time()
+        homestate.touch('temperature')
         if outside:
             _last_temperature_outside = temperature
         event_handler.dispatch(TemperatureEvent(TemperatureEventType.DATA, temperature, sensor, rabbit, outside))
@@ -330,10 +332,10 @@ _forecast_monitoring_thread.start()
 
 # === HTTP API ===
 
-temperature_api = Blueprint('temperature_api', __name__)
-
-@temperature_api.route('/api/v1/temperature', methods = ['GET'])
-def temperature_api_get():
+def _api_state() -> dict:
+    '''
+    Get last temperature of all sensors for HTTP API and home state snapshot
+    '''
     device_info = {}
     with _last_temperature_time_lock:
         for device in _device_to_name:
@@ -341,4 +343,12 @@ def temperature_api_get():
                 'temperature': _last_temperature_value.get(device, None),
                 'time': _last_temperature_time.get(device, None),
             }
-    return jsonify(device_info)
+    return device_info
+
+homestate.register('temperature', _api_state)
+
+temperature_api = Blueprint('temperature_api', __name__)
+
+@temperature_api.route('/api/v1/temperature', methods = ['GET'])
+def temperature_api_get():
+    return jsonify(_api_state())
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+# ===================================================================
+# timelapse - archive periodic camera frames for time-lapse playback
+# By ORelio (c) 2026 - CDDL 1.0
+# ===================================================================
+
+from configparser import ConfigParser
+from datetime import datetime, date, timedelta
+from flask import Blueprint, Response, jsonify, request
+from threading import Lock
+
+import bisect
+import cv2
+import math
+import os
+import re
+import struct
+import time
+
+from logs import logs
+
+# Each day of each camera is stored as two append-only files:
+#  YYYY-MM-DD.jpg: JPEG frames, concatenated
+#  YYYY-MM-DD.idx: One fixed-size record per frame: timestamp, offset and length in the .jpg file
+_INDEX_RECORD = struct.Struct('<dQI')
+_CAMERA_NAME_PATTERN = re.compile('^[a-z0-9_-]+$')
+_DAY_PATTERN = re.compile('^([0-9]{4}-[0-9]{2}-[0-9]{2})\\.(jpg|idx)$')
+_MAX_PLAYBACK_FPS = 30
+
+config = ConfigParser()
+config.read('config/timelapse.ini')
+_path = config.get('Timelapse', 'Path', fallback='cache/timelapse')
+_retention_days = config.getint('Timelapse', 'RetentionDays', fallback=7)
+_width = config.getint('Timelapse', 'Width', fallback=640)
+_quality = config.getint('Timelapse', 'Quality', fallback=60)
+_max_streams = config.getint('Timelapse', 'MaxStreams', fallback=2)
+if _retention_days < 1:
+    raise ValueError('Invalid RetentionDays: {}'.format(_retention_days))
+if _max_streams < 1:
+    raise ValueError('Invalid MaxStreams: {}'.format(_max_streams))
+logs.debug('Loaded timelapse config (Path={}, RetentionDays={}, Width={}, Quality={}, MaxStreams={})'.format(_path, _retention_days, _width, _quality, _max_streams))
+
+_camera_locks = {}
+_camera_locks_lock = Lock()
+_camera_last_day = {}
+_stream_count = 0
+_stream_count_lock = Lock()
+
+def _get_lock(camera: str) -> Lock:
+    '''
+    Get write lock for a camera archive (internal)
+    '''
+    with _camera_locks_lock:
+        if not camera in _camera_locks:
+            _camera_locks[camera] = Lock()
+        return _camera_locks[camera]
+
+def _day_path(camera: str, day: date, extension: str) -> str:
+    '''
+    Get path of a day file for a camera (internal)
+    '''
+    return os.path.join(_path, camera, '{}.{}'.format(day.isoformat(), extension))
+
+def _check_camera(camera: str) -> str:
+    '''
+    Validate camera name for use in file paths (internal)
+    '''
+    camera = camera.lower()
+    if not _CAMERA_NAME_PATTERN.match(camera):
+        raise ValueError('Invalid camera name for time-lapse: {}'.format(camera))
+    return camera
+
+def _evict(camera: str):
+    '''
+    Delete days older than retention delay for a camera (internal)
+    '''
+    oldest = (date.today() - timedelta(days=_retention_days - 1)).isoformat()
+    directory = os.path.join(_path, camera)
+    for filename in os.listdir(directory):
+        match = _DAY_PATTERN.match(filename)
+        if match and match.group(1) < oldest:
+            os.remove(os.path.join(directory, filename))
+            logs.debug('Evicted time-lapse file for camera {}: {}'.format(camera, filename))
+
+def append_frame(camera: str, timestamp: float, frame):
+    '''
+    Downscale, encode and append a frame to the archive of a camera
+    camera: Name of camera
+    timestamp: Capture time of the frame
+    frame: Frame as numpy array, as returned by cv2
+    '''
+    camera = _check_camera(camera)
+    height, width = frame.shape[:2]
+    if width > _width:
+        frame = cv2.resize(frame, (_width, round(height * _width / width)), interpolation=cv2.INTER_AREA)
+    ret, jpg = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), _quality])
+    if not ret:
+        logs.error('Failed to encode time-lapse frame for camera: {}'.format(camera))
+        return
+    day = datetime.fromtimestamp(timestamp).date()
+    with _get_lock(camera):
+        os.makedirs(os.path.join(_path, camera), exist_ok=True)
+        if _camera_last_day.get(camera, None) != day:
+            _camera_last_day[camera] = day
+            _evict(camera)
+        # Frame data is written before its index record, so that the index never points to missing data
+        with open(_day_path(camera, day, 'jpg'), 'ab') as data_file:
+            offset = data_file.tell()
+            data_file.write(jpg.tobytes())
+        with open(_day_path(camera, day, 'idx'), 'ab') as index_file:
+            index_file.write(_INDEX_RECORD.pack(timestamp, offset, len(jpg)))
+
+def _read_index(camera: str, day: date) -> list:
+    '''
+    Read index of a day for a camera (internal)
+    returns list of (timestamp, offset, length), sorted by timestamp
+    '''
+    try:
+        with open(_day_path(camera, day, 'idx'), 'rb') as index_file:
+            data = index_file.read()
+    except FileNotFoundError:
+        return []
+    # Ignore incomplete record, in case of interrupted write
+    data = data[:len(data) - (len(data) % _INDEX_RECORD.size)]
+    return sorted(_INDEX_RECORD.iter_unpack(data))
+
+def get_frames(camera: str, start: float, end: float):
+    '''
+    Iterate over archived frames of a camera in a time range, reading frames one at a time from disk
+    camera: Name of camera
+    start: Start of range (timestamp)
+    end: End of range (timestamp)
+    yields (timestamp: float, jpg: bytes)
+    '''
+    camera = _check_camera(camera)
+    day = datetime.fromtimestamp(start).date()
+    last_day = datetime.fromtimestamp(end).date()
+    while day <= last_day:
+        index = _read_index(camera, day)
+        if len(index) > 0:
+            position = bisect.bisect_left([record[0] for record in index], start)
+            with open(_day_path(camera, day, 'jpg'), 'rb') as data_file:
+                for timestamp, offset, length in index[position:]:
+                    if timestamp > end:
+                        return
+                    data_file.seek(offset)
+                    yield timestamp, data_file.read(length)
+        day += timedelta(days=1)
+
+def get_summary() -> dict:
+    '''
+    Get archived days for all cameras
+    returns dict mapping camera name to dict mapping day (YYYY-MM-DD) to amount of frames
+    '''
+    summary = {}
+    if os.path.isdir(_path):
+        for camera in sorted(os.listdir(_path)):
+            if _CAMERA_NAME_PATTERN.match(camera) and os.path.isdir(os.path.join(_path, camera)):
+                summary[camera] = {}
+                for filename in sorted(os.listdir(os.path.join(_path, camera))):
+                    match = _DAY_PATTERN.match(filename)
+                    if match and match.group(2) == 'idx':
+                        size = os.path.getsize(os.path.join(_path, camera, filename))
+                        summary[camera][match.group(1)] = size // _INDEX_RECORD.size
+    return summary
+
+# === HTTP API ===
+
+timelapse_api = Blueprint('timelapse_api', __name__)
+
+@timelapse_api.route('/api/v1/timelapse', methods = ['GET'])
+def timelapse_api_get():
+    return jsonify(get_summary())
+
+@timelapse_api.route('/api/v1/timelapse/<camera>', methods = ['GET'])
+def timelapse_api_stream(camera: str):
+    '''
+    Stream a time-lapse as MJPEG (multipart/x-mixed-replace), viewable in a browser
+    Query parameters: start and end as timestamps (default: last 24 hours), fps (default: 10)
+    '''
+    global _stream_count
+    try:
+        camera = _check_camera(camera)
+        end = float(request.args.get('end', time.time()))
+        start = float(request.args.get('start', end - 86400))
+        fps = float(request.args.get('fps', 10))
+        # Timestamps are converted to dates once streaming has started, too late for reporting an out of range value
+        if math.isfinite(start) and math.isfinite(end):
+            datetime.fromtimestamp(start)
+            datetime.fromtimestamp(end)
+    except (ValueError, OverflowError, OSError):
+        return jsonify({'success': False, 'message': 'Invalid parameter'}), 400
+    if not all(math.isfinite(value) for value in [start, end, fps]) or start > end or fps <= 0 or fps > _MAX_PLAYBACK_FPS:
+        return jsonify({'success': False, 'message': 'Invalid parameter'}), 400
+    if not os.path.isdir(os.path.join(_path, camera)):
+        return jsonify({'success': False, 'message': 'Not Found'}), 404
+    # Each stream holds a server worker thread during playback, leave enough threads for other requests
+    # Slot is reserved right away so that simultaneous requests cannot exceed the limit
+    with _stream_count_lock:
+        if _stream_count >= _max_streams:
+            return jsonify({'success': False, 'message': 'Too many time-lapse streams'}), 503
+        _stream_count += 1
+    def stream():
+        for timestamp, jpg in get_frames(camera, start, end):
+            yield b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: ' + str(len(jpg)).encode('ascii') + b'\r\n\r\n' + jpg + b'\r\n'
+            time.sleep(1.0 / fps)
+    def release():
+        global _stream_count
+        with _stream_count_lock:
+            _stream_count -= 1
+    response = Response(stream(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    response.call_on_close(release) # Called once when the response is closed, whether streaming started or not
+    return response
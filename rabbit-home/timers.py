@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+# ======================================================================
+# timers - cancellable delays and scheduled callbacks without busy-waits
+# By ORelio (c) 2026 - CDDL 1.0
+# ======================================================================
+
+from threading import Thread, Condition, Event
+
+import heapq
+import itertools
+import time
+
+from logs import logs
+
+class Cancellation:
+    '''
+    Cancellation flag shared between a long-running operation and whoever may cancel it.
+    Replaces polling of thread tokens: waiting threads do not wake up until the delay elapses or the operation is cancelled.
+    '''
+    def __init__(self):
+        self._event = Event()
+
+    def cancel(self):
+        '''
+        Cancel the operation, waking up any thread sleeping on this cancellation
+        '''
+        self._event.set()
+
+    def is_cancelled(self) -> bool:
+        '''
+        Check if the operation was cancelled
+        '''
+        return self._event.is_set()
+
+    def sleep(self, delay_seconds: float) -> bool:
+        '''
+        Sleep for the specified delay but stop early if the operation is cancelled
+        returns TRUE if the delay elapsed, FALSE if the operation was cancelled
+        '''
+        if delay_seconds > 0:
+            return not self._event.wait(delay_seconds)
+        return not self._event.is_set()
+
+class Timer:
+    '''
+    Handle for a callback scheduled using schedule()
+    '''
+    def __init__(self, deadline: float, callback, args: list, kwargs: dict, name: str):
+        self.deadline = deadline
+        self.name = name
+        self._callback = callback
+        self._args = args
+        self._kwargs = kwargs
+        self._cancelled = False
+
+    def cancel(self):
+        '''
+        Cancel the callback, if not already fired
+        '''
+        self._cancelled = True
+
+    def is_cancelled(self) -> bool:
+        '''
+        Check if the callback was cancelled
+        '''
+        return self._cancelled
+
+    def _fire(self):
+        '''
+        Run the callback on a dedicated thread (internal, from scheduler thread)
+        '''
+        if not self._cancelled:
+            Thread(target=self._callback, args=self._args, kwargs=self._kwargs, name=self.name).start()
+
+# Scheduled timers, as a heap of (deadline, sequence, timer)
+_timers = []
+_sequence = itertools.count()
+_timers_changed = Condition()
+_scheduler_thread = None
+
+def _scheduler_loop():
+    '''
+    Sleep until the earliest deadline and fire due timers (internal thread)
+    '''
+    while True:
+        due = []
+        with _timers_changed:
+            while len(_timers) == 0:
+                _timers_changed.wait()
+            now = time.monotonic()
+            while len(_timers) > 0 and _timers[0][0] <= now:
+                due.append(heapq.heappop(_timers)[2])
+            if len(due) == 0:
+                _timers_changed.wait(_timers[0][0] - now)
+        for timer in due:
+            try:
+                timer._fire()
+            except RuntimeError as e:
+                logs.error('Failed to start timer "{}": {}'.format(timer.name, e))
+
+def schedule(delay_seconds: float, callback, *args, name: str = 'Timer', **kwargs) -> Timer:
+    '''
+    Schedule a callback to run after the specified delay, without a thread waiting for it meanwhile
+    All timers share a single scheduler thread. Callbacks run on their own thread, so they may block.
+    delay_seconds: Delay before running the callback, with millisecond precision
+    callback: Function to call, with the specified arguments
+    name: Name of the callback thread, for logs
+    returns Timer handle, allowing to cancel the callback
+    '''
+    global _scheduler_thread
+    deadline = time.monotonic() + max(0, delay_seconds)
+    timer = Timer(deadline, callback, args, kwargs, name)
+    with _timers_changed:
+        if _scheduler_thread is None:
+            # Daemon thread: pending timers must not keep the process alive
+            _scheduler_thread = Thread(target=_scheduler_loop, name='Timer scheduler', daemon=True)
+            _scheduler_thread.start()
+        heapq.heappush(_timers, (deadline, next(_sequence), timer))
+        if _timers[0][2] is timer:
+            _timers_changed.notify()
+    return timer
@@ -16,6 +16,8 @@ import time
 from logs import logs
 from daycycle import _latitude, _longitude, is_day
 
+import homestate
+
 _lock = Lock()
 _last_refresh = None
 _last_refresh_hour = None
@@ -50,6 +52,7 @@ def _refresh_forecast():
                 _last_forecast_cache.today_forecast['T']['min'],
                 _last_forecast_cache.nearest_forecast['T']['value'],
                 _last_forecast_cache.today_forecast['T']['max']))
+            homestate.touch('weather')
         except:
             logs.error('Failed to refresh forecast, API seems unreachable.')
             last_midnight = datetime.now().replace(hour=0, minute=0, second=0).timestamp()
@@ -107,18 +110,27 @@ _refresh_forecast()
 
 # === HTTP API ===
 
-weather_api = Blueprint('weather_api', __name__)
-
-@weather_api.route('/api/v1/weather', methods = ['GET'])
-def weather_api_get():
+def _api_state() -> dict:
+    '''
+    Get weather forecast for HTTP API and home state snapshot
+    '''
     forecast = get_daily_forecast()
     today = None
     if forecast:
         today = forecast.pop(0)
         today['current'] = get_current_temperature()
-    return jsonify({
+    return {
         'is_day': is_day(),
         'today': today,
         'forecast': forecast,
         'refreshed': _last_refresh,
-    })
+    }
+
+# Rebuild regularly: day/night state changes over time, and forecast cache expires every hour
+homestate.register('weather', _api_state, max_age=300)
+
+weather_api = Blueprint('weather_api', __name__)
+
+@weather_api.route('/api/v1/weather', methods = ['GET'])
+def weather_api_get():
+    return jsonify(_api_state())
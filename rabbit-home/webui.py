@@ -6,18 +6,132 @@
 # ======================================
 
 from configparser import ConfigParser
-from flask import Blueprint, send_from_directory
+from flask import Blueprint, Response, request
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+
+from logs import logs
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 config = ConfigParser()
 config.read('config/webui.ini')
 enabled = config.getboolean('WebUI', 'enabled')
 path = config.get('WebUI', 'path')
 
+_ROOT_DIR = 'webui'
+_COMPRESSIBLE_EXTENSIONS = ['.html', '.css', '.js', '.svg', '.json', '.txt']
+_CACHE_IMMUTABLE = 'public, max-age=31536000, immutable'
+_CACHE_REVALIDATE = 'no-cache'
+
+class StaticAsset:
+    '''
+    Static file kept in memory, along with precompressed variants
+    '''
+    def __init__(self, file_path: str, content: bytes):
+        '''
+        Create a static asset
+        file_path: Path relative to webui directory, e.g. css/index.css
+        content: File content, after rewriting references to other assets
+        '''
+        self.file_path = file_path
+        self.mimetype = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+        self.fingerprint = hashlib.sha1(content).hexdigest()[:16]
+        self.variants = {'identity': content}
+        if os.path.splitext(file_path)[1].lower() in _COMPRESSIBLE_EXTENSIONS:
+            compressed = gzip.compress(content, compresslevel=9, mtime=0)
+            if len(compressed) < len(content):
+                self.variants['gzip'] = compressed
+            if brotli is not None:
+                compressed = brotli.compress(content, quality=11)
+                if len(compressed) < len(content):
+                    self.variants['br'] = compressed
+
+    def __repr__(self):
+        return 'StaticAsset(path={}, fingerprint={}, variants={})'.format(
+            self.file_path, self.fingerprint, ','.join(
+                ['{}:{}'.format(encoding, len(data)) for encoding, data in self.variants.items()]))
+
+_assets = dict()
+
+def _fingerprint_references(file_path: str, content: bytes) -> bytes:
+    '''
+    Append fingerprint of already loaded assets to references found in HTML or CSS file
+    file_path: Path of the HTML or CSS file relative to webui directory
+    content: File content
+    returns content with references rewritten as e.g. css/index.css?v=<fingerprint>
+    '''
+    base_dir = os.path.dirname(file_path)
+    def rewrite(match):
+        reference = match.group(2)
+        target = os.path.normpath(os.path.join(base_dir, reference)).replace(os.sep, '/')
+        if target in _assets and not '?' in reference and not ':' in reference:
+            return '{}{}?v={}{}'.format(match.group(1), reference, _assets[target].fingerprint, match.group(3))
+        return match.group(0)
+    text = content.decode('utf-8')
+    text = re.sub(r'((?:src|href)=")([^"]+)(")', rewrite, text)
+    text = re.sub(r'(url\(["\']?)([^"\')]+)(["\']?\))', rewrite, text)
+    return text.encode('utf-8')
+
+def _load_assets():
+    '''
+    Load, fingerprint and precompress all files from the webui directory
+    Files referenced by CSS are loaded before CSS, and CSS/JS before HTML, so that references carry final fingerprints
+    '''
+    files = []
+    for directory, subdirectories, filenames in os.walk(_ROOT_DIR):
+        for filename in filenames:
+            files.append(os.path.relpath(os.path.join(directory, filename), _ROOT_DIR).replace(os.sep, '/'))
+    load_order = lambda file_path: {'.css': 1, '.html': 2}.get(os.path.splitext(file_path)[1].lower(), 0)
+    for file_path in sorted(files, key=load_order):
+        with open(os.path.join(_ROOT_DIR, file_path), 'rb') as file:
+            content = file.read()
+        if load_order(file_path) > 0:
+            content = _fingerprint_references(file_path, content)
+        _assets[file_path] = StaticAsset(file_path, content)
+    logs.debug('Loaded {} static files ({} bytes, brotli {})'.format(
+        len(_assets), sum([len(asset.variants['identity']) for asset in _assets.values()]),
+        'enabled' if brotli is not None else 'unavailable'))
+
+def _serve_asset(asset: StaticAsset) -> Response:
+    '''
+    Serve an in-memory asset, using the best precompressed variant accepted by the client
+    Fingerprinted URLs are cached forever by clients, other URLs are revalidated using ETag
+    '''
+    encoding = 'identity'
+    for candidate in ['br', 'gzip']:
+        if candidate in asset.variants and candidate in request.accept_encodings:
+            encoding = candidate
+            break
+    response = Response(asset.variants[encoding], mimetype=asset.mimetype)
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    if len(asset.variants) > 1:
+        response.vary.add('Accept-Encoding')
+    response.set_etag('{}-{}'.format(asset.fingerprint, encoding))
+    if request.args.get('v', None) == asset.fingerprint:
+        response.headers['Cache-Control'] = _CACHE_IMMUTABLE
+    else:
+        response.headers['Cache-Control'] = _CACHE_REVALIDATE
+    return response.make_conditional(request)
+
+if enabled:
+    _load_assets()
+
 web_ui = Blueprint('web_ui', __name__)
 
 @web_ui.route(path)
 @web_ui.route(path + '<path:file_path>')
 def serve_ui(file_path = 'index.html'):
     if enabled:
-        return send_from_directory('webui', file_path)
+        if file_path in _assets:
+            return _serve_asset(_assets[file_path])
+        return 'Not Found', 404
     return 'Forbidden', 403
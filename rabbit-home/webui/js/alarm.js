@@ -22,7 +22,7 @@ var Alarm = {
     },
 
     RefreshStatus: function() {
-        window.API.GET('/api/v1/alarm', function(result) {
+        window.API.GETState('/api/v1/alarm', function(result) {
             var alarm_status = document.getElementById('alarm_status')
             if (alarm_status.alt.length == 0) {
                 // initial build
@@ -43,7 +43,7 @@ var Alarm = {
             document.getElementById('alarm_status_detail').innerText = Alarm.Status2Text(result.detail);
         });
 
-        Tools.ApiToTable(API.GET, '/api/v1/openings', 'all_openings', 'opening_',
+        Tools.ApiToTable(API.GETState, '/api/v1/openings', 'all_openings', 'opening_',
             function(item_name, item_data, item_node, initial_build) {
                 if (initial_build) {
                     var name_div = item_node.getElementsByTagName('div')[0];
@@ -70,7 +70,7 @@ var Alarm = {
             }
         , 1 /* element per row */);
 
-        Tools.ApiToTable(API.GET, '/api/v1/cameras', 'all_alarm_elements', 'camera_',
+        Tools.ApiToTable(API.GETState, '/api/v1/cameras', 'all_alarm_elements', 'camera_',
             function(item_name, item_data, item_node, initial_build) {
                 if (initial_build) {
                     var item_type = document.createElement('div');
@@ -107,7 +107,7 @@ var Alarm = {
             }
         , 3 /* element per row */);
 
-        Tools.ApiToTable(API.GET, '/api/v1/motion', 'all_alarm_elements', 'motion_sensor_',
+        Tools.ApiToTable(API.GETState, '/api/v1/motion', 'all_alarm_elements', 'motion_sensor_',
             function(item_name, item_data, item_node, initial_build) {
                 if (initial_build) {
                     var item_type = document.createElement('div');
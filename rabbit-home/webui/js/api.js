@@ -92,6 +92,136 @@ var API = {
         xhr.send(body_json);
     },
 
+    /**
+     * Last snapshot retrieved from /api/v1/state, see GETState()
+     */
+    State: {
+        Data: null,
+        ETag: null,
+        PendingCallbacks: null,
+    },
+
+    /**
+     * Live updates pushed by /api/v1/events, see SubscribeLive()
+     */
+    Live: {
+        Source: null,
+        Callbacks: [],
+    },
+
+    /**
+     * Check if live updates are currently received, in which case API.State.Data is kept up to date by the server
+     */
+    IsLive: function() {
+        return API.Live.Source !== null && API.Live.Source.readyState === 1 && API.State.Data !== null;
+    },
+
+    /**
+     * Subscribe to live updates pushed by the server (Server-Sent Events)
+     * The callback is called without arguments each time the state changes, and can read state using GETState()
+     * @param {function(): void} callback Callback to call on state changes
+     * @returns {boolean} False if live updates are not supported by the browser
+     */
+    SubscribeLive: function(callback) {
+        if (typeof window.EventSource === 'undefined') {
+            return false;
+        }
+        API.Live.Callbacks.push(callback);
+        if (API.Live.Source === null) {
+            var on_message = function(message) {
+                var data = null;
+                try {
+                    data = JSON.parse(message.data);
+                } catch (exception) {
+                    Tools.LogError('/api/v1/events sent invalid JSON: ' + message.data);
+                    return;
+                }
+                if (message.type === 'state' || API.State.Data === null) {
+                    API.State.Data = data;
+                } else {
+                    for (var section in data) {
+                        API.State.Data[section] = data[section];
+                    }
+                }
+                API.State.ETag = null;
+                for (var i = 0; i < API.Live.Callbacks.length; i++) {
+                    API.Live.Callbacks[i]();
+                }
+            };
+            API.Live.Source = new EventSource('/api/v1/events');
+            API.Live.Source.addEventListener('state', on_message);
+            API.Live.Source.addEventListener('delta', on_message);
+        }
+        return true;
+    },
+
+    /**
+     * Retrieve module state from the aggregated /api/v1/state endpoint
+     * Drop-in replacement for GET() on module endpoints, e.g. '/api/v1/lights' gives the 'lights' section of the snapshot.
+     * Concurrent calls share the same request, and unchanged snapshots are revalidated using ETag (304 Not Modified)
+     * When receiving live updates, state is served from memory without any request
+     * @param {string} endpoint Module API endpoint, e.g. /api/v1/lights
+     * @param {function(result): void} success_callback Callback on success containing module state
+     * @param {function(result): void} failure_callback (Optional) callback on failure containing response data or status
+     */
+    GETState: function(endpoint, success_callback, failure_callback) {
+        if (API.IsLive()) {
+            success_callback(API.State.Data[endpoint.split('/').pop()]);
+            return;
+        }
+        var pending = {
+            'section': endpoint.split('/').pop(),
+            'success_callback': success_callback,
+            'failure_callback': failure_callback
+        };
+        if (API.State.PendingCallbacks !== null) {
+            API.State.PendingCallbacks.push(pending);
+            return;
+        }
+        API.State.PendingCallbacks = [pending];
+        var state_endpoint = '/api/v1/state';
+        if (window.document.documentMode) {
+            // bypass IE11 XMLHttpRequest response caching
+            state_endpoint = state_endpoint + '?_ts=' + String(Date.now());
+        }
+        var xhr = new XMLHttpRequest();
+        xhr.open('GET', state_endpoint, true);
+        if (API.State.ETag !== null) {
+            xhr.setRequestHeader('If-None-Match', API.State.ETag);
+        }
+        xhr.onreadystatechange = function () {
+            if (xhr.readyState == 4) {
+                var callbacks = API.State.PendingCallbacks;
+                API.State.PendingCallbacks = null;
+                if (xhr.status == 200) {
+                    try {
+                        API.State.Data = JSON.parse(xhr.responseText);
+                        API.State.ETag = xhr.getResponseHeader('ETag');
+                    } catch (parse_exception) {
+                        Tools.LogError(state_endpoint + ' returned 200 OK but response body is not JSON: ' + xhr.responseText);
+                    }
+                }
+                for (var i = 0; i < callbacks.length; i++) {
+                    if ((xhr.status == 200 || xhr.status == 304) && API.State.Data !== null) {
+                        try {
+                            callbacks[i].success_callback(API.State.Data[callbacks[i].section]);
+                        } catch (exception) {
+                            Tools.LogError(state_endpoint + ' section ' + callbacks[i].section + ': success_callback() failed: ' + exception);
+                        }
+                    } else if (xhr.status >= 400 || xhr.status == 0) {
+                        if (typeof callbacks[i].failure_callback === 'function') {
+                            callbacks[i].failure_callback(xhr.responseText);
+                        }
+                    }
+                }
+                if (xhr.status >= 400) {
+                    Tools.LogError(state_endpoint + ' returned code ' + xhr.status + ':\n' + xhr.responseText);
+                }
+            }
+        };
+        xhr.send(null);
+    },
+
     /**
      * Perform API GET API Request
      * Shorthand for ApiRequest('GET', endpoint, null, success_callback, failure_callback)
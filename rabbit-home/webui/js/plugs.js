@@ -7,7 +7,7 @@ var Plugs = {
     },
 
     RefreshStatus: function() {
-        Tools.ApiToTable(window.API.GET, '/api/v1/plugs', 'all_plugs', 'plug_',
+        Tools.ApiToTable(window.API.GETState, '/api/v1/plugs', 'all_plugs', 'plug_',
             function(item_name, item_data, item_node, initial_build) {
                 if (initial_build) {
                     var item_state = document.createElement('div');
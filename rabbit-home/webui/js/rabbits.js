@@ -9,6 +9,9 @@ var Rabbits = {
     LastDataChange: 0,
 
     RefreshBurst: function() {
+        if (API.IsLive()) {
+            return; // Changes are pushed by the server
+        }
         if (Rabbits.LastDataChange + 60000 > Date.now()) {
             setTimeout(Rabbits.RefreshBurst, 1000);
             setTimeout(Rabbits.RefreshStatus, 100);
@@ -16,7 +19,7 @@ var Rabbits = {
     },
 
     RefreshStatus: function() {
-        Tools.ApiToTable(window.API.GET, '/api/v1/rabbits', 'all_rabbits', 'rabbit_',
+        Tools.ApiToTable(window.API.GETState, '/api/v1/rabbits', 'all_rabbits', 'rabbit_',
             function(item_name, item_data, item_node, initial_build) {
                 if (initial_build) {
                     var item_state = document.createElement('div');
@@ -10,6 +10,9 @@ var Shutters = {
     LastDataChange: 0,
 
     RefreshBurst: function() {
+        if (API.IsLive()) {
+            return; // Changes are pushed by the server
+        }
         if (Shutters.LastDataChange + 10000 > Date.now()) {
             setTimeout(Shutters.RefreshBurst, 1000);
             setTimeout(Shutters.RefreshStatus, 100);
@@ -17,7 +20,7 @@ var Shutters = {
     },
 
     RefreshStatus: function() {
-        Tools.ApiToTable(window.API.GET, '/api/v1/shutters', 'all_shutters', 'shutter_',
+        Tools.ApiToTable(window.API.GETState, '/api/v1/shutters', 'all_shutters', 'shutter_',
             function(item_name, item_data, item_node, initial_build) {
                 if (initial_build) {
                     var item_state = document.createElement('div');
@@ -135,12 +135,21 @@ var Tools = {
 
     /**
      * Automatically call the provided refresh function every 5 minutes or the specified time interval
+     * Also call it on each live update pushed by the server, when supported by the browser
      */
     ScheduleAutoRefresh: function(callback, refresh_time) {
+        API.SubscribeLive(callback);
+        Tools.SchedulePeriodicRefresh(callback, refresh_time);
+    },
+
+    /**
+     * Call the provided refresh function every 5 minutes or the specified time interval (see ScheduleAutoRefresh)
+     */
+    SchedulePeriodicRefresh: function(callback, refresh_time) {
         if (refresh_time === undefined) {
             refresh_time = 300000; // 5 minutes
         }
         setTimeout(callback, 100);
-        setTimeout(function() { Tools.ScheduleAutoRefresh(callback, refresh_time); }, refresh_time);
+        setTimeout(function() { Tools.SchedulePeriodicRefresh(callback, refresh_time); }, refresh_time);
     },
 };
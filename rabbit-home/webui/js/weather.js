@@ -8,7 +8,7 @@ var Weather = {
     },
 
     RefreshForecast: function() {
-        window.API.GET('/api/v1/weather', function(result) {
+        window.API.GETState('/api/v1/weather', function(result) {
             if (result.today) {
                 document.getElementById('weather_today_image').src = Weather.Description2Image(result.today.description, result.is_day);
                 document.getElementById('weather_today_description').innerText = result.today.description;
@@ -37,7 +37,7 @@ var Weather = {
     },
 
     RefreshSensors: function() {
-        Tools.ApiToTable(window.API.GET, '/api/v1/temperature', 'temperature_sensors', 'temperature_',
+        Tools.ApiToTable(window.API.GETState, '/api/v1/temperature', 'temperature_sensors', 'temperature_',
             function(item_name, item_data, item_node, initial_build) {
                 if (initial_build) {
                     var item_value = document.createElement('div');
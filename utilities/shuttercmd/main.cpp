@@ -1,11 +1,31 @@
 #include <iostream>
+#include <string>
 #include "SerialPort.hpp"
 
 using namespace mn::CppLinuxSerial;
 
 int main(int argc, char *argv[])
 {
-	if (argc > 1)
+	if (argc > 1 && std::string(argv[1]) == "--stdin")
+	{
+		// Persistent mode: keep serial port open and read one command per line on stdin
+		// "READY" is written on stdout once the serial port is open, then each command is acknowledged with "OK" once written
+		SerialPort serialPort("/dev/serial/by-id/usb-1a86_USB_Serial-if00-port0", BaudRate::B_115200);
+		serialPort.Open();
+		std::cout << "READY" << std::endl;
+		std::string command;
+		while (std::getline(std::cin, command))
+		{
+			if (!command.empty())
+			{
+				serialPort.Write(command);
+				serialPort.Write("\r\n");
+			}
+			std::cout << "OK" << std::endl;
+		}
+		serialPort.Close();
+	}
+	else if (argc > 1)
 	{
 		SerialPort serialPort("/dev/serial/by-id/usb-1a86_USB_Serial-if00-port0", BaudRate::B_115200);
 		serialPort.Open();
@@ -18,5 +38,8 @@ int main(int argc, char *argv[])
 		std::cout << argv[0];
 		std::cout << " <command>";
 		std::cout << std::endl;
+		std::cout << argv[0];
+		std::cout << " --stdin";
+		std::cout << std::endl;
 	}
 }